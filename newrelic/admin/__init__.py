@@ -22,9 +22,11 @@ _builtin_plugins = [
     "local_config",
     "network_config",
     "record_deploy",
+    "run_aggregator",
     "run_program",
     "run_python",
     "server_config",
+    "startup_profile",
     "validate_config",
 ]
 
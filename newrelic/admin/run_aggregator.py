@@ -0,0 +1,55 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.admin import command, usage
+
+
+@command('run-aggregator', 'config_file',
+"""Runs the aggregator process, which connects to the data collector and
+uploads the data on behalf of agents which have aggregator mode enabled,
+such as those in the worker processes of a pre-fork web server. The agent
+configuration is loaded from <config_file>, which would normally be the
+same as used by the agents, and the aggregator listens on the Unix domain
+socket given by the aggregator.socket_path setting.""")
+def run_aggregator(args):
+    import os
+    import signal
+    import sys
+
+    if len(args) == 0:
+        usage('run-aggregator')
+        sys.exit(1)
+
+    from newrelic.config import initialize
+    from newrelic.core.aggregator import AggregatorServer
+    from newrelic.core.config import global_settings
+
+    config_file = args[0]
+    environment = os.environ.get('NEW_RELIC_ENVIRONMENT')
+
+    if config_file == '-':
+        config_file = os.environ.get('NEW_RELIC_CONFIG_FILE')
+
+    initialize(config_file, environment, ignore_errors=False)
+
+    settings = global_settings()
+
+    server = AggregatorServer(settings.aggregator.socket_path, settings)
+
+    # Process managers stop the aggregator with SIGTERM, in which case any
+    # data still held should be sent before exiting.
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.shutdown())
+
+    server.serve_forever()
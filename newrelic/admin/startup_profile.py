@@ -0,0 +1,74 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from newrelic.admin import command, usage
+
+
+@command('startup-profile', 'config_file [module ...]',
+"""Initializes the agent using the settings from <config_file> and then
+imports each of the named modules, reporting the time taken to import
+them along with the time spent in each stage of agent startup, including
+the individual instrumentation hooks triggered by the imports.""")
+def startup_profile(args):
+    import os
+    import sys
+    import time
+
+    if len(args) == 0:
+        usage('startup-profile')
+        sys.exit(1)
+
+    config_file = args[0]
+    environment = os.environ.get('NEW_RELIC_ENVIRONMENT')
+
+    if config_file == '-':
+        config_file = os.environ.get('NEW_RELIC_CONFIG_FILE')
+
+    import_costs = []
+
+    def timed_import(name):
+        if name in sys.modules:
+            import_costs.append((name, None))
+            return
+
+        start = time.perf_counter()
+        __import__(name)
+        import_costs.append((name, time.perf_counter() - start))
+
+    timed_import('newrelic.agent')
+
+    from newrelic.config import initialize
+    from newrelic.core.startup_profile import startup_timings
+
+    initialize(config_file, environment, ignore_errors=False)
+
+    for name in args[1:]:
+        timed_import(name)
+
+    width = max(len(name) for name, _ in import_costs + startup_timings())
+
+    print('Import cost (ms):')
+    print()
+
+    for name, duration in import_costs:
+        if duration is None:
+            print(f'  {name:<{width}}  (already imported)')
+        else:
+            print(f'  {name:<{width}}  {duration * 1000.0:10.3f}')
+
+    print()
+    print('Startup profile (ms):')
+    print()
+
+    for name, duration in startup_timings():
+        print(f'  {name:<{width}}  {duration * 1000.0:10.3f}')
@@ -22,6 +22,8 @@ from newrelic.core.external_node import ExternalNode
 
 
 class ExternalTrace(CatHeaderMixin, TimeTrace):
+    __slots__ = ("library", "url", "method", "params")
+
     def __init__(self, library, url, method=None, **kwargs):
         parent = kwargs.pop("parent", None)
         source = kwargs.pop("source", None)
@@ -22,6 +22,8 @@ from newrelic.core.function_node import FunctionNode
 
 
 class FunctionTrace(TimeTrace):
+    __slots__ = ("name", "group", "label", "params", "terminal", "rollup")
+
     def __init__(self, name, group=None, label=None, params=None, terminal=False, rollup=None, **kwargs):
         parent = kwargs.pop("parent", None)
         source = kwargs.pop("source", None)
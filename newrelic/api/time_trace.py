@@ -34,6 +34,37 @@ _logger = logging.getLogger(__name__)
 
 
 class TimeTrace():
+    # The attributes of every trace are held in slots rather than in the
+    # instance dictionary, as a trace is created for every span recorded.
+    # Derived trace classes should declare slots for their own attributes,
+    # but as __dict__ is retained arbitrary attributes can still be added.
+
+    __slots__ = (
+        "parent",
+        "root",
+        "child_count",
+        "children",
+        "start_time",
+        "end_time",
+        "duration",
+        "exclusive",
+        "thread_id",
+        "activated",
+        "exited",
+        "is_async",
+        "has_async_children",
+        "min_child_start_time",
+        "exc_data",
+        "should_record_segment_params",
+        "guid",
+        "agent_attributes",
+        "user_attributes",
+        "_source",
+        "_greenlet",
+        "__dict__",
+        "__weakref__",
+    )
+
     def __init__(self, parent=None, source=None):
         self.parent = parent
         self.root = None
@@ -74,7 +105,19 @@ class TimeTrace():
         return f"<{self.__class__.__name__} object at 0x{id(self):x} {dict(name=getattr(self, 'name', None))}>"
 
     def __enter__(self):
-        self.parent = parent = self.parent or current_trace()
+        cache = trace_cache()
+
+        # Where the parent has to be looked up, the thread ID used to do
+        # so is retained so the same checks for running in a greenlet or
+        # coroutine need not be repeated when saving away this trace.
+
+        parent = self.parent
+        thread_id = None
+
+        if not parent:
+            thread_id, parent = cache.current_thread_trace()
+
+        self.parent = parent
         if not parent:
             return self
 
@@ -106,8 +149,7 @@ class TimeTrace():
 
         self.start_time = time.time()
 
-        cache = trace_cache()
-        self.thread_id = cache.current_thread_id()
+        self.thread_id = cache.current_thread_id() if thread_id is None else thread_id
 
         # Push ourselves as the current node and store parent.
         try:
@@ -0,0 +1,174 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the policy used to pick the compression level,
+and optionally the compression algorithm, for payloads sent to the data
+collector when adaptive compression is enabled.
+
+The highest level is picked for which the time estimated to compress the
+payload fits within what remains of the time budget for compression in the
+current harvest, given the throughput measured for that level in previous
+harvests. A level is passed over if the payloads for the same collector
+method compressed with it have been no smaller than those compressed with
+the next lower level, as the extra time taken is then being wasted.
+
+"""
+
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LEVELS = (1, 3, 6, 9)
+
+# Level used where nothing is known about the size of a payload.
+
+DEFAULT_LEVEL = 6
+
+# Throughput in bytes per second assumed for each level until it has been
+# measured, being a conservative figure for JSON payloads. The levels of
+# zstd are not comparable with those of zlib and it is much faster at the
+# same level, so it has its own figures.
+
+DEFAULT_RATES = {1: 50e6, 3: 30e6, 6: 15e6, 9: 5e6}
+
+DEFAULT_ZSTD_RATES = {1: 300e6, 3: 200e6, 6: 80e6, 9: 50e6}
+
+# Weight given to the latest measurement when updating the history.
+
+ALPHA = 0.3
+
+# How much smaller payloads must be for a higher level to be worthwhile.
+
+MIN_IMPROVEMENT = 0.02
+
+
+def zstd_available():
+    return zstandard is not None
+
+
+def nearest_level(level):
+    """Returns the level from those picked between which is closest to the
+    given compression level, with the default level used if none is given.
+
+    """
+
+    if not level or level < 0:
+        return DEFAULT_LEVEL
+
+    return min(LEVELS, key=lambda candidate: (abs(candidate - level), candidate))
+
+
+def compressobj(method, level):
+    """Returns a compressor with compress() and flush() methods for the
+    content encoding and compression level.
+
+    """
+
+    if method == "zstd":
+        return zstandard.ZstdCompressor(level=level if level and level > 0 else 3).compressobj()
+
+    wbits = 31 if method == "gzip" else 15
+    return zlib.compressobj(level or zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, wbits)
+
+
+class AdaptiveCompression():
+
+    """Picks the compression level for each payload and records how well
+    the payload compressed. Instances are shared by the threads sending
+    data for a harvest so updates are done under a lock.
+
+    """
+
+    def __init__(self, method="gzip", time_budget=1.0, zstd=False):
+        if zstd and zstd_available():
+            method = "zstd"
+
+        self.method = method
+        self._time_budget = time_budget
+        self._spent = 0.0
+        self._ratios = {}
+        self._rates = dict(DEFAULT_ZSTD_RATES if method == "zstd" else DEFAULT_RATES)
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def expected_size(self, name, default=None):
+        """Returns the uncompressed size of the last payload sent for the
+        collector method, for when the payload is compressed as it is
+        produced and its size isn't yet known.
+
+        """
+
+        return self._sizes.get(name, default)
+
+    def choose(self, name, size):
+        """Returns the compression level to use for a payload of the given
+        uncompressed size for the collector method.
+
+        """
+
+        with self._lock:
+            remaining = self._time_budget - self._spent
+            ratios = self._ratios.get(name, {})
+            rates = self._rates
+
+            for index in range(len(LEVELS) - 1, 0, -1):
+                level = LEVELS[index]
+
+                if size / rates[level] > remaining:
+                    continue
+
+                lower = LEVELS[index - 1]
+                if level in ratios and lower in ratios and ratios[level] > ratios[lower] * (1.0 - MIN_IMPROVEMENT):
+                    continue
+
+                return level
+
+        return LEVELS[0]
+
+    def record(self, name, level, size, compressed_size, elapsed):
+        """Records the result of compressing a payload, which counts
+        against the time budget for the current harvest. How well a level
+        performed is only recorded for the levels which are picked between.
+
+        """
+
+        if not size:
+            return
+
+        with self._lock:
+            self._spent += elapsed
+            self._sizes[name] = size
+
+            if level not in self._rates:
+                return
+
+            ratios = self._ratios.setdefault(name, {})
+
+            ratio = compressed_size / size
+            previous = ratios.get(level)
+            ratios[level] = ratio if previous is None else previous + ALPHA * (ratio - previous)
+
+            if elapsed > 0.0:
+                rate = size / elapsed
+                self._rates[level] += ALPHA * (rate - self._rates[level])
+
+    def reset_budget(self):
+        """Restores the full time budget at the end of a harvest."""
+
+        with self._lock:
+            self._spent = 0.0
@@ -12,15 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
 import os
+import socket
+import struct
 import sys
+import threading
 import time
-import zlib
 from pprint import pprint
 
 import newrelic.packages.urllib3 as urllib3
 from newrelic import version
 from newrelic.common import certs
+from newrelic.common.adaptive_compression import compressobj, nearest_level
 from newrelic.common.encoding_utils import (
     json_decode,
     json_encode,
@@ -43,6 +47,8 @@ except ImportError:
         return _DEFAULT_CERT_PATH
 
 
+_logger = logging.getLogger(__name__)
+
 HEADER_AUDIT_LOGGING_DENYLIST = frozenset(("x-api-key", "api-key"))
 
 
@@ -76,6 +82,11 @@ def _urllib3_ssl_recursion_workaround(wrapped, instance, args, kwargs):
 class BaseClient:
     AUDIT_LOG_ID = 0
 
+    # Whether send_request() accepts the payload as an iterable of encoded
+    # chunks as well as a byte string.
+
+    STREAMING_PAYLOADS = False
+
     def __init__(
         self,
         host,
@@ -94,6 +105,10 @@ class BaseClient:
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
         default_content_encoding_header="Identity",
+        max_connections=1,
+        shared_connections=False,
+        http2=False,
+        adaptive_compression=None,
     ):
         self._audit_log_fp = audit_log_fp
 
@@ -110,12 +125,21 @@ class BaseClient:
         pass
 
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(params, payload_size, body, compression_time):
+        pass
+
+    @staticmethod
+    def _supportability_compression(method, level, payload_size, compressed_size):
         pass
 
     @classmethod
-    def log_request(cls, fp, method, url, params, payload, headers, body=None, compression_time=None):
-        cls._supportability_request(params, payload, body, compression_time)
+    def log_request(
+        cls, fp, method, url, params, payload, headers, body=None, compression_time=None, payload_size=None
+    ):
+        if payload_size is None:
+            payload_size = len(payload) if payload else 0
+
+        cls._supportability_request(params, payload_size, body, compression_time)
 
         if not fp:
             return
@@ -226,7 +250,114 @@ class BaseClient:
         return 202, b""
 
 
+class Http2Response:
+    __slots__ = ("status", "headers", "data")
+
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+
+class Http2ConnectionPool:
+    """Stands in for the urllib3 connection pool to make requests using
+    HTTP/2, with all requests being multiplexed over a single connection.
+    This requires the httpx package to be installed along with its HTTP/2
+    support. Errors are raised as urllib3 exceptions so are handled the
+    same as for the urllib3 connection pool.
+
+    """
+
+    scheme = "https"
+
+    def __init__(
+        self, host, port, timeout=None, ca_certs=None, ca_cert_dir=None, cert_reqs=None, maxsize=1, **kwargs
+    ):
+        import httpx
+
+        if cert_reqs == "NONE":
+            verify = False
+        else:
+            verify = ca_certs or ca_cert_dir or True
+
+        self._httpx = httpx
+        self._client = httpx.Client(
+            http2=True,
+            base_url=f"https://{host}:{port}",
+            timeout=timeout,
+            verify=verify,
+            limits=httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize),
+        )
+
+    @staticmethod
+    def available():
+        try:
+            import h2  # noqa: F401
+            import httpx  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        self.close()
+
+    def close(self):
+        self._client.close()
+
+    def request_encode_url(self, method, url, fields=None, body=None, headers=None, **kwargs):
+        try:
+            response = self._client.request(method, url, params=fields, content=body, headers=headers)
+        except self._httpx.HTTPError as e:
+            raise urllib3.exceptions.HTTPError(e)
+
+        return Http2Response(response.status_code, response.headers, response.content)
+
+
+# Connection pools which are shared by all clients in the process which
+# connect to the same host with the same options. These are never closed
+# when a client is done with them, so connections are kept alive between
+# harvests and reused by all applications. Pools inherited from a parent
+# process are discarded, as the connections are then shared with it.
+
+_shared_connection_pools = {}
+_shared_connection_pools_lock = threading.Lock()
+_shared_connection_pools_pid = None
+
+
+def shared_connection_pool(connection_cls, host, port, **kwargs):
+    global _shared_connection_pools_pid
+
+    key = (connection_cls, host, port, repr(sorted(kwargs.items())))
+
+    with _shared_connection_pools_lock:
+        if _shared_connection_pools_pid != os.getpid():
+            _shared_connection_pools.clear()
+            _shared_connection_pools_pid = os.getpid()
+
+        pool = _shared_connection_pools.get(key)
+        if pool is None:
+            pool = _shared_connection_pools[key] = connection_cls(host, port, **kwargs)
+
+    return pool
+
+
+def close_shared_connection_pools():
+    with _shared_connection_pools_lock:
+        pools = list(_shared_connection_pools.values())
+        _shared_connection_pools.clear()
+
+    for pool in pools:
+        try:
+            pool.close()
+        except Exception:
+            pass
+
+
 class HttpClient(BaseClient):
+    STREAMING_PAYLOADS = True
     CONNECTION_CLS = urllib3.HTTPSConnectionPool
     PREFIX_SCHEME = "https://"
     BASE_HEADERS = urllib3.make_headers(keep_alive=True, accept_encoding=True, user_agent=USER_AGENT)
@@ -249,12 +380,17 @@ class HttpClient(BaseClient):
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
         default_content_encoding_header="Identity",
+        max_connections=1,
+        shared_connections=False,
+        http2=False,
+        adaptive_compression=None,
     ):
         self._host = host
         port = self._port = port
         self._compression_threshold = compression_threshold
         self._compression_level = compression_level
         self._compression_method = compression_method
+        self._adaptive_compression = adaptive_compression
         self._max_payload_size_in_bytes = max_payload_size_in_bytes
         self._audit_log_fp = audit_log_fp
         self._default_content_encoding_header = default_content_encoding_header
@@ -264,6 +400,7 @@ class HttpClient(BaseClient):
         self._headers = dict(self.BASE_HEADERS)
         self._connection_kwargs = connection_kwargs = {
             "timeout": timeout,
+            "maxsize": max_connections,
         }
         self._urlopen_kwargs = urlopen_kwargs = {}
 
@@ -310,6 +447,16 @@ class HttpClient(BaseClient):
         # Logging
         self._proxy = proxy
 
+        # HTTP/2 is only used when connecting directly to the host, and
+        # falls back to HTTP/1.1 if the backend for it isn't installed.
+
+        if http2 and self.CONNECTION_CLS.scheme == "https" and not proxy:
+            if Http2ConnectionPool.available():
+                self.CONNECTION_CLS = Http2ConnectionPool
+            else:
+                _logger.debug("HTTP/2 was requested but the httpx package with HTTP/2 support is not installed.")
+
+        self._shared_connections = shared_connections
         self._connection_attr = None
 
     @staticmethod
@@ -345,7 +492,8 @@ class HttpClient(BaseClient):
 
     def __exit__(self, exc, value, tb):
         if self._connection_attr:
-            self._connection_attr.__exit__(exc, value, tb)
+            if not self._shared_connections:
+                self._connection_attr.__exit__(exc, value, tb)
             self._connection_attr = None
 
     @property
@@ -354,14 +502,31 @@ class HttpClient(BaseClient):
             return self._connection_attr
 
         retries = urllib3.Retry(total=False, connect=None, read=None, redirect=0, status=None)
-        self._connection_attr = self.CONNECTION_CLS(
-            self._host, self._port, strict=True, retries=retries, **self._connection_kwargs
-        )
+
+        if self._shared_connections:
+            self._connection_attr = shared_connection_pool(
+                self.CONNECTION_CLS, self._host, self._port, strict=True, retries=retries, **self._connection_kwargs
+            )
+        else:
+            self._connection_attr = self.CONNECTION_CLS(
+                self._host, self._port, strict=True, retries=retries, **self._connection_kwargs
+            )
+
         return self._connection_attr
 
     def close_connection(self):
+        # The connection is closed at the end of each harvest, so this is
+        # also when the time budget for compressing payloads is restored.
+
+        if self._adaptive_compression is not None:
+            self._adaptive_compression.reset_budget()
+
+        # A shared connection pool is left open for use by other clients
+        # and by this client when next sending a request.
+
         if self._connection_attr:
-            self._connection_attr.close()
+            if not self._shared_connections:
+                self._connection_attr.close()
             self._connection_attr = None
 
     def log_request(
@@ -374,19 +539,20 @@ class HttpClient(BaseClient):
         headers,
         body=None,
         compression_time=None,
+        payload_size=None,
     ):
         if not self._prefix:
             url = f"{self.CONNECTION_CLS.scheme}://{self._host}{url}"
 
-        return super(HttpClient, self).log_request(fp, method, url, params, payload, headers, body, compression_time)
+        return super(HttpClient, self).log_request(
+            fp, method, url, params, payload, headers, body, compression_time, payload_size
+        )
 
     @staticmethod
     def _compress(data, method="gzip", level=None):
         compression_start = time.time()
-        level = level or zlib.Z_DEFAULT_COMPRESSION
-        wbits = 31 if method == "gzip" else 15
 
-        compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        compressor = compressobj(method, level)
         data = compressor.compress(data)
         data += compressor.flush()
 
@@ -394,6 +560,50 @@ class HttpClient(BaseClient):
 
         return data, compression_time
 
+    @staticmethod
+    def _compress_chunks(chunks, threshold, method="gzip", level=None):
+        """Consumes the chunks of an encoded payload, compressing them as
+        they are produced once the payload exceeds the compression
+        threshold, so that the complete uncompressed payload is never held
+        in memory. Returns the uncompressed size, the request body and the
+        compression time, which is None if the body was not compressed.
+
+        """
+
+        size = 0
+        buffered = []
+        compressor = None
+        compressed = []
+        compression_time = 0.0
+
+        for chunk in chunks:
+            size += len(chunk)
+
+            if compressor is None:
+                buffered.append(chunk)
+
+                if size <= threshold:
+                    continue
+
+                compression_start = time.time()
+                compressor = compressobj(method, level)
+                compressed.extend(compressor.compress(data) for data in buffered)
+                buffered = None
+            else:
+                compression_start = time.time()
+                compressed.append(compressor.compress(chunk))
+
+            compression_time += max(time.time(), compression_start) - compression_start
+
+        if compressor is None:
+            return size, b"".join(buffered), None
+
+        compression_start = time.time()
+        compressed.append(compressor.flush())
+        compression_time += max(time.time(), compression_start) - compression_start
+
+        return size, b"".join(compressed), compression_time
+
     def send_request(
         self,
         method="POST",
@@ -413,18 +623,66 @@ class HttpClient(BaseClient):
             merged_headers.update(headers)
         path = self._prefix + path
         body = payload
+        payload_size = None
         compression_time = None
+
+        # With adaptive compression the level is picked for each payload.
+        # Where the payload is compressed as it is produced, this is based
+        # on the size of the last payload for the same collector method,
+        # with the nearest level to that configured being used for the
+        # first such payload.
+
+        adaptive_compression = self._adaptive_compression
+        compression_name = (params and params.get("method")) or path
+
+        if adaptive_compression is not None:
+            compression_method = adaptive_compression.method
+            compression_level = None
+            if isinstance(payload, bytes):
+                compression_level = adaptive_compression.choose(compression_name, len(payload))
+            elif payload is not None:
+                expected_size = adaptive_compression.expected_size(compression_name)
+                if expected_size is None:
+                    compression_level = nearest_level(self._compression_level)
+                else:
+                    compression_level = adaptive_compression.choose(compression_name, expected_size)
+        else:
+            compression_method = self._compression_method
+            compression_level = self._compression_level
+
+        if payload is not None and not isinstance(payload, bytes):
+            if self._audit_log_fp:
+                # The audit log records the uncompressed payload, so it
+                # needs to be held in memory in full anyway.
+                body = payload = b"".join(payload)
+            else:
+                payload_size, body, compression_time = self._compress_chunks(
+                    payload,
+                    self._compression_threshold,
+                    method=compression_method,
+                    level=compression_level,
+                )
+                payload = None
+                if compression_time is not None:
+                    merged_headers["Content-Encoding"] = compression_method
+                elif self._default_content_encoding_header:
+                    merged_headers["Content-Encoding"] = self._default_content_encoding_header
         if payload is not None:
-            if len(payload) > self._compression_threshold:
+            payload_size = len(payload)
+            if payload_size > self._compression_threshold:
                 body, compression_time = self._compress(
                     payload,
-                    method=self._compression_method,
-                    level=self._compression_level,
+                    method=compression_method,
+                    level=compression_level,
                 )
-                merged_headers["Content-Encoding"] = self._compression_method
+                merged_headers["Content-Encoding"] = compression_method
             elif self._default_content_encoding_header:
                 merged_headers["Content-Encoding"] = self._default_content_encoding_header
 
+        if adaptive_compression is not None and compression_time is not None:
+            adaptive_compression.record(compression_name, compression_level, payload_size, len(body), compression_time)
+            self._supportability_compression(compression_method, compression_level, payload_size, len(body))
+
         request_id = self.log_request(
             self._audit_log_fp,
             "POST",
@@ -434,6 +692,7 @@ class HttpClient(BaseClient):
             merged_headers,
             body,
             compression_time,
+            payload_size,
         )
 
         if body and len(body) > self._max_payload_size_in_bytes:
@@ -490,6 +749,10 @@ class InsecureHttpClient(HttpClient):
         max_payload_size_in_bytes=1000000,
         audit_log_fp=None,
         default_content_encoding_header="Identity",
+        max_connections=1,
+        shared_connections=False,
+        http2=False,
+        adaptive_compression=None,
     ):
         proxy = self._parse_proxy(proxy_scheme, proxy_host, None, None, None)
         if proxy and proxy.scheme == "https":
@@ -517,21 +780,25 @@ class InsecureHttpClient(HttpClient):
             max_payload_size_in_bytes,
             audit_log_fp,
             default_content_encoding_header,
+            max_connections,
+            shared_connections,
+            http2,
+            adaptive_compression,
         )
 
 
 class SupportabilityMixin:
     @staticmethod
-    def _supportability_request(params, payload, body, compression_time):
+    def _supportability_request(params, payload_size, body, compression_time):
         # *********
         # Used only for supportability metrics. Do not use to drive business
         # logic!
-        # payload: uncompressed
+        # payload_size: uncompressed size
         # body: compressed
         agent_method = params and params.get("method")
         # *********
 
-        if agent_method and payload:
+        if agent_method and payload_size:
             # Compression was applied
             if compression_time is not None:
                 internal_metric(
@@ -545,10 +812,16 @@ class SupportabilityMixin:
                 )
             internal_metric(
                 f"Supportability/Python/Collector/{agent_method}/Output/Bytes",
-                len(payload),
+                payload_size,
             )
             # Top level metric to aggregate overall bytes being sent
-            internal_metric("Supportability/Python/Collector/Output/Bytes", len(payload))
+            internal_metric("Supportability/Python/Collector/Output/Bytes", payload_size)
+
+    @staticmethod
+    def _supportability_compression(method, level, payload_size, compressed_size):
+        # Records the choices made when adaptive compression is enabled.
+        internal_count_metric(f"Supportability/Python/Collector/Compression/{method}/Level/{level}", 1)
+        internal_metric("Supportability/Python/Collector/Compression/Ratio", compressed_size / payload_size)
 
     @staticmethod
     def _supportability_response(status, exc, connection="direct"):
@@ -676,3 +949,141 @@ class ServerlessModeClient(DeveloperModeClient):
         output = dict(self.payload)
         self.payload.clear()
         return output
+
+
+# Requests to the aggregator and its responses are sent over the socket as
+# a message made up of a JSON encoded header, which holds the request path
+# and parameters or the response status, followed by the body.
+
+_MESSAGE_LENGTHS = struct.Struct(">II")
+
+
+def _recv_exactly(sock, size):
+    chunks = []
+
+    while size:
+        chunk = sock.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed by peer.")
+        chunks.append(chunk)
+        size -= len(chunk)
+
+    return b"".join(chunks)
+
+
+def write_socket_message(sock, header, body=b""):
+    """Writes a message with a header, which must be JSON serializable, and
+    a byte string body to the socket.
+
+    """
+
+    header = json_encode(header).encode("utf-8")
+    sock.sendall(_MESSAGE_LENGTHS.pack(len(header), len(body)) + header + body)
+
+
+def read_socket_message(sock):
+    """Reads a message written by write_socket_message() from the socket,
+    returning the header and the body.
+
+    """
+
+    header_length, body_length = _MESSAGE_LENGTHS.unpack(_recv_exactly(sock, _MESSAGE_LENGTHS.size))
+    header = json_decode(_recv_exactly(sock, header_length).decode("utf-8"))
+    body = _recv_exactly(sock, body_length)
+
+    return header, body
+
+
+class AggregatorModeClient(BaseClient):
+    """Client which sends requests for the data collector to a local
+    aggregator process over a Unix domain socket. The host is the path of
+    the socket. A single connection is kept open and shared by all threads.
+
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        proxy_scheme=None,
+        proxy_host=None,
+        proxy_port=None,
+        proxy_user=None,
+        proxy_pass=None,
+        timeout=None,
+        ca_bundle_path=None,
+        disable_certificate_validation=False,
+        compression_threshold=64 * 1024,
+        compression_level=None,
+        compression_method="gzip",
+        max_payload_size_in_bytes=1000000,
+        audit_log_fp=None,
+        default_content_encoding_header="Identity",
+        max_connections=1,
+        shared_connections=False,
+        http2=False,
+        adaptive_compression=None,
+    ):
+        self._socket_path = host
+        self._timeout = timeout
+        self._audit_log_fp = audit_log_fp
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def __exit__(self, exc, value, tb):
+        self.close_connection()
+
+    def close_connection(self):
+        with self._lock:
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+
+    def _request(self, header, body):
+        if self._socket is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self._timeout)
+                sock.connect(self._socket_path)
+            except Exception:
+                sock.close()
+                raise
+            self._socket = sock
+
+        try:
+            write_socket_message(self._socket, header, body)
+            return read_socket_message(self._socket)
+        except Exception:
+            self._socket.close()
+            self._socket = None
+            raise
+
+    def send_request(
+        self,
+        method="POST",
+        path="/agent_listener/invoke_raw_method",
+        params=None,
+        headers=None,
+        payload=None,
+    ):
+        request_id = self.log_request(
+            self._audit_log_fp,
+            "POST",
+            f"unix:{self._socket_path}{path}",
+            params,
+            payload,
+            headers,
+        )
+
+        try:
+            with self._lock:
+                header, data = self._request({"path": path, "params": params}, payload or b"")
+        except (OSError, ValueError, struct.error) as e:
+            self.log_response(self._audit_log_fp, request_id, 0, None, None)
+            raise NetworkInterfaceException(e)
+
+        status = header["status"]
+
+        self.log_response(self._audit_log_fp, request_id, status, {}, data)
+
+        return status, data
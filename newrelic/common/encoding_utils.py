@@ -23,11 +23,14 @@ import hashlib
 import io
 import itertools
 import json
+import logging
 import random
 import re
 import types
 import zlib
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
+
+_logger = logging.getLogger(__name__)
 
 
 HEXDIGLC_RE = re.compile("^[0-9a-f]+$")
@@ -48,7 +51,17 @@ BASE64_DECODE_STR = getattr(base64, "decodestring", None)
 # defaults.
 
 
-def json_encode(obj, **kwargs):
+def _json_default(o):
+    if isinstance(o, bytes):
+        return o.decode("latin-1")
+    elif isinstance(o, types.GeneratorType):
+        return list(o)
+    elif hasattr(o, "__iter__"):
+        return list(iter(o))
+    raise TypeError(repr(o) + " is not JSON serializable")
+
+
+def _json_encode_kwargs(kwargs):
     _kwargs = {}
 
     # This wrapper function needs to deal with a few issues.
@@ -68,16 +81,7 @@ def json_encode(obj, **kwargs):
     # The third is eliminate white space after separators to trim the
     # size of the data being sent.
 
-    def _encode(o):
-        if isinstance(o, bytes):
-            return o.decode("latin-1")
-        elif isinstance(o, types.GeneratorType):
-            return list(o)
-        elif hasattr(o, "__iter__"):
-            return list(iter(o))
-        raise TypeError(repr(o) + " is not JSON serializable")
-
-    _kwargs["default"] = _encode
+    _kwargs["default"] = _json_default
 
     _kwargs["separators"] = (",", ":")
 
@@ -88,7 +92,11 @@ def json_encode(obj, **kwargs):
 
     _kwargs.update(kwargs)
 
-    return json.dumps(obj, **_kwargs)
+    return _kwargs
+
+
+def json_encode(obj, **kwargs):
+    return json.dumps(obj, **_json_encode_kwargs(kwargs))
 
 
 def json_decode(s, **kwargs):
@@ -98,6 +106,164 @@ def json_decode(s, **kwargs):
     return json.loads(s, **kwargs)
 
 
+# Alternative implementations which can be used for encoding the JSON
+# payloads sent to the data collector. Each backend must preserve the
+# behaviour of json_encode() in treating byte strings as Latin-1 and
+# expanding generators and other iterables into lists. The encode function
+# returns UTF-8 encoded bytes.
+
+JSONBackend = namedtuple("JSONBackend", ["name", "encode"])
+
+_json_encoder = json.JSONEncoder(**_json_encode_kwargs({}))
+
+
+def _json_backend_encode(obj):
+    return _json_encoder.encode(obj).encode("utf-8")
+
+
+JSON_BACKENDS = OrderedDict()
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    # Dataclasses and datetimes are passed through to the default handler
+    # as they are not otherwise accepted by json_encode().
+
+    _orjson_options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def _orjson_backend_encode(obj):
+        # Fall back to the json module for anything orjson cannot encode,
+        # such as integers larger than 64 bits or float subclasses, so that
+        # the result only differs from that of json_encode() in non ASCII
+        # characters not being escaped and in NaN and infinite values being
+        # encoded as null rather than as invalid JSON. As generators cannot
+        # be consumed a second time, the lists any were expanded into are
+        # kept for use by the fallback.
+
+        expanded = {}
+
+        def _default(o):
+            result = _json_default(o)
+            if not isinstance(o, bytes):
+                expanded[id(o)] = (o, result)
+            return result
+
+        try:
+            return orjson.dumps(obj, default=_default, option=_orjson_options)
+        except TypeError:
+            if not expanded:
+                return _json_backend_encode(obj)
+
+        def _fallback_default(o):
+            if id(o) in expanded:
+                return expanded[id(o)][1]
+            return _json_default(o)
+
+        return json.dumps(obj, default=_fallback_default, separators=(",", ":")).encode("utf-8")
+
+    JSON_BACKENDS["orjson"] = JSONBackend("orjson", _orjson_backend_encode)
+
+JSON_BACKENDS["json"] = JSONBackend("json", _json_backend_encode)
+
+
+def json_backend(name="auto"):
+    """Returns the JSON backend with the given name. If the name is "auto",
+    or the named backend is not available, the first available backend in
+    order of preference is returned, the json module being used if no other
+    is available.
+
+    """
+
+    backend = JSON_BACKENDS.get(name)
+
+    if backend is None:
+        if name != "auto":
+            _logger.warning("The JSON backend %r is not available. Using %r instead.", name, next(iter(JSON_BACKENDS)))
+
+        backend = next(iter(JSON_BACKENDS.values()))
+
+    return backend
+
+
+def _json_iterencode(obj, depth, item_separator, encode, batch_size=256):
+    if depth <= 0 or not isinstance(obj, (list, tuple, types.GeneratorType)):
+        yield encode(obj)
+        return
+
+    yield b"["
+
+    if depth == 1:
+        # The elements are encoded in batches, stripping the brackets from
+        # each encoded batch, to save on the overhead of encoding them one
+        # at a time.
+
+        iterator = iter(obj)
+        separator = b""
+
+        while True:
+            batch = list(itertools.islice(iterator, batch_size))
+            if not batch:
+                break
+            yield separator
+            yield encode(batch)[1:-1]
+            separator = item_separator
+
+    else:
+        first = True
+        for item in obj:
+            if first:
+                first = False
+            else:
+                yield item_separator
+            yield from _json_iterencode(item, depth - 1, item_separator, encode, batch_size)
+
+    yield b"]"
+
+
+def json_encode_chunks(obj, chunk_size=64 * 1024, max_depth=2, backend=None, **kwargs):
+    """Encodes obj as JSON in the same way as json_encode(), but yields the
+    result as a sequence of UTF-8 encoded byte strings of around chunk_size
+    bytes rather than returning it as one string. The backend used defaults
+    to the json module, which is also used if any keyword arguments are
+    supplied for it.
+
+    Lists, tuples and generators nested less than max_depth levels deep are
+    written out a few elements at a time, with generators being consumed as
+    they are encoded rather than first being expanded into a list. Anything
+    below that is encoded in one go, as the pure Python streaming encoder
+    in the json module is much slower than the C accelerated encoder.
+
+    """
+
+    if kwargs:
+        _kwargs = _json_encode_kwargs(kwargs)
+        item_separator = _kwargs["separators"][0].encode("utf-8")
+        _encode = json.JSONEncoder(**_kwargs).encode
+
+        def encode(o):
+            return _encode(o).encode("utf-8")
+
+    else:
+        item_separator = b","
+        encode = (backend or JSON_BACKENDS["json"]).encode
+
+    parts = []
+    size = 0
+
+    for part in _json_iterencode(obj, max_depth, item_separator, encode):
+        parts.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield b"".join(parts)
+            parts = []
+            size = 0
+
+    if parts:
+        yield b"".join(parts)
+
+
 # Functions for obfuscating/deobfuscating text string based on an XOR
 # cipher.
 
@@ -45,9 +45,6 @@ def doc_signature(func):
     return str(sig)
 
 
-_trace_cache = trace_cache()
-
-
 def shell_command(wrapped):
     args = inspect.getfullargspec(wrapped).args
 
@@ -358,7 +355,7 @@ class ConsoleShell(cmd.Cmd):
     def do_transactions(self):
         """ """
 
-        for item in _trace_cache.active_threads():
+        for item in trace_cache().active_threads():
             transaction, thread_id, thread_type, frame = item
             print("THREAD", item, file=self.stdout)
             if transaction is not None:
@@ -30,7 +30,9 @@ import warnings
 import newrelic
 import newrelic.core.application
 import newrelic.core.config
+from newrelic.common.agent_http import close_shared_connection_pools
 from newrelic.common.log_file import initialize_logging
+from newrelic.core.startup_profile import StartupTrace
 from newrelic.core.thread_utilization import thread_utilization_data_source
 from newrelic.samplers.cpu_usage import cpu_usage_data_source
 from newrelic.samplers.gc_data import garbage_collector_data_source
@@ -154,7 +156,8 @@ class Agent():
 
         _logger.info(f"New Relic Python Agent ({newrelic.version})")
 
-        check_environment()
+        with StartupTrace("check_environment"):
+            check_environment()
 
         if "NEW_RELIC_ADMIN_COMMAND" in os.environ:
             if settings.debug.log_agent_initialization:
@@ -391,7 +394,8 @@ class Agent():
             # the period of the timeout.
 
             if activate_session:
-                application.activate_session(self.activate_agent, timeout)
+                with StartupTrace("activate_application"):
+                    application.activate_session(self.activate_agent, timeout)
 
     @property
     def applications(self):
@@ -754,6 +758,12 @@ class Agent():
         if self._harvest_thread.is_alive():
             self._harvest_thread.join(timeout)
 
+        # Connections kept open between harvests are closed once the final
+        # harvest is complete.
+
+        if not self._harvest_thread.is_alive():
+            close_shared_connection_pools()
+
 
 def agent_instance():
     """Returns the agent object. This function should always be used and
@@ -12,15 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import logging
 import os
 
 from newrelic import version
 from newrelic.common import system_info
-from newrelic.common.agent_http import ApplicationModeClient, ServerlessModeClient
+from newrelic.common.adaptive_compression import AdaptiveCompression
+from newrelic.common.agent_http import (
+    AggregatorModeClient,
+    ApplicationModeClient,
+    ServerlessModeClient,
+)
 from newrelic.common.encoding_utils import (
+    json_backend,
     json_decode,
     json_encode,
+    json_encode_chunks,
     serverless_payload_encode,
 )
 from newrelic.common.utilization import (
@@ -45,12 +53,48 @@ from newrelic.network.exceptions import (
     ForceAgentDisconnect,
     ForceAgentRestart,
     NetworkInterfaceException,
+    PayloadTooLarge,
     RetryDataForRequest,
 )
 
 _logger = logging.getLogger(__name__)
 
 
+def connection_pool_options(settings):
+    """Returns the options for the connections made by the client of a
+    protocol object. Connections are kept open and shared by all clients
+    in the process when the connection pool is enabled.
+
+    """
+
+    max_connections = settings.parallel_harvest.max_workers if settings.parallel_harvest.enabled else 1
+
+    if not settings.connection_pool.enabled:
+        return {"max_connections": max_connections}
+
+    return {
+        "max_connections": max(settings.connection_pool.size, max_connections),
+        "shared_connections": True,
+        "http2": settings.connection_pool.http2,
+    }
+
+
+def adaptive_compression(settings):
+    """Returns the policy for picking the compression level of payloads
+    if adaptive compression is enabled.
+
+    """
+
+    if not settings.adaptive_compression.enabled:
+        return None
+
+    return AdaptiveCompression(
+        method=settings.compressed_content_encoding,
+        time_budget=settings.adaptive_compression.time_budget,
+        zstd=settings.adaptive_compression.zstd,
+    )
+
+
 class AgentProtocol():
     VERSION = 17
 
@@ -65,7 +109,7 @@ class AgentProtocol():
         409: ForceAgentRestart,
         410: ForceAgentDisconnect,
         411: DiscardDataForRequest,
-        413: DiscardDataForRequest,
+        413: PayloadTooLarge,
         414: DiscardDataForRequest,
         415: DiscardDataForRequest,
         417: DiscardDataForRequest,
@@ -120,6 +164,14 @@ class AgentProtocol():
                 "further information. content=%(content)s"
             ),
         ),
+        413: (
+            logging.INFO,
+            (
+                "The payload for endpoint %(method)s exceeded the maximum "
+                "payload size. Event data will be split into smaller "
+                "requests where possible, otherwise it is discarded."
+            ),
+        ),
         429: (
             logging.WARNING,
             (
@@ -180,8 +232,12 @@ class AgentProtocol():
             compression_method=settings.compressed_content_encoding,
             max_payload_size_in_bytes=settings.max_payload_size_in_bytes,
             audit_log_fp=audit_log_fp,
+            adaptive_compression=adaptive_compression(settings),
+            **connection_pool_options(settings),
         )
 
+        self._json_backend = json_backend(settings.json_backend)
+
         self._params = {
             "protocol_version": self.VERSION,
             "license_key": settings.license_key,
@@ -271,7 +327,15 @@ class AgentProtocol():
         params["method"] = method
         if self._run_token:
             params["run_id"] = self._run_token
-        return params, self._headers, json_encode(payload).encode("utf-8")
+
+        # Where the client supports it the payload is encoded in chunks which
+        # the client compresses as they are produced, rather than holding
+        # the full encoded payload in memory.
+
+        if self.client.STREAMING_PAYLOADS:
+            return params, self._headers, json_encode_chunks(payload, backend=self._json_backend)
+
+        return params, self._headers, self._json_backend.encode(payload)
 
     @staticmethod
     def _connect_payload(app_name, linked_applications, environment, settings):
@@ -463,6 +527,11 @@ class AgentProtocol():
                 cls._connect_payload(app_name, linked_applications, environment, settings),
             )
 
+        # Keep the configuration as received from the data collector as
+        # the aggregator hands it on to the agents reporting through it.
+
+        server_configuration = copy.deepcopy(configuration)
+
         # Apply High Security Mode to server_config, so the local
         # security settings won't get overwritten when we overlay
         # the server settings on top of them.
@@ -486,6 +555,8 @@ class AgentProtocol():
                 if logger_func:
                     logger_func("%s", message)
 
+        protocol.server_configuration = server_configuration
+
         return protocol
 
     def finalize(self):
@@ -538,6 +609,17 @@ class ServerlessModeProtocol(AgentProtocol):
         return cls(settings, client_cls=client_cls)
 
 
+class AggregatorModeProtocol(AgentProtocol):
+    def __init__(self, settings, host=None, client_cls=AggregatorModeClient):
+        # All requests are sent to the local aggregator process, which
+        # makes the requests to the data collector on behalf of all agents
+        # reporting through it, so any redirect host is ignored.
+
+        super(AggregatorModeProtocol, self).__init__(
+            settings, host=settings.aggregator.socket_path, client_cls=client_cls
+        )
+
+
 class OtlpProtocol(AgentProtocol):
     def __init__(self, settings, host=None, client_cls=ApplicationModeClient):
         if settings.audit_log_file:
@@ -562,6 +644,8 @@ class OtlpProtocol(AgentProtocol):
             max_payload_size_in_bytes=1000000,
             audit_log_fp=audit_log_fp,
             default_content_encoding_header=None,
+            adaptive_compression=adaptive_compression(settings),
+            **connection_pool_options(settings),
         )
 
         self._params = {}
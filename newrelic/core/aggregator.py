@@ -0,0 +1,566 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the aggregator, a process which is run alongside
+a pre-fork web server so that the agents in each of the worker processes
+do not each have to connect to and upload data to the data collector.
+
+Agents with aggregator mode enabled send the requests they would make to
+the data collector to the aggregator over a Unix domain socket instead. The
+aggregator connects to the data collector once for each application and
+hands the server side configuration on to the agents. The harvest data sent
+by the agents is merged and then uploaded by the aggregator in a single
+request for each type of data per harvest cycle.
+
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+from newrelic.common.agent_http import read_socket_message, write_socket_message
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.core.config import global_settings
+from newrelic.core.data_collector import DeveloperModeSession, Session
+from newrelic.core.stats_engine import SampledDataSet, TimeStats
+from newrelic.network.exceptions import (
+    DiscardDataForRequest,
+    ForceAgentDisconnect,
+    ForceAgentRestart,
+    RetryDataForRequest,
+)
+
+_logger = logging.getLogger(__name__)
+
+# Fixed responses to requests which the aggregator handles itself rather
+# than passing on to the data collector.
+
+_RESPONSES = {
+    "preconnect": {"redirect_host": "aggregator"},
+    "agent_settings": [],
+    "get_agent_commands": [],
+    "agent_command_results": [],
+    "profile_data": [],
+    "update_loaded_modules": None,
+    "shutdown": [],
+}
+
+_EVENT_METHODS = (
+    "analytic_event_data",
+    "custom_event_data",
+    "error_event_data",
+    "span_event_data",
+)
+
+_DATA_METHODS = _EVENT_METHODS + (
+    "error_data",
+    "log_event_data",
+    "metric_data",
+    "sql_trace_data",
+    "transaction_sample_data",
+)
+
+
+def _event_priority(sample):
+    # Transaction, span and error events carry the priority they were
+    # sampled with in their intrinsic attributes, which is used so that the
+    # same events are kept as would be by an agent reporting directly.
+
+    try:
+        return float(sample[0]["priority"])
+    except (LookupError, TypeError, ValueError):
+        return None
+
+
+class AggregatedApplication():
+
+    """Holds the session with the data collector for an application and the
+    harvest data received for it from the agents reporting through the
+    aggregator.
+
+    """
+
+    def __init__(self, app_name, linked_applications, environment):
+        self.app_name = app_name
+        self.linked_applications = linked_applications
+        self.environment = environment
+
+        self.session = None
+        self.connect_lock = threading.Lock()
+
+        self._lock = threading.Lock()
+        self._next_flexible = None
+        self._next_default = None
+        self._reset()
+
+    def _reset(self):
+        self._period_start = time.time()
+        self._metrics = {}
+        self._events = {}
+        self._errors = []
+        self._log_blocks = []
+        self._log_count = 0
+        self._sql_traces = []
+        self._traces = []
+        self._payloads = 0
+
+    @property
+    def key(self):
+        return (self.app_name,) + tuple(self.linked_applications)
+
+    @property
+    def agent_run_id(self):
+        return self.session and self.session.agent_run_id
+
+    def connect(self, settings):
+        """Connects to the data collector, replacing any existing session.
+        Data held for the previous session is discarded.
+
+        """
+
+        session_cls = DeveloperModeSession if settings.developer_mode else Session
+
+        self.close()
+
+        session = session_cls(self.app_name, self.linked_applications, self.environment, settings)
+        configuration = session.configuration
+        now = time.time()
+
+        with self._lock:
+            self.session = session
+            self._next_flexible = now + configuration.event_harvest_config.report_period_ms / 1000.0
+            self._next_default = now + configuration.data_report_period
+            self._reset()
+
+        _logger.info(
+            "Aggregator connected to the data collector for %r with run ID %r.", self.app_name, self.agent_run_id
+        )
+
+    def close(self):
+        session, self.session = self.session, None
+
+        if session is not None:
+            try:
+                session.shutdown_session()
+            except Exception:
+                _logger.debug("Failed to shutdown the session for %r.", self.app_name, exc_info=True)
+            session.close_connection()
+
+    def merge(self, method, payload, rollback=False):
+        """Merges a payload for one of the data methods of the data
+        collector into the data held for the next harvest. Payloads which
+        could not be sent are merged back in with rollback set.
+
+        """
+
+        configuration = self.session.configuration
+        agent_limits = configuration.agent_limits
+        harvest_limits = configuration.event_harvest_config.harvest_limits
+
+        with self._lock:
+            if method == "metric_data":
+                if rollback:
+                    self._period_start = min(self._period_start, payload[1])
+                else:
+                    self._payloads += 1
+
+                for spec, values in payload[3]:
+                    key = (spec["name"], spec.get("scope", ""))
+                    stats = self._metrics.get(key)
+                    if stats is None:
+                        self._metrics[key] = TimeStats(*values)
+                    else:
+                        stats.merge_stats(values)
+
+            elif method in _EVENT_METHODS:
+                events = self._events.get(method)
+                if events is None:
+                    events = self._events[method] = SampledDataSet(getattr(harvest_limits, method))
+
+                samples = payload[2]
+                for sample in samples:
+                    events.add(sample, _event_priority(sample))
+                events.add_seen(payload[1]["events_seen"] - len(samples))
+
+            elif method == "error_data":
+                self._errors.extend(payload[1])
+                del self._errors[agent_limits.errors_per_harvest :]
+
+            elif method == "sql_trace_data":
+                self._sql_traces.extend(payload[0])
+                del self._sql_traces[agent_limits.slow_sql_data :]
+
+            elif method == "transaction_sample_data":
+                # Keep the slowest transaction traces, which allows for the
+                # slowest transaction as well as any for synthetics.
+
+                self._traces.extend(payload[1])
+                self._traces.sort(key=lambda trace: trace[1], reverse=True)
+                del self._traces[agent_limits.synthetics_transactions + 1 :]
+
+            elif method == "log_event_data":
+                for block in payload:
+                    logs = block.get("logs", [])[: max(harvest_limits.log_event_data - self._log_count, 0)]
+                    if logs:
+                        self._log_count += len(logs)
+                        self._log_blocks.append(dict(block, logs=logs))
+
+    def due_harvests(self, now):
+        """Returns which of the flexible and default harvests are due,
+        scheduling the next of each.
+
+        """
+
+        session = self.session
+
+        if session is None:
+            return ()
+
+        configuration = session.configuration
+        due = []
+
+        if now >= self._next_flexible:
+            self._next_flexible = now + configuration.event_harvest_config.report_period_ms / 1000.0
+            due.append(True)
+
+        if now >= self._next_default:
+            self._next_default = now + configuration.data_report_period
+            due.append(False)
+
+        return due
+
+    def _take(self, flexible):
+        # Takes the data which is due to be sent, returning a list of the
+        # collector methods and payloads. The event types in the allowlist
+        # are sent by the flexible harvest and everything else by the
+        # default harvest.
+
+        allowlist = self.session.configuration.event_harvest_config.allowlist
+        now = time.time()
+        payloads = []
+
+        with self._lock:
+            for method in _EVENT_METHODS:
+                events = self._events.get(method)
+                if events is not None and (method in allowlist) == flexible:
+                    del self._events[method]
+                    payloads.append((method, [None, events.sampling_info, list(events)]))
+
+            if self._log_blocks and ("log_event_data" in allowlist) == flexible:
+                payloads.append(("log_event_data", self._log_blocks))
+                self._log_blocks, self._log_count = [], 0
+
+            if flexible:
+                return payloads
+
+            if self._errors:
+                payloads.append(("error_data", [None, self._errors]))
+                self._errors = []
+
+            if self._sql_traces:
+                payloads.append(("sql_trace_data", [self._sql_traces]))
+                self._sql_traces = []
+
+            if self._traces:
+                payloads.append(("transaction_sample_data", [None, self._traces]))
+                self._traces = []
+
+            # The metric data is sent last, along with a supportability
+            # metric for the number of harvests merged into it.
+
+            key = ("Supportability/Python/Aggregator/Harvests", "")
+            self._metrics.setdefault(key, TimeStats()).merge_stats(TimeStats(self._payloads))
+
+            metric_data = [({"name": name, "scope": scope}, stats) for (name, scope), stats in self._metrics.items()]
+            payloads.append(("metric_data", [None, self._period_start, now, metric_data]))
+
+            self._metrics = {}
+            self._payloads = 0
+            self._period_start = now
+
+        return payloads
+
+    def harvest(self, flexible=False):
+        """Sends the data which has been received since the last harvest
+        to the data collector. Data which could not be sent but which
+        should be retried is merged back in to be sent at the next harvest.
+
+        """
+
+        if self.session is None:
+            return
+
+        for method, payload in self._take(flexible):
+            try:
+                self.session.forward_data(method, payload)
+            except RetryDataForRequest:
+                _logger.debug("Retrying %r data for %r at next harvest.", method, self.app_name)
+                self.merge(method, payload, rollback=True)
+            except DiscardDataForRequest:
+                _logger.debug("Discarding %r data for %r.", method, self.app_name)
+
+
+class AggregatorServer():
+
+    """Listens on a Unix domain socket for the requests of agents in
+    aggregator mode, and sends the data they report to the data collector
+    from its own harvest cycle.
+
+    """
+
+    def __init__(self, socket_path, settings=None):
+        self._socket_path = socket_path
+        self._settings = settings or global_settings()
+
+        self._applications = {}
+        self._run_ids = {}
+        self._disconnected = set()
+        self._lock = threading.Lock()
+
+        self._socket = None
+        self._threads = []
+        self._shutdown = threading.Event()
+
+    @property
+    def socket_path(self):
+        return self._socket_path
+
+    def start(self):
+        """Starts listening for requests and the harvest thread."""
+
+        try:
+            os.unlink(self._socket_path)
+        except FileNotFoundError:
+            pass
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self._socket_path)
+        self._socket.listen(128)
+
+        for target, name in ((self._accept, "NR-Aggregator"), (self._harvest_loop, "NR-Aggregator-Harvest")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+        _logger.info("Aggregator listening on %r.", self._socket_path)
+
+    def serve_forever(self):
+        self.start()
+
+        try:
+            while not self._shutdown.wait(1.0):
+                pass
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Stops accepting requests, sends any data still held and then
+        closes the sessions with the data collector.
+
+        """
+
+        with self._lock:
+            sock, self._socket = self._socket, None
+
+        self._shutdown.set()
+
+        if sock is None:
+            return
+
+        # Closing the socket alone doesn't wake a thread blocked accepting
+        # connections on it.
+
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+        sock.close()
+
+        try:
+            os.unlink(self._socket_path)
+        except OSError:
+            pass
+
+        for thread in self._threads:
+            thread.join(5.0)
+
+        self.harvest()
+
+        with self._lock:
+            applications = list(self._applications.values())
+
+        for application in applications:
+            application.close()
+
+    def harvest(self):
+        """Sends all data held for each application immediately."""
+
+        with self._lock:
+            applications = list(self._run_ids.values())
+
+        for application in applications:
+            self._harvest(application, flexible=True)
+            self._harvest(application, flexible=False)
+
+    def _accept(self):
+        while not self._shutdown.is_set():
+            try:
+                connection, _ = self._socket.accept()
+            except (AttributeError, OSError):
+                return
+
+            thread = threading.Thread(target=self._handle, args=(connection,), name="NR-Aggregator-Connection")
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        with connection:
+            while not self._shutdown.is_set():
+                try:
+                    header, body = read_socket_message(connection)
+                except (OSError, ValueError):
+                    return
+
+                try:
+                    status, value = self.dispatch(header.get("params") or {}, body)
+                except Exception:
+                    _logger.exception("Aggregator failed to handle request %r.", header)
+                    status, value = 500, None
+
+                try:
+                    write_socket_message(
+                        connection, {"status": status}, json_encode({"return_value": value}).encode("utf-8")
+                    )
+                except OSError:
+                    return
+
+    def dispatch(self, params, body):
+        """Handles a request for the data collector from an agent. Returns
+        the status code and the return value of the response.
+
+        """
+
+        method = params.get("method")
+
+        if method in _RESPONSES:
+            return 200, _RESPONSES[method]
+
+        payload = json_decode(body.decode("utf-8")) if body else None
+
+        if method == "connect":
+            return self._connect(payload[0])
+
+        if method not in _DATA_METHODS:
+            return 400, None
+
+        run_id = params.get("run_id")
+
+        with self._lock:
+            if run_id in self._disconnected:
+                return 410, None
+            application = self._run_ids.get(run_id)
+
+        # An unknown run ID means the agent is reporting for a session the
+        # aggregator no longer has, so the agent is told to reconnect.
+
+        if application is None or application.agent_run_id != run_id:
+            return 409, None
+
+        application.merge(method, payload)
+
+        return 202, None
+
+    def _connect(self, payload):
+        app_names = payload["app_name"]
+        key = tuple(app_names)
+
+        with self._lock:
+            if key in self._disconnected:
+                return 410, None
+
+            application = self._applications.get(key)
+            if application is None:
+                application = self._applications[key] = AggregatedApplication(
+                    app_names[0], app_names[1:], payload.get("environment")
+                )
+
+        # Only the first agent to connect for an application causes the
+        # aggregator to connect to the data collector, with the others
+        # being given the same server side configuration.
+
+        with application.connect_lock:
+            if application.session is None:
+                try:
+                    self._connect_application(application)
+                except ForceAgentDisconnect:
+                    return 410, None
+                except Exception:
+                    _logger.debug("Aggregator failed to connect for %r.", application.app_name, exc_info=True)
+                    return 503, None
+
+            return 200, application.session.server_configuration
+
+    def _connect_application(self, application):
+        previous = application.agent_run_id
+
+        try:
+            application.connect(self._settings)
+        except ForceAgentDisconnect:
+            self._disconnect(application, previous)
+            raise
+
+        with self._lock:
+            self._run_ids.pop(previous, None)
+            self._run_ids[application.agent_run_id] = application
+
+    def _disconnect(self, application, run_id):
+        with self._lock:
+            self._disconnected.add(application.key)
+            self._disconnected.add(run_id)
+            self._applications.pop(application.key, None)
+            self._run_ids.pop(run_id, None)
+
+        application.close()
+
+    def _harvest(self, application, flexible):
+        try:
+            application.harvest(flexible)
+        except ForceAgentRestart:
+            _logger.info("Aggregator restarting the session for %r.", application.app_name)
+            try:
+                with application.connect_lock:
+                    self._connect_application(application)
+            except Exception:
+                _logger.debug("Aggregator failed to reconnect for %r.", application.app_name, exc_info=True)
+        except ForceAgentDisconnect:
+            self._disconnect(application, application.agent_run_id)
+        except Exception:
+            _logger.exception("Aggregator harvest failed for %r.", application.app_name)
+
+    def _harvest_loop(self):
+        while not self._shutdown.wait(0.5):
+            with self._lock:
+                applications = list(self._run_ids.values())
+
+            now = time.time()
+
+            for application in applications:
+                for flexible in application.due_harvests(now):
+                    self._harvest(application, flexible)
@@ -16,9 +16,11 @@
 
 """
 
+import hashlib
 import logging
 import os
 import sys
+import tempfile
 import threading
 import time
 import traceback
@@ -30,8 +32,10 @@ from newrelic.core.adaptive_sampler import AdaptiveSampler
 from newrelic.core.config import global_settings
 from newrelic.core.custom_event import create_custom_event
 from newrelic.core.data_collector import create_session
-from newrelic.core.database_utils import SQLConnections
+from newrelic.core.database_utils import ExplainPlanPool, SQLConnections
 from newrelic.core.environment import environment_settings, plugins
+from newrelic.core.harvest_spool import HarvestSpool
+from newrelic.core.harvest_uploader import HarvestUploader
 from newrelic.core.internal_metrics import (
     InternalTrace,
     InternalTraceContext,
@@ -40,7 +44,10 @@ from newrelic.core.internal_metrics import (
 )
 from newrelic.core.profile_sessions import profile_session_manager
 from newrelic.core.rules_engine import RulesEngine, SegmentCollapseEngine
-from newrelic.core.stats_engine import CustomMetrics, StatsEngine
+from newrelic.core.shared_metric_table import shared_metric_table
+from newrelic.core.startup_profile import harvest_startup_timings
+from newrelic.core.stats_engine import CustomMetrics, StatsEngine, StatsEngineShards
+from newrelic.core.transaction_recorder import TransactionRecorder
 from newrelic.network.exceptions import (
     DiscardDataForRequest,
     ForceAgentDisconnect,
@@ -104,6 +111,14 @@ class Application:
         self._stats_custom_lock = threading.RLock()
         self._stats_custom_engine = StatsEngine()
 
+        self._stats_shards = None
+
+        self._transaction_recorder = None
+
+        self._explain_plan_pool = None
+
+        self._harvest_spool = None
+
         self._agent_commands_lock = threading.Lock()
         self._data_samplers_lock = threading.Lock()
         self._data_samplers_started = False
@@ -182,8 +197,22 @@ class Application:
             print(f"Transaction Normalization Rules: {self._rules_engine['transaction'].rules!r}", file=file)
             print(f"Transaction Segment Allowlist Rules: {self._rules_engine['segment'].rules!r}", file=file)
             print(f"Harvest Period Start: {time.asctime(time.localtime(self._period_start))}", file=file)
-            print(f"Transaction Count: {self._transaction_count}", file=file)
-            print(f"Last Transaction: {time.asctime(time.localtime(self._last_transaction))}", file=file)
+
+            # Transactions recorded into stats engine shards are only
+            # counted against the application when the shards are folded.
+
+            transaction_count = self._transaction_count
+            last_transaction = self._last_transaction
+
+            stats_shards = self._stats_shards
+
+            if stats_shards is not None:
+                shards_transaction_count, shards_last_transaction = stats_shards.transaction_stats()
+                transaction_count += shards_transaction_count
+                last_transaction = max(last_transaction, shards_last_transaction)
+
+            print(f"Transaction Count: {transaction_count}", file=file)
+            print(f"Last Transaction: {time.asctime(time.localtime(last_transaction))}", file=file)
             print(f"Global Events Count: {self._global_events_account}", file=file)
             print(f"Harvest Metrics Count: {self._stats_engine.metrics_count()}", file=file)
             print(f"Harvest Discard Count: {self._discard_count}", file=file)
@@ -415,9 +444,11 @@ class Application:
                             configuration.transaction_name_rules,
                         )
 
-                    self._rules_engine["url"] = RulesEngine(configuration.url_rules)
-                    self._rules_engine["metric"] = RulesEngine(configuration.metric_name_rules)
-                    self._rules_engine["transaction"] = RulesEngine(configuration.transaction_name_rules)
+                    cache_size = configuration.agent_limits.rules_engine_cache_entries
+
+                    self._rules_engine["url"] = RulesEngine(configuration.url_rules, cache_size)
+                    self._rules_engine["metric"] = RulesEngine(configuration.metric_name_rules, cache_size)
+                    self._rules_engine["transaction"] = RulesEngine(configuration.transaction_name_rules, cache_size)
                     self._rules_engine["segment"] = SegmentCollapseEngine(configuration.transaction_segment_terms)
 
                 except Exception:
@@ -492,7 +523,20 @@ class Application:
 
         configuration = active_session.configuration
 
+        # If enabled, metrics are accumulated in a table in shared memory
+        # common to all worker processes forked from the process in which
+        # the agent was initialized, with one process harvesting the table
+        # on behalf of all. Only one application can make use of the table.
+
+        metric_table = None
+
+        if configuration.stats_engine.shared_metrics and not configuration.serverless_mode.enabled:
+            metric_table = shared_metric_table(configuration)
+            if not metric_table.bind(self._app_name):
+                metric_table = None
+
         with self._stats_lock:
+            self._stats_engine.use_shared_metric_table(metric_table)
             self._stats_engine.reset_stats(configuration, reset_stream=True)
 
             if configuration.serverless_mode.enabled:
@@ -509,6 +553,80 @@ class Application:
         with self._stats_lock:
             self._stats_engine.reset_stats(configuration)
 
+        # If enabled, transaction data and custom metrics and events are
+        # accumulated in a set of shards, each with their own lock, rather
+        # than all threads contending on the locks for the main stats
+        # engines. The shards are folded into the main stats engine when
+        # a harvest is performed.
+
+        if configuration.stats_engine.shards > 0:
+            stats_shards = StatsEngineShards(configuration.stats_engine.shards)
+            stats_shards.reset_stats(configuration)
+            self._stats_shards = stats_shards
+        else:
+            self._stats_shards = None
+
+        # If enabled, finished transactions will be handed off to a
+        # background thread for recording so that the aggregation of the
+        # transaction data into the stats engine is not done on the
+        # thread which handled the request. This is not done in
+        # serverless mode as there is no harvest thread and the process
+        # may be frozen as soon as the request completes.
+
+        recorder_settings = configuration.transaction_recorder
+
+        if recorder_settings.enabled and not configuration.serverless_mode.enabled:
+            self._transaction_recorder = TransactionRecorder(
+                self._record_transaction,
+                self._app_name,
+                queue_size=recorder_settings.queue_size,
+                overflow_policy=recorder_settings.overflow_policy,
+                block_timeout=recorder_settings.block_timeout,
+            )
+
+        # If enabled, database connections used for explain plans are kept
+        # open across harvests and the explain plans are run from a
+        # background thread, with the results being cached. Otherwise a
+        # new set of connections is created for each harvest.
+
+        if self._explain_plan_pool is not None:
+            self._explain_plan_pool.shutdown()
+            self._explain_plan_pool = None
+
+        explain_plan_settings = configuration.explain_plan
+
+        if explain_plan_settings.pool_enabled and not configuration.serverless_mode.enabled:
+            self._explain_plan_pool = ExplainPlanPool(
+                configuration.agent_limits.max_sql_connections,
+                cache_ttl=explain_plan_settings.cache_ttl,
+                harvest_timeout=explain_plan_settings.harvest_timeout,
+                idle_timeout=explain_plan_settings.idle_timeout,
+            )
+
+        # If enabled, harvest data which cannot be sent to the data
+        # collector is written to a spool on disk and sent once the data
+        # collector can be reached again. Each application has its own
+        # spool directory as the data is only valid for that application.
+
+        if self._harvest_spool is not None:
+            self._harvest_spool.close()
+            self._harvest_spool = None
+
+        spool_settings = configuration.spool
+
+        if spool_settings.enabled and not configuration.serverless_mode.enabled:
+            spool_directory = spool_settings.directory or os.path.join(tempfile.gettempdir(), "newrelic-spool")
+            app_directory = hashlib.sha256(self._app_name.encode("utf-8")).hexdigest()[:16]
+
+            self._harvest_spool = HarvestSpool(
+                os.path.join(spool_directory, app_directory),
+                max_bytes=spool_settings.max_bytes,
+                max_age=spool_settings.max_age,
+                segment_bytes=spool_settings.segment_bytes,
+            )
+
+            active_session.spool = self._harvest_spool
+
         # Record an initial start time for the reporting period and
         # clear record of last transaction processed.
 
@@ -845,6 +963,15 @@ class Application:
         if not self._active_session:
             return
 
+        stats_shards = self._stats_shards
+
+        if stats_shards is not None:
+            stats_shard = stats_shards.shard()
+            with stats_shard.lock:
+                stats_shard.events_count += 1
+                stats_shard.stats.record_custom_metric(name, value)
+            return
+
         with self._stats_custom_lock:
             self._global_events_account += 1
             self._stats_custom_engine.record_custom_metric(name, value)
@@ -865,6 +992,16 @@ class Application:
         if not self._active_session:
             return
 
+        stats_shards = self._stats_shards
+
+        if stats_shards is not None:
+            stats_shard = stats_shards.shard()
+            with stats_shard.lock:
+                for name, value in metrics:
+                    stats_shard.events_count += 1
+                    stats_shard.stats.record_custom_metric(name, value)
+            return
+
         with self._stats_custom_lock:
             for name, value in metrics:
                 self._global_events_account += 1
@@ -926,6 +1063,15 @@ class Application:
         event = create_custom_event(event_type, params, settings=settings)
 
         if event:
+            stats_shards = self._stats_shards
+
+            if stats_shards is not None:
+                stats_shard = stats_shards.shard()
+                with stats_shard.lock:
+                    stats_shard.events_count += 1
+                    stats_shard.stats.record_custom_event(event)
+                return
+
             with self._stats_custom_lock:
                 self._global_events_account += 1
                 self._stats_engine.record_custom_event(event)
@@ -942,6 +1088,15 @@ class Application:
         event = create_custom_event(event_type, params, settings=settings, is_ml_event=True)
 
         if event:
+            stats_shards = self._stats_shards
+
+            if stats_shards is not None:
+                stats_shard = stats_shards.shard()
+                with stats_shard.lock:
+                    stats_shard.events_count += 1
+                    stats_shard.stats.record_ml_event(event)
+                return
+
             with self._stats_custom_lock:
                 self._global_events_account += 1
                 self._stats_engine.record_ml_event(event)
@@ -950,6 +1105,18 @@ class Application:
         if not self._active_session:
             return
 
+        stats_shards = self._stats_shards
+
+        if stats_shards is not None:
+            stats_shard = stats_shards.shard()
+            with stats_shard.lock:
+                event = stats_shard.stats.record_log_event(
+                    message, level, timestamp, attributes=attributes, priority=priority
+                )
+                if event:
+                    stats_shard.events_count += 1
+            return
+
         with self._stats_custom_lock:
             event = self._stats_engine.record_log_event(
                 message, level, timestamp, attributes=attributes, priority=priority
@@ -958,8 +1125,24 @@ class Application:
                 self._global_events_account += 1
 
     def record_transaction(self, data):
-        """Record a single transaction against this application."""
+        """Record a single transaction against this application. Where
+        the background transaction recorder is enabled the transaction is
+        queued to be recorded by the worker thread, otherwise it is
+        recorded immediately on the calling thread.
 
+        """
+
+        if not self._active_session:
+            return
+
+        transaction_recorder = self._transaction_recorder
+
+        if transaction_recorder is not None:
+            transaction_recorder.put(data)
+        else:
+            self._record_transaction(data)
+
+    def _record_transaction(self, data):
         if not self._active_session:
             return
 
@@ -989,6 +1172,22 @@ class Application:
 
         self.validate_process()
 
+        # If stats engine shards are enabled, merge into the shard assigned
+        # to this thread so we only contend on the lock with other threads
+        # assigned to the same shard. The shards are folded into the main
+        # stats engine at the time of harvest.
+
+        stats_shards = self._stats_shards
+
+        if stats_shards is not None:
+            stats_shard = stats_shards.shard()
+            stats_lock = stats_shard.lock
+            parent_stats = stats_shard.stats
+        else:
+            stats_shard = None
+            stats_lock = self._stats_lock
+            parent_stats = self._stats_engine
+
         internal_metrics = CustomMetrics()
 
         with InternalTraceContext(internal_metrics):
@@ -999,7 +1198,7 @@ class Application:
                     # that the process of generating the metrics into the stats
                     # don't unnecessarily lock out another thread.
 
-                    stats = self._stats_engine.create_workarea()
+                    stats = parent_stats.create_workarea()
                     stats.record_transaction(data)
 
                 except Exception:
@@ -1014,12 +1213,18 @@ class Application:
                     if settings.debug.record_transaction_failure:
                         raise
 
-            with self._stats_lock:
+            with stats_lock:
                 try:
-                    self._transaction_count += 1
-                    self._last_transaction = data.end_time
+                    if stats_shard is not None:
+                        stats_shard.transaction_count += 1
+                        stats_shard.last_transaction = data.end_time
+                        stats_engine = stats_shard.stats
+                    else:
+                        self._transaction_count += 1
+                        self._last_transaction = data.end_time
+                        stats_engine = self._stats_engine
 
-                    self._stats_engine.merge(stats)
+                    stats_engine.merge(stats)
 
                     # We merge the internal statistics here as well even
                     # though have popped out of the context where we are
@@ -1027,7 +1232,7 @@ class Application:
                     # anything else after this point. If we do then that
                     # data will not be recorded.
 
-                    self._stats_engine.merge_custom_metrics(internal_metrics.metrics())
+                    stats_engine.merge_custom_metrics(internal_metrics.metrics())
 
                 except Exception:
                     _logger.exception(
@@ -1183,9 +1388,33 @@ class Application:
                 _logger.debug("Snapshotting for harvest[%s] of %r.", call_metric, self._app_name)
 
                 configuration = self._active_session.configuration
+
+                # Wait for any transactions which were handed off to the
+                # background recorder prior to the harvest being started
+                # to be recorded so they are included in this harvest.
+
+                transaction_recorder = self._transaction_recorder
+                harvest_spool = self._harvest_spool
+                metric_table = self._stats_engine.shared_metric_table
+
+                if transaction_recorder is not None:
+                    if not transaction_recorder.flush(configuration.transaction_recorder.flush_timeout):
+                        _logger.debug(
+                            "Timed out waiting for %d queued transactions to be recorded for harvest of %r.",
+                            len(transaction_recorder),
+                            self._app_name,
+                        )
+
                 transaction_count = self._transaction_count
 
+                stats_shards = self._stats_shards
+
                 with self._stats_lock:
+                    if stats_shards is not None:
+                        shards_transaction_count, shards_events_count = stats_shards.fold(self._stats_engine)
+                        transaction_count += shards_transaction_count
+                        self._global_events_account += shards_events_count
+
                     self._transaction_count = 0
 
                     self._last_transaction = 0.0
@@ -1280,6 +1509,43 @@ class Application:
 
                     stats.record_custom_metric("Instance/Reporting", 0)
 
+                    # Report on how the background transaction recorder
+                    # has been coping with the volume of transactions.
+
+                    if transaction_recorder is not None:
+                        queued, dropped, inline, max_depth = transaction_recorder.stats()
+
+                        internal_count_metric("Supportability/Python/TransactionRecorder/Queued", queued)
+                        internal_count_metric("Supportability/Python/TransactionRecorder/Dropped", dropped)
+                        internal_count_metric("Supportability/Python/TransactionRecorder/Inline", inline)
+                        internal_metric("Supportability/Python/TransactionRecorder/QueueDepth", max_depth)
+
+                    # Report on data written to and sent from the spool
+                    # while the data collector could not be reached.
+
+                    if harvest_spool is not None:
+                        written, drained, dropped = harvest_spool.stats()
+
+                        internal_count_metric("Supportability/Python/Spool/Written", written)
+                        internal_count_metric("Supportability/Python/Spool/Drained", drained)
+                        internal_count_metric("Supportability/Python/Spool/Dropped", dropped)
+
+                    # Report on how full the shared metric table is and
+                    # how many metrics had to be held locally instead.
+
+                    if metric_table is not None:
+                        used, overflowed = metric_table.usage()
+
+                        internal_metric("Supportability/Python/SharedMetrics/SlotsUsed", used)
+                        internal_count_metric("Supportability/Python/SharedMetrics/Overflow", overflowed)
+
+                    # Report on the time taken by each stage of agent
+                    # startup, including instrumentation hooks which ran
+                    # since the last harvest.
+
+                    for name, duration in harvest_startup_timings():
+                        internal_metric(f"Supportability/Python/Startup/{name}", duration)
+
                     # If an import order issue was detected, send a metric for
                     # each uninstrumented module
 
@@ -1309,204 +1575,274 @@ class Application:
                         _logger.debug("Stretching harvest duration for forced harvest on shutdown.")
                         period_end = self._period_start + 1.001
 
-                try:
-                    # Send the transaction and custom metric data.
-
-                    # Send data set for analytics, which is Synthetic analytic
-                    # events, and the sampled data set of regular requests sent
-                    # as separate requests.
-
-                    synthetics_events = stats.synthetics_events
-                    if synthetics_events:
-                        if synthetics_events.num_samples:
-                            _logger.debug("Sending synthetics event data for harvest of %r.", self._app_name)
-
-                            self._active_session.send_transaction_events(
-                                synthetics_events.sampling_info, synthetics_events
-                            )
-
-                        stats.reset_synthetics_events()
+                # The uploads are made one at a time when writing to the
+                # audit log, as it is not safe to write to concurrently, and
+                # in serverless mode where nothing is sent over the network.
 
-                    if configuration.collect_analytics_events and configuration.transaction_events.enabled:
-                        transaction_events = stats.transaction_events
-
-                        if transaction_events:
-                            # As per spec
-                            internal_metric(
-                                "Supportability/Python/RequestSampler/requests", transaction_events.num_seen
-                            )
-                            internal_metric(
-                                "Supportability/Python/RequestSampler/samples", transaction_events.num_samples
-                            )
+                upload_workers = 1
 
-                            if transaction_events.num_samples:
-                                _logger.debug("Sending analytics event data for harvest of %r.", self._app_name)
+                if (
+                    configuration.parallel_harvest.enabled
+                    and not configuration.audit_log_file
+                    and not configuration.serverless_mode.enabled
+                ):
+                    upload_workers = configuration.parallel_harvest.max_workers
 
-                                self._active_session.send_transaction_events(
-                                    transaction_events.sampling_info, transaction_events
+                try:
+                    # Send the transaction and custom metric data.
+                    #
+                    # The event, error and trace data are sent before the
+                    # metric data, so that the supportability metrics
+                    # recorded when sending them are included. These uploads
+                    # are independent of each other and, if enabled, are
+                    # made concurrently.
+
+                    with HarvestUploader(internal_metrics, upload_workers) as uploader:
+                        session = self._active_session
+
+                        # Send data set for analytics, which is Synthetic analytic
+                        # events, and the sampled data set of regular requests sent
+                        # as separate requests.
+
+                        synthetics_events = stats.synthetics_events
+                        if synthetics_events:
+                            if synthetics_events.num_samples:
+                                _logger.debug("Sending synthetics event data for harvest of %r.", self._app_name)
+
+                                uploader.upload(
+                                    session.send_transaction_events,
+                                    synthetics_events.sampling_info,
+                                    synthetics_events,
+                                    on_success=stats.reset_synthetics_events,
                                 )
+                            else:
+                                stats.reset_synthetics_events()
 
-                            stats.reset_transaction_events()
-
-                    # Send span events
-
-                    if (
-                        configuration.span_events.enabled
-                        and configuration.collect_span_events
-                        and configuration.distributed_tracing.enabled
-                    ):
-                        if configuration.infinite_tracing.enabled:
-                            span_stream = stats.span_stream
-                            # Only merge stats as part of default harvest
-                            if span_stream is not None and not flexible:
-                                spans_seen, spans_dropped = span_stream.stats()
-                                spans_sent = spans_seen - spans_dropped
-
-                                internal_count_metric("Supportability/InfiniteTracing/Span/Seen", spans_seen)
-                                internal_count_metric("Supportability/InfiniteTracing/Span/Sent", spans_sent)
-                        else:
-                            spans = stats.span_events
-                            if spans:
-                                if spans.num_samples > 0:
-                                    span_samples = list(spans)
-
-                                    _logger.debug("Sending span event data for harvest of %r.", self._app_name)
-
-                                    self._active_session.send_span_events(spans.sampling_info, span_samples)
-                                    span_samples = None
+                        if configuration.collect_analytics_events and configuration.transaction_events.enabled:
+                            transaction_events = stats.transaction_events
 
+                            if transaction_events:
                                 # As per spec
-                                spans_seen = spans.num_seen
-                                spans_sampled = spans.num_samples
-                                internal_count_metric("Supportability/SpanEvent/TotalEventsSeen", spans_seen)
-                                internal_count_metric("Supportability/SpanEvent/TotalEventsSent", spans_sampled)
-
-                                stats.reset_span_events()
-
-                    # Send error events
-
-                    if (
-                        configuration.collect_error_events
-                        and configuration.error_collector.capture_events
-                        and configuration.error_collector.enabled
-                    ):
-                        error_events = stats.error_events
-                        if error_events:
-                            num_error_samples = error_events.num_samples
-                            if num_error_samples > 0:
-                                error_event_samples = list(error_events)
-
-                                _logger.debug("Sending error event data for harvest of %r.", self._app_name)
-
-                                samp_info = error_events.sampling_info
-                                self._active_session.send_error_events(samp_info, error_event_samples)
-                                error_event_samples = None
+                                internal_metric(
+                                    "Supportability/Python/RequestSampler/requests", transaction_events.num_seen
+                                )
+                                internal_metric(
+                                    "Supportability/Python/RequestSampler/samples", transaction_events.num_samples
+                                )
 
-                            # As per spec
-                            internal_count_metric("Supportability/Events/TransactionError/Seen", error_events.num_seen)
-                            internal_count_metric("Supportability/Events/TransactionError/Sent", num_error_samples)
+                                if transaction_events.num_samples:
+                                    _logger.debug("Sending analytics event data for harvest of %r.", self._app_name)
 
-                            stats.reset_error_events()
+                                    uploader.upload(
+                                        session.send_transaction_events,
+                                        transaction_events.sampling_info,
+                                        transaction_events,
+                                        on_success=stats.reset_transaction_events,
+                                    )
+                                else:
+                                    stats.reset_transaction_events()
+
+                        # Send span events
+
+                        if (
+                            configuration.span_events.enabled
+                            and configuration.collect_span_events
+                            and configuration.distributed_tracing.enabled
+                        ):
+                            if configuration.infinite_tracing.enabled:
+                                span_stream = stats.span_stream
+                                # Only merge stats as part of default harvest
+                                if span_stream is not None and not flexible:
+                                    spans_seen, spans_dropped = span_stream.stats()
+                                    spans_sent = spans_seen - spans_dropped
+
+                                    internal_count_metric("Supportability/InfiniteTracing/Span/Seen", spans_seen)
+                                    internal_count_metric("Supportability/InfiniteTracing/Span/Sent", spans_sent)
+                            else:
+                                spans = stats.span_events
+                                if spans:
+
+                                    def span_events_sent(spans=spans):
+                                        # As per spec
+                                        spans_seen = spans.num_seen
+                                        spans_sampled = spans.num_samples
+                                        internal_count_metric("Supportability/SpanEvent/TotalEventsSeen", spans_seen)
+                                        internal_count_metric("Supportability/SpanEvent/TotalEventsSent", spans_sampled)
+
+                                        stats.reset_span_events()
+
+                                    if spans.num_samples > 0:
+                                        _logger.debug("Sending span event data for harvest of %r.", self._app_name)
+
+                                        uploader.upload(
+                                            session.send_span_events,
+                                            spans.sampling_info,
+                                            list(spans),
+                                            on_success=span_events_sent,
+                                        )
+                                    else:
+                                        span_events_sent()
+
+                        # Send error events
+
+                        if (
+                            configuration.collect_error_events
+                            and configuration.error_collector.capture_events
+                            and configuration.error_collector.enabled
+                        ):
+                            error_events = stats.error_events
+                            if error_events:
+
+                                def error_events_sent(error_events=error_events):
+                                    # As per spec
+                                    internal_count_metric(
+                                        "Supportability/Events/TransactionError/Seen", error_events.num_seen
+                                    )
+                                    internal_count_metric(
+                                        "Supportability/Events/TransactionError/Sent", error_events.num_samples
+                                    )
 
-                    # Send custom events
+                                    stats.reset_error_events()
 
-                    if configuration.collect_custom_events and configuration.custom_insights_events.enabled:
-                        customs = stats.custom_events
+                                if error_events.num_samples > 0:
+                                    _logger.debug("Sending error event data for harvest of %r.", self._app_name)
 
-                        if customs:
-                            if customs.num_samples > 0:
-                                custom_samples = list(customs)
+                                    uploader.upload(
+                                        session.send_error_events,
+                                        error_events.sampling_info,
+                                        list(error_events),
+                                        on_success=error_events_sent,
+                                    )
+                                else:
+                                    error_events_sent()
 
-                                _logger.debug("Sending custom event data for harvest of %r.", self._app_name)
+                        # Send custom events
 
-                                self._active_session.send_custom_events(customs.sampling_info, custom_samples)
-                                custom_samples = None
+                        if configuration.collect_custom_events and configuration.custom_insights_events.enabled:
+                            customs = stats.custom_events
 
-                            # As per spec
-                            internal_count_metric("Supportability/Events/Customer/Seen", customs.num_seen)
-                            internal_count_metric("Supportability/Events/Customer/Sent", customs.num_samples)
+                            if customs:
 
-                            stats.reset_custom_events()
+                                def custom_events_sent(customs=customs):
+                                    # As per spec
+                                    internal_count_metric("Supportability/Events/Customer/Seen", customs.num_seen)
+                                    internal_count_metric("Supportability/Events/Customer/Sent", customs.num_samples)
 
-                    # Send machine learning events
+                                    stats.reset_custom_events()
 
-                    if configuration.ml_insights_events.enabled:
-                        ml_events = stats.ml_events
+                                if customs.num_samples > 0:
+                                    _logger.debug("Sending custom event data for harvest of %r.", self._app_name)
 
-                        if ml_events:
-                            if ml_events.num_samples > 0:
-                                ml_event_samples = list(ml_events)
+                                    uploader.upload(
+                                        session.send_custom_events,
+                                        customs.sampling_info,
+                                        list(customs),
+                                        on_success=custom_events_sent,
+                                    )
+                                else:
+                                    custom_events_sent()
 
-                                _logger.debug("Sending machine learning event data for harvest of %r.", self._app_name)
+                        # Send machine learning events
 
-                                self._active_session.send_ml_events(ml_events.sampling_info, ml_event_samples)
-                                ml_event_samples = None
+                        if configuration.ml_insights_events.enabled:
+                            ml_events = stats.ml_events
 
-                            # As per spec
-                            internal_count_metric("Supportability/Events/Customer/Seen", ml_events.num_seen)
-                            internal_count_metric("Supportability/Events/Customer/Sent", ml_events.num_samples)
+                            if ml_events:
 
-                            stats.reset_ml_events()
+                                def ml_events_sent(ml_events=ml_events):
+                                    # As per spec
+                                    internal_count_metric("Supportability/Events/Customer/Seen", ml_events.num_seen)
+                                    internal_count_metric("Supportability/Events/Customer/Sent", ml_events.num_samples)
 
-                    # Send log events
+                                    stats.reset_ml_events()
 
-                    if (
-                        configuration
-                        and configuration.application_logging
-                        and configuration.application_logging.enabled
-                        and configuration.application_logging.forwarding
-                        and configuration.application_logging.forwarding.enabled
-                    ):
-                        logs = stats.log_events
+                                if ml_events.num_samples > 0:
+                                    _logger.debug(
+                                        "Sending machine learning event data for harvest of %r.", self._app_name
+                                    )
 
-                        if logs:
-                            if logs.num_samples > 0:
-                                log_samples = list(logs)
+                                    uploader.upload(
+                                        session.send_ml_events,
+                                        ml_events.sampling_info,
+                                        list(ml_events),
+                                        on_success=ml_events_sent,
+                                    )
+                                else:
+                                    ml_events_sent()
+
+                        # Send log events
+
+                        if (
+                            configuration
+                            and configuration.application_logging
+                            and configuration.application_logging.enabled
+                            and configuration.application_logging.forwarding
+                            and configuration.application_logging.forwarding.enabled
+                        ):
+                            logs = stats.log_events
+
+                            if logs:
+
+                                def log_events_sent(logs=logs):
+                                    # As per spec
+                                    internal_count_metric("Supportability/Logging/Forwarding/Seen", logs.num_seen)
+                                    internal_count_metric("Supportability/Logging/Forwarding/Sent", logs.num_samples)
+                                    internal_count_metric(
+                                        "Logging/Forwarding/Dropped", logs.num_seen - logs.num_samples
+                                    )
 
-                                _logger.debug("Sending log event data for harvest of %r.", self._app_name)
+                                    stats.reset_log_events()
 
-                                self._active_session.send_log_events(logs.sampling_info, log_samples)
-                                log_samples = None
+                                if logs.num_samples > 0:
+                                    _logger.debug("Sending log event data for harvest of %r.", self._app_name)
 
-                            # As per spec
-                            internal_count_metric("Supportability/Logging/Forwarding/Seen", logs.num_seen)
-                            internal_count_metric("Supportability/Logging/Forwarding/Sent", logs.num_samples)
-                            internal_count_metric("Logging/Forwarding/Dropped", logs.num_seen - logs.num_samples)
+                                    uploader.upload(
+                                        session.send_log_events,
+                                        logs.sampling_info,
+                                        list(logs),
+                                        on_success=log_events_sent,
+                                    )
+                                else:
+                                    log_events_sent()
 
-                            stats.reset_log_events()
+                        # Send the accumulated error data.
 
-                    # Send the accumulated error data.
+                        if configuration.collect_errors:
+                            error_data = stats.error_data()
 
-                    if configuration.collect_errors:
-                        error_data = stats.error_data()
+                            if error_data:
+                                _logger.debug("Sending error data for harvest of %r.", self._app_name)
 
-                        if error_data:
-                            _logger.debug("Sending error data for harvest of %r.", self._app_name)
+                                uploader.upload(session.send_errors, error_data)
 
-                            self._active_session.send_errors(error_data)
+                        if not flexible:
+                            if configuration.collect_traces:
+                                connections = self._explain_plan_pool
 
-                    if not flexible:
-                        if configuration.collect_traces:
-                            connections = SQLConnections(configuration.agent_limits.max_sql_connections)
+                                if connections is None:
+                                    connections = SQLConnections(configuration.agent_limits.max_sql_connections)
 
-                            with connections:
-                                if configuration.slow_sql.enabled:
-                                    _logger.debug("Processing slow SQL data for harvest of %r.", self._app_name)
+                                with connections:
+                                    if configuration.slow_sql.enabled:
+                                        _logger.debug("Processing slow SQL data for harvest of %r.", self._app_name)
 
-                                    slow_sql_data = stats.slow_sql_data(connections)
+                                        slow_sql_data = stats.slow_sql_data(connections)
 
-                                    if slow_sql_data:
-                                        _logger.debug("Sending slow SQL data for harvest of %r.", self._app_name)
+                                        if slow_sql_data:
+                                            _logger.debug("Sending slow SQL data for harvest of %r.", self._app_name)
 
-                                        self._active_session.send_sql_traces(slow_sql_data)
+                                            uploader.upload(session.send_sql_traces, slow_sql_data)
 
-                                slow_transaction_data = stats.transaction_trace_data(connections)
+                                    slow_transaction_data = stats.transaction_trace_data(connections)
 
-                                if slow_transaction_data:
-                                    _logger.debug("Sending slow transaction data for harvest of %r.", self._app_name)
+                                    if slow_transaction_data:
+                                        _logger.debug(
+                                            "Sending slow transaction data for harvest of %r.", self._app_name
+                                        )
 
-                                    self._active_session.send_transaction_traces(slow_transaction_data)
+                                        uploader.upload(session.send_transaction_traces, slow_transaction_data)
 
+                    if not flexible:
                         # Create a metric_normalizer based on normalize_name
                         # If metric rename rules are empty, set normalizer
                         # to None and the stats engine will skip steps as
@@ -1554,6 +1890,24 @@ class Application:
 
                         self._period_start = period_end
 
+                        # Now that the data collector can be reached, send
+                        # any data written to the spool by earlier harvests
+                        # which failed. Failing to do so leaves the data in
+                        # the spool for the next harvest.
+
+                        if harvest_spool is not None:
+                            try:
+                                drained = self._active_session.drain_spool()
+                            except Exception:
+                                _logger.debug(
+                                    "Unable to send spooled data for harvest of %r.", self._app_name, exc_info=True
+                                )
+                            else:
+                                if drained:
+                                    _logger.debug(
+                                        "Sent %d spooled payloads for harvest of %r.", drained, self._app_name
+                                    )
+
                         # Fetch agent commands sent from the data collector
                         # and process them.
 
@@ -1708,6 +2062,28 @@ class Application:
 
         self.stop_data_samplers()
 
+        # Stop the background transaction recorder. Anything still queued
+        # at this point belongs to the session being shutdown and will be
+        # discarded by the worker thread.
+
+        if self._transaction_recorder is not None:
+            self._transaction_recorder.shutdown(timeout=0.0)
+            self._transaction_recorder = None
+
+        # Stop the background thread used for explain plans, which will
+        # close any database connections it holds.
+
+        if self._explain_plan_pool is not None:
+            self._explain_plan_pool.shutdown()
+            self._explain_plan_pool = None
+
+        # Seal the segment of the spool being written to so that what it
+        # holds can be sent by the next session or process.
+
+        if self._harvest_spool is not None:
+            self._harvest_spool.close()
+            self._harvest_spool = None
+
         # Finishes collecting environment plugin information
         # if this has not been completed during harvest
         # lifetime of the application
@@ -58,11 +58,27 @@ class AttributeFilter():
     #      the bitfield.
     #
     #   4. Return the resulting bitfield after all rules have been applied.
+    #
+    # Rather than testing every rule against the attribute name, the rules
+    # are compiled into a prefix trie keyed on the characters of the rule
+    # names. Only rules whose names are a prefix of the attribute name can
+    # match, and since the rules are sorted such that shorter names come
+    # first, walking the trie along the attribute name visits the matching
+    # rules in the same order as traversing the sorted list would. The
+    # rules attached to a node of the trie are reduced to a pair of masks,
+    # so applying them takes a single step no matter how many there are.
+    #
+    # Results are cached against the attribute name and default
+    # destinations. The cache is cleared when it reaches the size given by
+    # the attributes.filter_cache_size setting so that high cardinality
+    # attribute names do not cause it to grow without bound.
 
     def __init__(self, flattened_settings):
         self.enabled_destinations = self._set_enabled_destinations(flattened_settings)
         self.rules = self._build_rules(flattened_settings)
+        self.trie = self._build_trie(self.rules)
         self.cache = {}
+        self.cache_size = flattened_settings.get("attributes.filter_cache_size", 10000)
 
     def __repr__(self):
         return f"<AttributeFilter: destinations: {bin(self.enabled_destinations)}, rules: {self.rules}>"
@@ -136,29 +152,96 @@ class AttributeFilter():
 
         return tuple(rules)
 
+    def _build_trie(self, rules):
+        # Build the trie from the sorted rules. Include rules can only add
+        # destinations which are enabled, so they are masked against the
+        # enabled destinations at this point.
+
+        root = AttributeFilterTrieNode()
+
+        for rule in rules:
+            node = root
+            for char in rule.name:
+                node = node.children.setdefault(char, AttributeFilterTrieNode())
+
+            if rule.is_include:
+                node.add_include(rule.is_wildcard, rule.destinations & self.enabled_destinations)
+            else:
+                node.add_exclude(rule.is_wildcard, rule.destinations)
+
+        return root
+
     def apply(self, name, default_destinations):
         if self.enabled_destinations == DST_NONE:
             return DST_NONE
 
         cache_index = (name, default_destinations)
 
-        if cache_index in self.cache:
-            return self.cache[cache_index]
+        cache = self.cache
+        if cache_index in cache:
+            return cache[cache_index]
 
         destinations = self.enabled_destinations & default_destinations
 
-        for rule in self.rules:
-            if rule.name_match(name):
-                if rule.is_include:
-                    inc_dest = rule.destinations & self.enabled_destinations
-                    destinations |= inc_dest
-                else:
-                    destinations &= ~rule.destinations
+        node = self.trie
 
-        self.cache[cache_index] = destinations
+        if node.wildcard is not None:
+            destinations = (destinations & node.wildcard[0]) | node.wildcard[1]
+
+        for char in name:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.wildcard is not None:
+                destinations = (destinations & node.wildcard[0]) | node.wildcard[1]
+        else:
+            if node.exact is not None:
+                destinations = (destinations & node.exact[0]) | node.exact[1]
+
+        if len(cache) >= self.cache_size:
+            cache.clear()
+
+        cache[cache_index] = destinations
         return destinations
 
 
+class AttributeFilterTrieNode():
+    # A node in the prefix trie of attribute filter rules, reached by the
+    # characters of a rule name from the root of the trie.
+    #
+    # The effect of the wildcard rules and the exact match rules for the
+    # name of the node are each held as a tuple of (and_mask, or_mask),
+    # with the destinations after applying the rules being given by
+    # (destinations & and_mask) | or_mask. Applying a further include rule
+    # ors its destinations into or_mask, whereas applying a further exclude
+    # rule removes its destinations from both masks.
+
+    __slots__ = ("children", "wildcard", "exact")
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.exact = None
+
+    def _masks(self, is_wildcard):
+        masks = self.wildcard if is_wildcard else self.exact
+        return masks if masks is not None else (DST_ALL, DST_NONE)
+
+    def _set_masks(self, is_wildcard, masks):
+        if is_wildcard:
+            self.wildcard = masks
+        else:
+            self.exact = masks
+
+    def add_include(self, is_wildcard, destinations):
+        and_mask, or_mask = self._masks(is_wildcard)
+        self._set_masks(is_wildcard, (and_mask, or_mask | destinations))
+
+    def add_exclude(self, is_wildcard, destinations):
+        and_mask, or_mask = self._masks(is_wildcard)
+        self._set_masks(is_wildcard, (and_mask & ~destinations, or_mask & ~destinations))
+
+
 class AttributeFilterRule():
     def __init__(self, name, destinations, is_include):
         self.name = name.rstrip("*")
@@ -27,6 +27,7 @@ import copy
 import logging
 import os
 import re
+import tempfile
 import threading
 import urllib.parse as urlparse
 
@@ -177,6 +178,10 @@ class ThreadProfilerSettings(Settings):
     pass
 
 
+class TraceCacheSettings(Settings):
+    pass
+
+
 class TransactionTracerSettings(Settings):
     pass
 
@@ -223,6 +228,18 @@ class AgentLimitsSettings(Settings):
     pass
 
 
+class AdaptiveCompressionSettings(Settings):
+    pass
+
+
+class AggregatorSettings(Settings):
+    pass
+
+
+class ConnectionPoolSettings(Settings):
+    pass
+
+
 class ConsoleSettings(Settings):
     pass
 
@@ -239,6 +256,10 @@ class TransactionEventsSettings(Settings):
     pass
 
 
+class TransactionRecorderSettings(Settings):
+    pass
+
+
 class TransactionEventsAttributesSettings(Settings):
     pass
 
@@ -267,6 +288,22 @@ class UtilizationSettings(Settings):
     pass
 
 
+class StatsEngineSettings(Settings):
+    pass
+
+
+class ExplainPlanSettings(Settings):
+    pass
+
+
+class OtlpSettings(Settings):
+    pass
+
+
+class ParallelHarvestSettings(Settings):
+    pass
+
+
 class StripExceptionMessageSettings(Settings):
     pass
 
@@ -303,6 +340,10 @@ class ServerlessModeSettings(Settings):
     pass
 
 
+class SpoolSettings(Settings):
+    pass
+
+
 class TransactionSegmentSettings(Settings):
     pass
 
@@ -425,7 +466,9 @@ class EventHarvestConfigHarvestLimitSettings(Settings):
 
 
 _settings = TopLevelSettings()
+_settings.adaptive_compression = AdaptiveCompressionSettings()
 _settings.agent_limits = AgentLimitsSettings()
+_settings.aggregator = AggregatorSettings()
 _settings.application_logging = ApplicationLoggingSettings()
 _settings.application_logging.forwarding = ApplicationLoggingForwardingSettings()
 _settings.application_logging.forwarding.labels = ApplicationLoggingForwardingLabelsSettings()
@@ -445,6 +488,7 @@ _settings.attributes = AttributesSettings()
 _settings.browser_monitoring = BrowserMonitorSettings()
 _settings.browser_monitoring.attributes = BrowserMonitorAttributesSettings()
 _settings.code_level_metrics = CodeLevelMetricsSettings()
+_settings.connection_pool = ConnectionPoolSettings()
 _settings.console = ConsoleSettings()
 _settings.cross_application_tracer = CrossApplicationTracerSettings()
 _settings.custom_insights_events = CustomInsightsEventsSettings()
@@ -459,6 +503,7 @@ _settings.error_collector.attributes = ErrorCollectorAttributesSettings()
 _settings.event_harvest_config = EventHarvestConfigSettings()
 _settings.event_harvest_config.harvest_limits = EventHarvestConfigHarvestLimitSettings()
 _settings.event_loop_visibility = EventLoopVisibilitySettings()
+_settings.explain_plan = ExplainPlanSettings()
 _settings.gc_runtime_metrics = GCRuntimeMetricsSettings()
 _settings.memory_runtime_pid_metrics = MemoryRuntimeMetricsSettings()
 _settings.heroku = HerokuSettings()
@@ -466,19 +511,25 @@ _settings.infinite_tracing = InfiniteTracingSettings()
 _settings.instrumentation = InstrumentationSettings()
 _settings.instrumentation.graphql = InstrumentationGraphQLSettings()
 _settings.message_tracer = MessageTracerSettings()
+_settings.otlp = OtlpSettings()
+_settings.parallel_harvest = ParallelHarvestSettings()
 _settings.process_host = ProcessHostSettings()
 _settings.rum = RumSettings()
 _settings.serverless_mode = ServerlessModeSettings()
 _settings.slow_sql = SlowSqlSettings()
 _settings.span_events = SpanEventSettings()
 _settings.span_events.attributes = SpanEventAttributesSettings()
+_settings.spool = SpoolSettings()
+_settings.stats_engine = StatsEngineSettings()
 _settings.strip_exception_messages = StripExceptionMessageSettings()
 _settings.synthetics = SyntheticsSettings()
 _settings.thread_profiler = ThreadProfilerSettings()
+_settings.trace_cache = TraceCacheSettings()
 _settings.transaction_events = TransactionEventsSettings()
 _settings.transaction_events.attributes = TransactionEventsAttributesSettings()
 _settings.transaction_metrics = TransactionMetricsSettings()
 _settings.transaction_name = TransactionNameSettings()
+_settings.transaction_recorder = TransactionRecorderSettings()
 _settings.transaction_segments = TransactionSegmentSettings()
 _settings.transaction_segments.attributes = TransactionSegmentAttributesSettings()
 _settings.transaction_tracer = TransactionTracerSettings()
@@ -661,6 +712,8 @@ _settings.host = os.environ.get("NEW_RELIC_HOST")
 _settings.otlp_host = os.environ.get("NEW_RELIC_OTLP_HOST")
 _settings.port = int(os.environ.get("NEW_RELIC_PORT", "0"))
 _settings.otlp_port = int(os.environ.get("NEW_RELIC_OTLP_PORT", "0"))
+_settings.otlp.metric_data = _environ_as_bool("NEW_RELIC_OTLP_METRIC_DATA", default=False)
+_settings.otlp.span_event_data = _environ_as_bool("NEW_RELIC_OTLP_SPAN_EVENT_DATA", default=False)
 
 _settings.agent_run_id = None
 _settings.entity_guid = None
@@ -743,11 +796,16 @@ _settings.sampling_target = 10
 _settings.sampling_target_period_in_seconds = 60
 
 _settings.compressed_content_encoding = "gzip"
+_settings.adaptive_compression.enabled = _environ_as_bool("NEW_RELIC_ADAPTIVE_COMPRESSION_ENABLED", default=False)
+_settings.adaptive_compression.time_budget = _environ_as_float("NEW_RELIC_ADAPTIVE_COMPRESSION_TIME_BUDGET", 1.0)
+_settings.adaptive_compression.zstd = _environ_as_bool("NEW_RELIC_ADAPTIVE_COMPRESSION_ZSTD", default=False)
+_settings.json_backend = os.environ.get("NEW_RELIC_JSON_BACKEND", "auto")
 _settings.max_payload_size_in_bytes = 1000000
 
 _settings.attributes.enabled = True
 _settings.attributes.exclude = []
 _settings.attributes.include = []
+_settings.attributes.filter_cache_size = 10000
 
 _settings.thread_profiler.enabled = True
 _settings.cross_application_tracer.enabled = False
@@ -821,7 +879,45 @@ _settings.browser_monitoring.attributes.include = []
 _settings.transaction_name.limit = None
 _settings.transaction_name.naming_scheme = os.environ.get("NEW_RELIC_TRANSACTION_NAMING_SCHEME")
 
+_settings.stats_engine.shards = _environ_as_int("NEW_RELIC_STATS_ENGINE_SHARDS", 0)
+_settings.stats_engine.columnar_metrics = _environ_as_bool("NEW_RELIC_STATS_ENGINE_COLUMNAR_METRICS", default=False)
+_settings.stats_engine.shared_metrics = _environ_as_bool("NEW_RELIC_STATS_ENGINE_SHARED_METRICS", default=False)
+_settings.stats_engine.shared_metrics_slots = _environ_as_int("NEW_RELIC_STATS_ENGINE_SHARED_METRICS_SLOTS", default=4096)
+_settings.stats_engine.shared_metrics_workers = _environ_as_int(
+    "NEW_RELIC_STATS_ENGINE_SHARED_METRICS_WORKERS", default=32
+)
+
+_settings.trace_cache.context_variables = _environ_as_bool("NEW_RELIC_TRACE_CACHE_CONTEXT_VARIABLES", default=False)
+
+_settings.transaction_recorder.enabled = _environ_as_bool("NEW_RELIC_TRANSACTION_RECORDER_ENABLED", default=False)
+_settings.transaction_recorder.queue_size = _environ_as_int("NEW_RELIC_TRANSACTION_RECORDER_QUEUE_SIZE", 1000)
+_settings.transaction_recorder.overflow_policy = os.environ.get(
+    "NEW_RELIC_TRANSACTION_RECORDER_OVERFLOW_POLICY", "drop"
+)
+_settings.transaction_recorder.block_timeout = _environ_as_float("NEW_RELIC_TRANSACTION_RECORDER_BLOCK_TIMEOUT", 0.1)
+_settings.transaction_recorder.flush_timeout = _environ_as_float("NEW_RELIC_TRANSACTION_RECORDER_FLUSH_TIMEOUT", 5.0)
+
+_settings.explain_plan.pool_enabled = _environ_as_bool("NEW_RELIC_EXPLAIN_PLAN_POOL_ENABLED", default=False)
+_settings.explain_plan.cache_ttl = _environ_as_float("NEW_RELIC_EXPLAIN_PLAN_CACHE_TTL", 300.0)
+_settings.explain_plan.harvest_timeout = _environ_as_float("NEW_RELIC_EXPLAIN_PLAN_HARVEST_TIMEOUT", 5.0)
+_settings.explain_plan.idle_timeout = _environ_as_float("NEW_RELIC_EXPLAIN_PLAN_IDLE_TIMEOUT", 300.0)
+
+_settings.aggregator.enabled = _environ_as_bool("NEW_RELIC_AGGREGATOR_ENABLED", default=False)
+_settings.aggregator.socket_path = os.environ.get(
+    "NEW_RELIC_AGGREGATOR_SOCKET_PATH", os.path.join(tempfile.gettempdir(), "newrelic-aggregator.sock")
+)
+
+_settings.parallel_harvest.enabled = _environ_as_bool("NEW_RELIC_PARALLEL_HARVEST_ENABLED", default=False)
+_settings.parallel_harvest.max_workers = _environ_as_int("NEW_RELIC_PARALLEL_HARVEST_MAX_WORKERS", 4)
+
 _settings.slow_sql.enabled = True
+_settings.slow_sql.fingerprint = _environ_as_bool("NEW_RELIC_SLOW_SQL_FINGERPRINT", default=False)
+
+_settings.spool.enabled = _environ_as_bool("NEW_RELIC_SPOOL_ENABLED", default=False)
+_settings.spool.directory = os.environ.get("NEW_RELIC_SPOOL_DIRECTORY", None)
+_settings.spool.max_bytes = _environ_as_int("NEW_RELIC_SPOOL_MAX_BYTES", 10 * 1024 * 1024)
+_settings.spool.max_age = _environ_as_float("NEW_RELIC_SPOOL_MAX_AGE", 3600.0)
+_settings.spool.segment_bytes = _environ_as_int("NEW_RELIC_SPOOL_SEGMENT_BYTES", 1024 * 1024)
 
 _settings.synthetics.enabled = True
 
@@ -842,6 +938,9 @@ _settings.agent_limits.synthetics_events = 200
 _settings.agent_limits.synthetics_transactions = 20
 _settings.agent_limits.data_compression_threshold = 64 * 1024
 _settings.agent_limits.data_compression_level = None
+_settings.agent_limits.sql_statement_cache_entries = 1000
+_settings.agent_limits.sql_statement_cache_bytes = 1024 * 1024
+_settings.agent_limits.rules_engine_cache_entries = 1000
 
 _settings.infinite_tracing.trace_observer_host = os.environ.get("NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_HOST", None)
 _settings.infinite_tracing.trace_observer_port = _environ_as_int("NEW_RELIC_INFINITE_TRACING_TRACE_OBSERVER_PORT", 443)
@@ -878,6 +977,10 @@ _settings.event_harvest_config.harvest_limits.log_event_data = _environ_as_int(
     "NEW_RELIC_APPLICATION_LOGGING_FORWARDING_MAX_SAMPLES_STORED", LOG_EVENT_RESERVOIR_SIZE
 )
 
+_settings.connection_pool.enabled = _environ_as_bool("NEW_RELIC_CONNECTION_POOL_ENABLED", default=False)
+_settings.connection_pool.size = _environ_as_int("NEW_RELIC_CONNECTION_POOL_SIZE", 4)
+_settings.connection_pool.http2 = _environ_as_bool("NEW_RELIC_CONNECTION_POOL_HTTP2", default=False)
+
 _settings.console.listener_socket = None
 _settings.console.allow_interpreter_cmd = False
 
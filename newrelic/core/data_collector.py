@@ -19,37 +19,104 @@
 import logging
 
 from newrelic.common.agent_http import (
+    AggregatorModeClient,
     ApplicationModeClient,
     DeveloperModeClient,
     ServerlessModeClient,
 )
 from newrelic.core.agent_protocol import (
     AgentProtocol,
+    AggregatorModeProtocol,
     OtlpProtocol,
     ServerlessModeProtocol,
 )
 from newrelic.core.agent_streaming import StreamingRpc
 from newrelic.core.config import global_settings
-from newrelic.core.otlp_utils import encode_metric_data, encode_ml_event_data
+from newrelic.core.otlp_utils import (
+    encode_metric_data,
+    encode_ml_event_data,
+    encode_span_event_data,
+    encode_timeslice_metric_data,
+)
+from newrelic.core.internal_metrics import internal_count_metric
+from newrelic.network.exceptions import DiscardDataForRequest, PayloadTooLarge, RetryDataForRequest
 
 from newrelic.core.attribute import process_user_attribute, MAX_NUM_USER_ATTRIBUTES
 
 _logger = logging.getLogger(__name__)
 
+# Collector methods for harvest data which can be sent by a session other
+# than the one which created the payload, such as when the payload is written
+# to the harvest spool or received by the aggregator, mapped to whether the
+# payload begins with the agent run ID, which must be replaced with that of
+# the session sending it.
+
+DATA_METHODS = {
+    "analytic_event_data": True,
+    "custom_event_data": True,
+    "error_data": True,
+    "error_event_data": True,
+    "log_event_data": False,
+    "metric_data": True,
+    "span_event_data": True,
+    "sql_trace_data": False,
+    "transaction_sample_data": True,
+}
+
+# Collector methods for sampled event data, where the payload is made up of
+# the agent run ID, the sampling information for the reservoir and the list
+# of events, and which can be split into multiple requests when too large.
+
+SAMPLED_DATA_METHODS = frozenset(("analytic_event_data", "custom_event_data", "error_event_data", "span_event_data"))
+
+
+def split_sample_set(sampling_info, samples):
+    """Splits the events from a reservoir into two halves, each with the
+    sampling information apportioned to it. The events seen and reservoir
+    size of the halves add up to those of the original reservoir, so that
+    the sampling rate derived by the data collector is unchanged.
+
+    """
+
+    samples = list(samples)
+    half = len(samples) // 2
+    slices = (samples[:half], samples[half:])
+
+    if sampling_info is None:
+        return tuple((None, events) for events in slices)
+
+    first = dict(sampling_info)
+    second = dict(sampling_info)
+
+    for key in ("events_seen", "reservoir_size"):
+        if key in sampling_info:
+            first[key] = sampling_info[key] * half // len(samples)
+            second[key] = sampling_info[key] - first[key]
+
+    return ((first, slices[0]), (second, slices[1]))
+
 
 class Session:
     PROTOCOL = AgentProtocol
     OTLP_PROTOCOL = OtlpProtocol
     CLIENT = ApplicationModeClient
+    OTLP_CLIENT = None
+
+    # Whether metric data and span events can be sent to the OTLP API
+    # endpoints when enabled, in place of being sent to the data collector.
+
+    OTLP_HARVEST_DATA = True
 
     def __init__(self, app_name, linked_applications, environment, settings):
         self._protocol = self.PROTOCOL.connect(
             app_name, linked_applications, environment, settings, client_cls=self.CLIENT
         )
         self._otlp_protocol = self.OTLP_PROTOCOL.connect(
-            app_name, linked_applications, environment, settings, client_cls=self.CLIENT
+            app_name, linked_applications, environment, settings, client_cls=self.OTLP_CLIENT or self.CLIENT
         )
         self._rpc = None
+        self.spool = None
+        self._spooled = False
 
     @property
     def configuration(self):
@@ -59,6 +126,10 @@ class Session:
     def agent_run_id(self):
         return self._protocol.configuration.agent_run_id
 
+    @property
+    def server_configuration(self):
+        return self._protocol.server_configuration
+
     def close_connection(self):
         self._protocol.close_connection()
 
@@ -93,6 +164,126 @@ class Session:
         if self._rpc:
             self._rpc.close()
 
+    def _send_data(self, method, payload):
+        """Sends harvest data to the data collector. If the request fails
+        in a way where the data would be retried on the next harvest and a
+        harvest spool is configured, the data is instead written to the
+        spool and will be sent by a later call to drain_spool().
+
+        """
+
+        try:
+            return self._protocol.send(method, payload)
+        except RetryDataForRequest:
+            if self.spool is None or not self.spool.write(method, payload):
+                raise
+
+            self._spooled = True
+
+            _logger.debug("Wrote %r data which could not be sent to the harvest spool.", method)
+
+    def _send_sample_set(self, method, sampling_info, samples, payload_func):
+        """Sends sampled event data to the data collector. If the payload
+        is rejected as being larger than the maximum payload size, the
+        events are split in half and each half sent as a separate request,
+        recursively, until each request fits or consists of only a single
+        event which is too large to be sent on its own. Such an event is
+        dropped, with the remaining events still being sent. The error is
+        only raised if none of the events could be sent. Once some of the
+        events have been sent, a failure which would result in all of them
+        being retried on the next harvest instead results in the remaining
+        events being discarded, so that events are not sent twice.
+
+        """
+
+        payload = payload_func(sampling_info, samples)
+
+        try:
+            return self._send_data(method, payload)
+        except PayloadTooLarge:
+            samples = list(samples)
+            if len(samples) < 2:
+                internal_count_metric(f"Supportability/Python/Collector/PayloadDropped/{method}", len(samples))
+                raise
+
+        internal_count_metric(f"Supportability/Python/Collector/PayloadSplit/{method}", 1)
+
+        _logger.debug(
+            "Splitting %d events for %r into separate requests to fit the maximum payload size.", len(samples), method
+        )
+
+        result = None
+        error = None
+        sent = False
+
+        for slice_info, slice_samples in split_sample_set(sampling_info, samples):
+            try:
+                result = self._send_sample_set(method, slice_info, slice_samples, payload_func)
+            except PayloadTooLarge as exc:
+                # None of the events in this slice could be sent as each
+                # was too large on its own, but the other slice may still
+                # be sent.
+
+                error = exc
+            except RetryDataForRequest:
+                if not sent:
+                    raise
+
+                raise DiscardDataForRequest(f"Some {method} events sent but remaining events could not be sent.")
+            else:
+                sent = True
+
+        if not sent:
+            raise error
+
+        return result
+
+    def _sampled_payload(self, sampling_info, samples):
+        return (self.agent_run_id, sampling_info, samples)
+
+    def _replace_run_id(self, method, payload):
+        if DATA_METHODS.get(method):
+            payload[0] = self.agent_run_id
+        return payload
+
+    def forward_data(self, method, payload):
+        """Sends a payload of harvest data which was created by another
+        session, such as that of an agent reporting through the aggregator.
+        The payload must be a list, with any agent run ID it holds being
+        replaced with that of this session.
+
+        """
+
+        # Metric data and span events go via the methods which would send
+        # them to the OTLP API endpoints if enabled.
+
+        if method == "metric_data":
+            return self.send_metric_data(*payload[1:])
+        elif method == "span_event_data":
+            return self.send_span_events(*payload[1:])
+        elif method in SAMPLED_DATA_METHODS:
+            return self._send_sample_set(method, payload[1], payload[2], self._sampled_payload)
+
+        return self._send_data(method, self._replace_run_id(method, payload))
+
+    def drain_spool(self):
+        """Sends any harvest data which was previously written to the
+        harvest spool. Returns the number of payloads which were sent.
+        Nothing is sent if data was written to the spool since the last
+        call, as the data collector is then unlikely to be reachable.
+
+        """
+
+        spooled, self._spooled = self._spooled, False
+
+        if self.spool is None or spooled:
+            return 0
+
+        def send(method, payload):
+            return self._protocol.send(method, self._replace_run_id(method, payload))
+
+        return self.spool.drain(send)
+
     def send_transaction_traces(self, transaction_traces):
         """Called to submit transaction traces. The transaction traces
         should be an iterable of individual traces.
@@ -107,19 +298,17 @@ class Session:
             return
 
         payload = (self.agent_run_id, transaction_traces)
-        return self._protocol.send("transaction_sample_data", payload)
+        return self._send_data("transaction_sample_data", payload)
 
     def send_transaction_events(self, sampling_info, sample_set):
         """Called to submit sample set for analytics."""
 
-        payload = (self.agent_run_id, sampling_info, sample_set)
-        return self._protocol.send("analytic_event_data", payload)
+        return self._send_sample_set("analytic_event_data", sampling_info, sample_set, self._sampled_payload)
 
     def send_custom_events(self, sampling_info, custom_event_data):
         """Called to submit sample set for custom events."""
 
-        payload = (self.agent_run_id, sampling_info, custom_event_data)
-        return self._protocol.send("custom_event_data", payload)
+        return self._send_sample_set("custom_event_data", sampling_info, custom_event_data, self._sampled_payload)
 
     def send_ml_events(self, sampling_info, custom_event_data):
         """Called to submit sample set for machine learning events."""
@@ -127,20 +316,48 @@ class Session:
         return self._otlp_protocol.send("ml_event_data", payload, path="/v1/logs")
 
     def send_span_events(self, sampling_info, span_event_data):
-        """Called to submit sample set for span events."""
+        """Called to submit sample set for span events. If enabled, the
+        span events are instead sent to the OTLP API endpoints.
+
+        """
+
+        if self.OTLP_HARVEST_DATA and self.configuration.otlp.span_event_data:
+            payload = encode_span_event_data(span_event_data, str(self.agent_run_id))
+            return self._otlp_protocol.send("span_event_data", payload, path="/v1/logs")
 
-        payload = (self.agent_run_id, sampling_info, span_event_data)
-        return self._protocol.send("span_event_data", payload)
+        return self._send_sample_set("span_event_data", sampling_info, span_event_data, self._sampled_payload)
 
     def send_metric_data(self, start_time, end_time, metric_data):
         """Called to submit metric data for specified period of time.
         Time values are seconds since UNIX epoch as returned by the
         time.time() function. The metric data should be iterable of
         specific metrics.
+
+        If enabled, the metrics are instead sent to the OTLP API endpoints,
+        with only those which can't be represented as OTLP metrics still
+        being sent to the data collector. Those are only sent once the OTLP
+        metrics have been sent, so that a failure which results in all the
+        metrics being retried on the next harvest can't double count them.
         """
 
+        if self.OTLP_HARVEST_DATA and self.configuration.otlp.metric_data:
+            payload, metric_data = encode_timeslice_metric_data(metric_data, start_time, end_time)
+
+            result = self._otlp_protocol.send("metric_data", payload, path="/v1/metrics")
+
+            if metric_data:
+                try:
+                    self._send_data("metric_data", (self.agent_run_id, start_time, end_time, metric_data))
+                except RetryDataForRequest:
+                    # The OTLP metrics have already been sent so the
+                    # metrics can't be retried as a whole.
+
+                    raise DiscardDataForRequest("OTLP metrics sent but remaining metric data could not be sent.")
+
+            return result
+
         payload = (self.agent_run_id, start_time, end_time, metric_data)
-        return self._protocol.send("metric_data", payload)
+        return self._send_data("metric_data", payload)
 
     def send_dimensional_metric_data(self, start_time, end_time, metric_data):
         """Called to submit dimensional metric data for specified period of time.
@@ -202,14 +419,16 @@ class Session:
     def send_log_events(self, sampling_info, log_event_data):
         """Called to submit sample set for log events."""
 
-        payload = ({"logs": tuple(log._asdict() for log in log_event_data)},)
-
         # Add common block attributes if not empty
         common = self.get_log_events_common_block()
-        if common:
-            payload[0]["common"] = {"attributes": common}
 
-        return self._protocol.send("log_event_data", payload)
+        def log_events_payload(sampling_info, log_event_data):
+            payload = ({"logs": tuple(log._asdict() for log in log_event_data)},)
+            if common:
+                payload[0]["common"] = {"attributes": common}
+            return payload
+
+        return self._send_sample_set("log_event_data", sampling_info, log_event_data, log_events_payload)
 
     def get_agent_commands(self):
         """Receive agent commands from the data collector."""
@@ -227,13 +446,12 @@ class Session:
 
         """
         payload = (self.agent_run_id, errors)
-        return self._protocol.send("error_data", payload)
+        return self._send_data("error_data", payload)
 
     def send_error_events(self, sampling_info, error_data):
         """Called to submit sample set for error events."""
 
-        payload = (self.agent_run_id, sampling_info, error_data)
-        return self._protocol.send("error_event_data", payload)
+        return self._send_sample_set("error_event_data", sampling_info, error_data, self._sampled_payload)
 
     def send_sql_traces(self, sql_traces):
         """Called to sub SQL traces. The SQL traces should be an
@@ -245,7 +463,7 @@ class Session:
         """
 
         payload = (sql_traces,)
-        return self._protocol.send("sql_trace_data", payload)
+        return self._send_data("sql_trace_data", payload)
 
     def send_agent_command_results(self, cmd_results):
         """Acknowledge the receipt of an agent command."""
@@ -292,6 +510,7 @@ class DeveloperModeSession(Session):
 class ServerlessModeSession(Session):
     PROTOCOL = ServerlessModeProtocol
     CLIENT = ServerlessModeClient
+    OTLP_HARVEST_DATA = False
 
     @staticmethod
     def connect_span_stream(*args, **kwargs):
@@ -306,10 +525,32 @@ class ServerlessModeSession(Session):
         pass
 
 
+class AggregatorModeSession(Session):
+    PROTOCOL = AggregatorModeProtocol
+    CLIENT = AggregatorModeClient
+
+    # The OTLP payloads are protobuf encoded and can't be merged by the
+    # aggregator so are still sent directly.
+
+    OTLP_CLIENT = ApplicationModeClient
+
+    # Metric data and span events are always sent to the aggregator so
+    # they can be merged, leaving it to the aggregator to send them to the
+    # OTLP API endpoints if enabled.
+
+    OTLP_HARVEST_DATA = False
+
+    @staticmethod
+    def connect_span_stream(*args, **kwargs):
+        pass
+
+
 def create_session(license_key, app_name, linked_applications, environment):
     settings = global_settings()
     if settings.serverless_mode.enabled:
         return ServerlessModeSession(app_name, linked_applications, environment, settings)
+    elif settings.aggregator.enabled:
+        return AggregatorModeSession(app_name, linked_applications, environment, settings)
     elif settings.developer_mode:
         return DeveloperModeSession(app_name, linked_applications, environment, settings)
     else:
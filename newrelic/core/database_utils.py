@@ -18,8 +18,11 @@ explain plans for SQL etc.
 """
 
 import logging
+import os
 import re
-import weakref
+import threading
+import time
+from collections import OrderedDict, deque
 
 
 from newrelic.core.internal_metrics import internal_metric
@@ -95,18 +98,35 @@ _quotes_table = {
     'single+oracle': (_single_oracle_re, _single_quotes_cleanup_re),
 }
 
+# For each quoting style the quoted strings and literals are matched by a
+# single regular expression so the statement is only scanned once. Quoted
+# strings come first in the alternation so that they take precedence over
+# any literals contained within them. Only the literals are matched
+# ignoring case, as the quoting style patterns are case sensitive. None of
+# the quoting style patterns other than for dollar quotes contain capturing
+# groups, so the back reference in the dollar quotes pattern is unchanged.
+#
+# The leading lookahead lists every character any of the alternatives can
+# start with. This lets the scan skip over most characters of a statement
+# without trying each of the alternatives in turn.
+
+_obfuscate_start_p = r"""(?=[-'"$q{0-9a-fA-FnNtT])"""
+
+_obfuscate_table = {
+    quoting_style: (
+        re.compile(f"{_obfuscate_start_p}(?:{quotes_re.pattern}|(?i:{_all_literals_p}))"),
+        quotes_cleanup_re,
+    )
+    for quoting_style, (quotes_re, quotes_cleanup_re) in _quotes_table.items()
+}
 
-def _obfuscate_sql(sql, database):
-    quotes_re, quotes_cleanup_re = _quotes_table.get(database.quoting_style,
-            (_single_quotes_re, _single_quotes_cleanup_re))
-
-    # Substitute quoted strings first.
 
-    sql = quotes_re.sub('?', sql)
+def _obfuscate_sql(sql, database):
+    obfuscate_re, quotes_cleanup_re = _obfuscate_table.get(database.quoting_style, _obfuscate_table['single'])
 
-    # Replace all other sensitive fields
+    # Substitute quoted strings and all other sensitive fields.
 
-    sql = _all_literals_re.sub('?', sql)
+    sql = obfuscate_re.sub('?', sql)
 
     # Determine if the obfuscated query was malformed by searching for
     # remaining quote characters
@@ -188,6 +208,39 @@ def _normalize_sql(sql):
 
     return sql
 
+
+# Fingerprinting of the SQL goes further than normalization and is used
+# in place of the normalized SQL to identify slow SQL when enabled by the
+# slow_sql.fingerprint setting. ORMs will generate statements which differ
+# only in the number of values in an IN list or the number of rows in a
+# VALUES clause. Normalization collapses a single parenthesised set of
+# values, but leaves a list of such sets following VALUES or IN, as found
+# with multi row inserts or IN lists of tuples, as well as PostgreSQL array
+# literals outside of parentheses. These are collapsed to a single value so
+# all the variants have the same identifier.
+
+_fingerprint_values_p = r'\b(VALUES|IN)\(\?\)(?:,\(\?\))+'
+_fingerprint_values_re = re.compile(_fingerprint_values_p, re.IGNORECASE)
+
+_fingerprint_array_p = r'\bARRAY\s*\[[^\]]*\]'
+_fingerprint_array_re = re.compile(_fingerprint_array_p, re.IGNORECASE)
+
+
+def _fingerprint_sql(obfuscated, normalized):
+    # Array literals are collapsed in the obfuscated SQL, before any
+    # parentheses within them are rewritten by normalization. Where there
+    # are none, the normalized SQL can be used as is.
+
+    sql, count = _fingerprint_array_re.subn('ARRAY[?]', obfuscated)
+
+    if count:
+        normalized = _normalize_sql(sql)
+
+    # Collapse a list of parenthesised sets of values to a single set.
+
+    return _fingerprint_values_re.sub(r'\1(?)', normalized)
+
+
 # Helper function for extracting out any identifier from a string which
 # might be preceded or followed by punctuation which we can expect in
 # context of SQL statements.
@@ -628,6 +681,12 @@ class SQLConnections():
 
         self.connections = []
 
+    def explain_plan(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        return _explain_plan(self, sql_statement.sql, sql_statement.database,
+                connect_params, cursor_params, sql_parameters,
+                execute_params)
+
     def __enter__(self):
         return self
 
@@ -635,6 +694,224 @@ class SQLConnections():
         self.cleanup()
 
 
+class _ExplainPlanRequest():
+
+    def __init__(self, key, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        self.key = key
+        self.sql_statement = sql_statement
+        self.connect_params = connect_params
+        self.cursor_params = cursor_params
+        self.sql_parameters = sql_parameters
+        self.execute_params = execute_params
+        self.done = False
+        self.details = None
+
+
+class ExplainPlanPool(SQLConnections):
+
+    """Database connections for explain plans which persist across
+    harvests, with the explain plans being run from a background thread.
+    This is used in place of creating a new set of SQL connections for
+    each harvest when explain_plan.pool_enabled is set.
+
+    Explain plans are cached against the fingerprint of the SQL for
+    cache_ttl seconds. When used as a context manager for a harvest, the
+    total time spent waiting on explain plans is limited to
+    harvest_timeout seconds. Any explain plan not complete in that time is
+    left to finish in the background and will be picked up from the cache
+    in a subsequent harvest. Connections are closed if no explain plans
+    have been run for idle_timeout seconds.
+
+    Database connections are only ever used from the background thread.
+
+    """
+
+    def __init__(self, maximum=4, cache_ttl=300.0, harvest_timeout=5.0,
+            idle_timeout=300.0):
+        super(ExplainPlanPool, self).__init__(maximum)
+
+        self.cache_ttl = cache_ttl
+        self.harvest_timeout = harvest_timeout
+        self.idle_timeout = idle_timeout
+
+        self._plans = {}
+        self._requests = deque()
+        self._pending = []
+        self._notify = threading.Condition()
+        self._deadline = None
+        self._shutdown = False
+
+        self._thread = None
+        self._process_id = None
+
+    def _start(self):
+        # Neither the background thread nor the database connections can
+        # be used after a fork of the process. The connections are shared
+        # with the parent and so are discarded without being closed.
+
+        process_id = os.getpid()
+
+        if self._thread is not None and self._process_id == process_id:
+            return
+
+        if self._process_id is not None and self._process_id != process_id:
+            self.connections = []
+            self._requests.clear()
+            self._pending = []
+
+        self._process_id = process_id
+
+        self._thread = threading.Thread(target=self._run,
+                name='NR-Explain-Plan-Pool')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _cached_plan(self, key, connect_params, now):
+        for params, expires, details in self._plans.get(key, ()):
+            if params == connect_params and expires > now:
+                return True, details
+        return False, None
+
+    def _cache_plan(self, key, connect_params, details):
+        expires = time.time() + self.cache_ttl
+        entries = [entry for entry in self._plans.get(key, ())
+                if entry[0] != connect_params]
+        entries.append((connect_params, expires, details))
+        self._plans[key] = entries
+
+    def _expire_plans(self):
+        now = time.time()
+        for key, entries in list(self._plans.items()):
+            entries = [entry for entry in entries if entry[1] > now]
+            if entries:
+                self._plans[key] = entries
+            else:
+                del self._plans[key]
+
+    def explain_plan(self, sql_statement, connect_params, cursor_params,
+            sql_parameters, execute_params):
+        key = (sql_statement.database.client, sql_statement.fingerprint)
+
+        with self._notify:
+            found, details = self._cached_plan(key, connect_params,
+                    time.time())
+
+            if found:
+                internal_metric('Supportability/Python/DatabaseUtils/'
+                        'Counts/explain_plan_cache_hit', 1)
+                return details
+
+            if self._shutdown:
+                return None
+
+            self._start()
+
+            for request in self._pending:
+                if (request.key == key and
+                        request.connect_params == connect_params):
+                    break
+            else:
+                request = _ExplainPlanRequest(key, sql_statement,
+                        connect_params, cursor_params, sql_parameters,
+                        execute_params)
+                self._pending.append(request)
+                self._requests.append(request)
+                self._notify.notify_all()
+
+            deadline = self._deadline
+            if deadline is None:
+                deadline = time.time() + self.harvest_timeout
+
+            while not request.done:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    internal_metric('Supportability/Python/DatabaseUtils/'
+                            'Counts/explain_plan_timeout', 1)
+                    return None
+                self._notify.wait(remaining)
+
+            return request.details
+
+    def _drop_connection(self, database, connect_params):
+        args, kwargs = connect_params
+        key = (database.client, args, kwargs)
+
+        for i, item in enumerate(self.connections):
+            if item[0] == key:
+                self.connections.pop(i)
+                try:
+                    item[1].cleanup()
+                except Exception:
+                    pass
+                break
+
+    def _run(self):
+        while True:
+            with self._notify:
+                if not self._requests and not self._shutdown:
+                    self._notify.wait(self.idle_timeout)
+
+                if self._requests:
+                    request = self._requests.popleft()
+                elif self._shutdown:
+                    break
+                else:
+                    request = None
+
+            if request is None:
+                # No explain plans have been requested for a while so
+                # close any connections rather than leave them idle.
+
+                if self.connections:
+                    self.cleanup()
+                continue
+
+            statement = request.sql_statement
+
+            details = _explain_plan(self, statement.sql, statement.database,
+                    request.connect_params, request.cursor_params,
+                    request.sql_parameters, request.execute_params)
+
+            # A failure may be due to a connection which has been closed
+            # by the database after being held for some time, so do not
+            # reuse the connection in case this is the reason.
+
+            if details is None and not _could_be_multi_query(statement.sql):
+                self._drop_connection(statement.database,
+                        request.connect_params)
+
+            with self._notify:
+                self._cache_plan(request.key, request.connect_params,
+                        details)
+                self._pending.remove(request)
+                request.details = details
+                request.done = True
+                self._notify.notify_all()
+
+        self.cleanup()
+
+    def shutdown(self):
+        """Stops the background thread, closing all connections once any
+        queued explain plans have been run.
+
+        """
+
+        with self._notify:
+            self._shutdown = True
+            self._notify.notify_all()
+
+    def __enter__(self):
+        with self._notify:
+            self._expire_plans()
+            self._deadline = time.time() + self.harvest_timeout
+        return self
+
+    def __exit__(self, exc, value, tb):
+        with self._notify:
+            self._deadline = None
+
+
 def _query_result_dicts_to_tuples(columns, rows):
     # Query results come back as a list of rows. If each row is a
     # dict, then its keys can be found in the columns list. Here, we
@@ -753,8 +1030,8 @@ def explain_plan(connections, sql_statement, connect_params, cursor_params,
     if sql_statement.operation not in database.explain_stmts:
         return
 
-    details = _explain_plan(connections, sql_statement.sql, database,
-            connect_params, cursor_params, sql_parameters, execute_params)
+    details = connections.explain_plan(sql_statement, connect_params,
+            cursor_params, sql_parameters, execute_params)
 
     if details is not None and sql_format != 'raw':
         return _obfuscate_explain_plan(database, *details)
@@ -817,6 +1094,8 @@ class SQLStatement():
         self._obfuscated = None
         self._normalized = None
         self._identifier = None
+        self._fingerprint = None
+        self._fingerprint_identifier = None
 
         if isinstance(sql, bytes):
             try:
@@ -831,6 +1110,7 @@ class SQLStatement():
                 self._uncommented = ''
                 self._obfuscated = ''
                 self._normalized = ''
+                self._fingerprint = ''
 
         self.sql = sql
         self.database = database
@@ -866,8 +1146,21 @@ class SQLStatement():
             self._normalized = _normalize_sql(self.obfuscated)
         return self._normalized
 
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = _fingerprint_sql(self.obfuscated, self.normalized)
+        return self._fingerprint
+
     @property
     def identifier(self):
+        settings = global_settings()
+
+        if settings.slow_sql.fingerprint:
+            if self._fingerprint_identifier is None:
+                self._fingerprint_identifier = hash(self.fingerprint)
+            return self._fingerprint_identifier
+
         if self._identifier is None:
             self._identifier = hash(self.normalized)
         return self._identifier
@@ -883,13 +1176,74 @@ class SQLStatement():
             return self.obfuscated
 
 
-_sql_statements = weakref.WeakValueDictionary()
+class SQLStatementCache():
+
+    """Least recently used cache of SQL statement objects keyed on the SQL
+    and the DBAPI2 module. The statement objects hold the results of
+    parsing, obfuscating and normalizing the SQL once it has been done, so
+    keeping them alive avoids repeating this work for the same SQL in
+    later transactions. The cache is bounded by both the number of entries
+    and the total length of the SQL held, as given by the settings
+    agent_limits.sql_statement_cache_entries and
+    agent_limits.sql_statement_cache_bytes.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self):
+        return self._size
+
+    def get(self, key):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, statement):
+        settings = global_settings()
+
+        max_entries = settings.agent_limits.sql_statement_cache_entries
+        max_size = settings.agent_limits.sql_statement_cache_bytes
+
+        size = len(statement.sql)
+
+        if max_entries <= 0 or size > max_size:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.sql)
+
+            self._entries[key] = statement
+            self._size += size
+
+            while len(self._entries) > max_entries or self._size > max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.sql)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+_sql_statements = SQLStatementCache()
 
 
 def sql_statement(sql, dbapi2_module):
     key = (sql, dbapi2_module)
 
-    result = _sql_statements.get(key, None)
+    result = _sql_statements.get(key)
 
     if result is not None:
         return result
@@ -897,6 +1251,6 @@ def sql_statement(sql, dbapi2_module):
     database = SQLDatabase(dbapi2_module)
     result = SQLStatement(sql, database)
 
-    _sql_statements[key] = result
+    _sql_statements.put(key, result)
 
     return result
@@ -0,0 +1,375 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a bounded on-disk spool for harvest data which
+could not be sent to the data collector, so that it can be sent once the
+data collector can be reached again rather than being held in memory, or
+lost when the process exits.
+
+The spool is a directory of append-only segment files. Each record in a
+segment is the zlib compressed JSON encoding of the name of the collector
+method, the time the record was written and the payload, prefixed with its
+length. A process appends to its own open segment, which is sealed when it
+reaches the segment size or when the spool is drained, and can then be
+claimed by any process sharing the spool directory for draining. Segments
+are discarded, oldest first, when the spool exceeds its maximum size and
+records are discarded when older than the maximum age.
+
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+from newrelic.common.encoding_utils import json_decode, json_encode
+from newrelic.network.exceptions import DiscardDataForRequest
+
+_logger = logging.getLogger(__name__)
+
+_LENGTH = struct.Struct(">I")
+
+_OPEN_SUFFIX = ".open"
+_SEALED_SUFFIX = ".seg"
+_DRAINING_SUFFIX = ".drain"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _segment_pid(name):
+    # Segment names are of the form <timestamp>-<pid>-<sequence> followed
+    # by the suffix, with the pid of a draining process appended to the
+    # name of a segment which has been claimed for draining.
+
+    try:
+        if _DRAINING_SUFFIX in name:
+            return int(name.rsplit("-", 1)[1])
+        return int(name.split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class HarvestSpool():
+
+    """Spool of the payloads of failed requests to the data collector."""
+
+    def __init__(self, directory, max_bytes=10 * 1024 * 1024, max_age=3600.0, segment_bytes=1024 * 1024):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        self._segment_bytes = segment_bytes
+
+        self._lock = threading.RLock()
+        self._segment = None
+        self._sequence = 0
+        self._process_id = os.getpid()
+
+        self._written = 0
+        self._drained = 0
+        self._dropped = 0
+
+    @property
+    def directory(self):
+        return self._directory
+
+    def _sealed_segments(self):
+        try:
+            names = os.listdir(self._directory)
+        except OSError:
+            return []
+
+        return sorted(name for name in names if name.endswith(_SEALED_SUFFIX))
+
+    def _new_segment(self):
+        self._sequence += 1
+        name = f"{int(time.time() * 1000):013d}-{os.getpid()}-{self._sequence:06d}{_OPEN_SUFFIX}"
+        return os.path.join(self._directory, name)
+
+    def _seal(self):
+        segment, self._segment = self._segment, None
+
+        if segment is not None:
+            try:
+                os.rename(segment, segment[: -len(_OPEN_SUFFIX)] + _SEALED_SUFFIX)
+            except OSError:
+                pass
+
+    def _seal_abandoned(self):
+        # Open segments of processes which have exited are sealed, and
+        # segments claimed for draining by such processes are released,
+        # so that the data they hold is not stranded.
+
+        pid = os.getpid()
+
+        for name in os.listdir(self._directory):
+            if name.endswith(_OPEN_SUFFIX):
+                base = name[: -len(_OPEN_SUFFIX)]
+            elif _DRAINING_SUFFIX in name:
+                base = name.split(_SEALED_SUFFIX)[0]
+            else:
+                continue
+
+            owner = _segment_pid(name)
+
+            if owner is None or owner == pid or _pid_alive(owner):
+                continue
+
+            try:
+                os.rename(os.path.join(self._directory, name), os.path.join(self._directory, base + _SEALED_SUFFIX))
+            except OSError:
+                pass
+
+    def _enforce_limits(self):
+        # Discards segments which are older than the maximum age and then,
+        # oldest first, any which take the spool over its maximum size. The
+        # open segments of other processes are left alone.
+
+        now = time.time()
+        segments = []
+        total = 0
+
+        for name in os.listdir(self._directory):
+            if not name.endswith((_OPEN_SUFFIX, _SEALED_SUFFIX)):
+                continue
+
+            path = os.path.join(self._directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            removable = name.endswith(_SEALED_SUFFIX) or path == self._segment
+
+            if removable and now - stat.st_mtime > self._max_age:
+                self._remove(path)
+                continue
+
+            total += stat.st_size
+            segments.append((name, path, stat.st_size, removable))
+
+        segments.sort()
+
+        for name, path, size, removable in segments:
+            if total <= self._max_bytes:
+                break
+
+            if removable:
+                if path == self._segment:
+                    self._segment = None
+                self._remove(path)
+                total -= size
+
+    def _remove(self, path):
+        try:
+            os.unlink(path)
+        except OSError:
+            return
+
+        self._dropped += 1
+
+        _logger.debug("Discarded harvest spool segment %r.", path)
+
+    def write(self, method, payload):
+        """Appends the payload for the collector method to the spool.
+        Returns True if the payload was written to the spool.
+
+        """
+
+        try:
+            data = zlib.compress(json_encode((method, time.time(), payload)).encode("utf-8"))
+        except Exception:
+            _logger.exception("Unable to encode the %r payload for the harvest spool.", method)
+            return False
+
+        with self._lock:
+            # An open segment inherited from the parent process after a
+            # fork is left to the parent, with the child starting its own.
+
+            if self._process_id != os.getpid():
+                self._process_id = os.getpid()
+                self._segment = None
+
+            try:
+                os.makedirs(self._directory, exist_ok=True)
+
+                if self._segment is None:
+                    self._segment = self._new_segment()
+
+                with open(self._segment, "ab") as fp:
+                    fp.write(_LENGTH.pack(len(data)) + data)
+                    size = fp.tell()
+
+                if size >= self._segment_bytes:
+                    self._seal()
+
+                self._enforce_limits()
+
+            except OSError:
+                _logger.warning(
+                    "Unable to write the %r payload to the harvest spool in %r.", method, self._directory, exc_info=True
+                )
+                return False
+
+            self._written += 1
+
+        return True
+
+    @staticmethod
+    def _read(path):
+        records = []
+
+        with open(path, "rb") as fp:
+            while True:
+                header = fp.read(_LENGTH.size)
+                if len(header) < _LENGTH.size:
+                    break
+
+                (length,) = _LENGTH.unpack(header)
+                data = fp.read(length)
+
+                # A truncated record is the result of the process exiting
+                # part way through a write and marks the end of the data.
+
+                if len(data) < length:
+                    break
+
+                records.append(data)
+
+        return records
+
+    def _write_sealed(self, path, records):
+        temporary = f"{path}.{os.getpid()}.tmp"
+
+        with open(temporary, "wb") as fp:
+            for data in records:
+                fp.write(_LENGTH.pack(len(data)))
+                fp.write(data)
+
+        os.rename(temporary, path)
+
+    def drain(self, send):
+        """Sends the spooled payloads, oldest first, by calling send with the
+        collector method and payload of each. A payload which the data
+        collector rejects outright is dropped. If send raises any other
+        exception the payloads not yet sent are left in the spool and the
+        exception is propagated. Returns the number of payloads which were
+        sent.
+
+        """
+
+        sent = 0
+
+        with self._lock:
+            if not os.path.isdir(self._directory):
+                return sent
+
+            self.close()
+            self._seal_abandoned()
+
+            pid = os.getpid()
+            now = time.time()
+
+            for name in self._sealed_segments():
+                path = os.path.join(self._directory, name)
+                claimed = f"{path}{_DRAINING_SUFFIX}-{pid}"
+
+                # Renaming the segment claims it for draining, so that it
+                # is not also drained by another process.
+
+                try:
+                    os.rename(path, claimed)
+                except OSError:
+                    continue
+
+                try:
+                    records = self._read(claimed)
+                except OSError:
+                    records = []
+
+                for index, data in enumerate(records):
+                    try:
+                        method, timestamp, payload = json_decode(zlib.decompress(data).decode("utf-8"))
+                    except Exception:
+                        self._dropped += 1
+                        continue
+
+                    if now - timestamp > self._max_age:
+                        self._dropped += 1
+                        continue
+
+                    try:
+                        send(method, payload)
+                    except DiscardDataForRequest:
+                        # Sending the payload again would only fail in the
+                        # same way and hold up those spooled after it.
+
+                        self._dropped += 1
+                        continue
+                    except Exception:
+                        # Put back those not yet sent under the original
+                        # name so they remain in order.
+
+                        try:
+                            self._write_sealed(path, records[index:])
+                        finally:
+                            self._remove_claimed(claimed)
+                        raise
+
+                    sent += 1
+                    self._drained += 1
+
+                self._remove_claimed(claimed)
+
+        return sent
+
+    def close(self):
+        """Seals the open segment so the data it holds can be drained by
+        any process sharing the spool directory.
+
+        """
+
+        with self._lock:
+            if self._process_id == os.getpid():
+                self._seal()
+
+    @staticmethod
+    def _remove_claimed(path):
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        """Returns and resets the counters used for the supportability
+        metrics as a tuple of the number of payloads written, drained and
+        the number of segments and records dropped.
+
+        """
+
+        with self._lock:
+            stats = (self._written, self._drained, self._dropped)
+            self._written, self._drained, self._dropped = 0, 0, 0
+
+        return stats
@@ -0,0 +1,132 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements the dispatching of the independent uploads of
+data to the data collector made during a harvest, so that they can be made
+concurrently rather than one after another.
+
+"""
+
+import concurrent.futures
+
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.stats_engine import CustomMetrics
+
+
+class HarvestUploader():
+
+    """Sends the data for a harvest to the data collector. Each upload is a
+    call sending data to one endpoint along with an optional callback made
+    once the data has been sent, such as to reset the data which was sent
+    so that it is not rolled back into the next harvest on a later failure.
+
+    With a single worker each upload is made immediately on the calling
+    thread and an exception stops the harvest at that point, as is the case
+    when calling the session directly. With more workers the uploads are
+    made concurrently from a pool of threads. The callbacks are still made
+    from the calling thread, in the order in which the uploads were added,
+    when wait() is called or the uploader is exited. Callbacks are only made
+    for those uploads which succeeded, with the exception raised by the
+    first upload to fail then being raised by wait().
+
+    """
+
+    def __init__(self, internal_metrics, max_workers=1):
+        self._internal_metrics = internal_metrics
+        self._max_workers = max_workers
+        self._executor = None
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc, value, tb):
+        try:
+            if exc is None:
+                self.wait()
+            else:
+                # Still make the callbacks for the uploads which succeeded
+                # so their data is not rolled back, but let the original
+                # exception propagate.
+
+                try:
+                    self.wait()
+                except Exception:
+                    pass
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    @staticmethod
+    def _send(send, args):
+        # Supportability metrics recorded by the client are captured
+        # separately for each upload, as the metrics table is not safe to
+        # be updated concurrently, and merged in once it completes.
+
+        internal_metrics = CustomMetrics()
+
+        with InternalTraceContext(internal_metrics):
+            try:
+                send(*args)
+            except Exception as exc:
+                return internal_metrics, exc
+
+        return internal_metrics, None
+
+    def upload(self, send, *args, **kwargs):
+        """Sends data by calling send with the supplied arguments. If given,
+        the on_success callback is made once the data has been sent.
+
+        """
+
+        on_success = kwargs.pop("on_success", None)
+
+        if self._max_workers <= 1:
+            send(*args)
+            if on_success is not None:
+                on_success()
+            return
+
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._max_workers, thread_name_prefix="NR-Harvest-Upload"
+            )
+
+        self._pending.append((self._executor.submit(self._send, send, args), on_success))
+
+    def wait(self):
+        """Waits for all uploads to complete, making the callbacks for those
+        which succeeded and then raising the exception of the first upload
+        which failed, if any.
+
+        """
+
+        pending, self._pending = self._pending, []
+
+        failure = None
+
+        for future, on_success in pending:
+            internal_metrics, exc = future.result()
+
+            self._internal_metrics.merge_custom_metrics(internal_metrics.metrics())
+
+            if exc is not None:
+                if failure is None:
+                    failure = exc
+            elif on_success is not None:
+                on_success()
+
+        if failure is not None:
+            raise failure
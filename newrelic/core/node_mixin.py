@@ -81,6 +81,14 @@ class GenericNodeMixin():
             ):
                 yield event
 
+    def span_event_count(self):
+        """Returns the number of span events span_events() would yield
+        without generating them.
+
+        """
+
+        return 1 + sum(child.span_event_count() for child in self.children)
+
 
 class DatastoreNodeMixin(GenericNodeMixin):
     @property
@@ -223,6 +223,80 @@ def encode_metric_data(metric_data, start_time, end_time, resource=None, scope=N
     )
 
 
+def timeslice_to_dimensional_metrics(metric_data):
+    """
+    Converts timeslice metric data, as sent in the metric_data payload, into the form of dimensional metric data
+    accepted by stats_to_otlp_metrics(), with any scope given as an attribute.
+
+    Returns a tuple of the converted metric data along with a list of any timeslice metrics which can't be
+    represented as OTLP metrics. These are the apdex metrics, which must still be sent in the metric_data payload.
+    """
+    dimensional_metric_data = {}
+    remaining_metric_data = []
+
+    for key, values in metric_data:
+        name = key["name"]
+        if name.startswith("Apdex"):
+            remaining_metric_data.append((key, values))
+            continue
+
+        # The kind of the metric isn't retained in the metric data, so value metrics which only ever record a
+        # count are sent as count metrics.
+        if any(values[1:]):
+            stats = TimeStats(*values)
+        else:
+            stats = CountStats(call_count=values[0])
+
+        tags = frozenset({("scope", key["scope"])}) if key["scope"] else None
+        dimensional_metric_data.setdefault(name, {})[tags] = stats
+
+    return dimensional_metric_data.items(), remaining_metric_data
+
+
+def encode_timeslice_metric_data(metric_data, start_time, end_time):
+    """
+    Encodes timeslice metric data as OTLP metrics attached to the APM entity. Returns a tuple of the encoded
+    payload along with the list of any metrics which could not be encoded.
+
+    Only the call count, total time, minimum and maximum are carried over for time metrics, with the exclusive
+    time and sum of squares having no equivalent in an OTLP summary.
+    """
+    dimensional_metric_data, remaining_metric_data = timeslice_to_dimensional_metrics(metric_data)
+    resource = create_resource({"instrumentation.provider": "newrelic-python"})
+    return encode_metric_data(dimensional_metric_data, start_time, end_time, resource=resource), remaining_metric_data
+
+
+def encode_span_event_data(span_event_data, agent_run_id):
+    """
+    Encodes span events as OTLP log records attached to the APM entity, in the same way as is done for machine
+    learning events. The intrinsic, user and agent attributes of each span are combined, with the intrinsics
+    taking precedence.
+    """
+    log_records = []
+    for intrinsics, user_attributes, agent_attributes in span_event_data:
+        attributes = dict(user_attributes)
+        attributes.update(agent_attributes)
+        attributes.update(intrinsics)
+        attributes.update(
+            {
+                "real_agent_id": agent_run_id,
+                "event.domain": "newrelic.span_events",
+                "event.name": intrinsics.get("type", "Span"),
+            }
+        )
+        log_records.append(
+            {
+                "time_unix_nano": int(intrinsics.get("timestamp", 0) * 1e6),
+                "attributes": create_key_values_from_iterable(
+                    (key, value) for key, value in attributes.items() if value is not None
+                ),
+            }
+        )
+
+    resource = create_resource({"instrumentation.provider": "newrelic-python"})
+    return LogsData(resource_logs=[ResourceLogs(resource=resource, scope_logs=[ScopeLogs(log_records=log_records)])])
+
+
 def encode_ml_event_data(custom_event_data, agent_run_id):
     # An InferenceEvent is attached to a separate ML Model entity instead
     # of the APM entity.
@@ -54,8 +54,50 @@ class NormalizationRule(_NormalizationRule):
         return self.match_expression_re.subn(self.replacement, string, count)
 
 
+# Pattern used to detect back references within a match expression. The
+# group numbers of these would change if the match expression were to be
+# combined with others into a single regular expression.
+
+_BACK_REFERENCE_RE = re.compile(r"\\[1-9]|\(\?P=")
+
+
+def _compile_prefilter(rules):
+    # Combines the match expressions of the rules into a single regular
+    # expression which matches if any of the individual rules would. If
+    # this cannot be done then None is returned.
+
+    if not rules:
+        return None
+
+    patterns = []
+
+    for rule in rules:
+        if _BACK_REFERENCE_RE.search(rule.match_expression):
+            return None
+        patterns.append(f"(?:{rule.match_expression})")
+
+    try:
+        return re.compile("|".join(patterns), re.IGNORECASE)
+    except re.error:
+        return None
+
+
 class RulesEngine():
-    def __init__(self, rules):
+    """Applies an ordered chain of normalization rules to a name.
+
+    As the rules are applied in order with each rule being applied to the
+    result of those prior to it, the first rule which matches must match
+    the original name. Before applying the chain of rules, the name, or
+    each segment of it for the rules which apply to each segment, is
+    therefore checked against a single regular expression combining all of
+    the rules, and if there is no match the name is returned unchanged.
+
+    The results for recently seen names are also cached. The cache is
+    cleared when it reaches cache_size entries.
+
+    """
+
+    def __init__(self, rules, cache_size=1000):
         self.__rules = []
 
         for rule in rules:
@@ -67,10 +109,47 @@ class RulesEngine():
 
         self.__rules = sorted(self.__rules, key=lambda rule: rule.eval_order)
 
+        self.__string_prefilter = _compile_prefilter([rule for rule in self.__rules if not rule.each_segment])
+        self.__segment_prefilter = _compile_prefilter([rule for rule in self.__rules if rule.each_segment])
+
+        self.__has_string_rules = any(not rule.each_segment for rule in self.__rules)
+        self.__has_segment_rules = any(rule.each_segment for rule in self.__rules)
+
+        self.__cache = {}
+        self.__cache_size = cache_size
+
     @property
     def rules(self):
         return self.__rules
 
+    def _may_match(self, string):
+        # Returns False only if it is certain that no rule matches the
+        # original string, in which case no rule in the chain can match.
+
+        if self.__has_string_rules:
+            if self.__string_prefilter is None or self.__string_prefilter.search(string):
+                return True
+
+        if self.__has_segment_rules:
+            if self.__segment_prefilter is None:
+                return True
+
+            segments = string.split("/")
+
+            # Skip the leading empty segment as is done when the
+            # rules are applied.
+
+            if segments and not segments[0]:
+                segments = segments[1:]
+
+            search = self.__segment_prefilter.search
+
+            for segment in segments:
+                if search(segment):
+                    return True
+
+        return False
+
     def normalize(self, string):
         # URLs are supposed to be ASCII but can get a
         # URL with illegal non ASCII characters. As the
@@ -84,6 +163,26 @@ class RulesEngine():
         if isinstance(string, bytes):
             string = string.decode("Latin-1")
 
+        cache = self.__cache
+
+        result = cache.get(string)
+
+        if result is not None:
+            return result
+
+        if self._may_match(string):
+            result = self._normalize(string)
+        else:
+            result = (string, False)
+
+        if len(cache) >= self.__cache_size:
+            cache.clear()
+
+        cache[string] = result
+
+        return result
+
+    def _normalize(self, string):
         final_string = string
         ignore = False
         for rule in self.__rules:
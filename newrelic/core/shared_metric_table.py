@@ -0,0 +1,553 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a metric table held in shared memory, which is
+used by the processes of a pre-fork web server in place of a metric table
+per process. The table is created in the parent process before the workers
+are forked, so that all workers share the one copy of the metric names, and
+the metrics of all workers are harvested and sent by a single process.
+
+The table has a fixed number of slots, each holding the name and scope of a
+metric, with the slot being found by hashing the key. Each process claims a
+stripe of the table to write the values of metrics to, so processes never
+write to the same values. Each stripe has two halves, only one of which is
+written to at a time. When harvesting, the process elected to do so switches
+all processes over to the other half, waits for any in-progress writes to
+the previous half to complete, and then collects and clears the values in
+that half across all stripes.
+
+Metrics which don't fit in the table, because the key is too long or the
+table is full, are held in a table local to the process, and are sent by
+the process itself.
+
+"""
+
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from newrelic.core.stats_engine import MetricTable, MetricTableRow, _stats_kind
+
+_logger = logging.getLogger(__name__)
+
+# Layout of the control block at the start of the shared memory, which is
+# followed by the name of the application the table is bound to.
+
+_EPOCH = 0
+_HARVESTER = 1
+_USED = 2
+_NAME_LENGTH = 3
+_CONTROL_SIZE = 8
+
+_NAME_SIZE = 256
+
+_ALIGNMENT = 8
+
+_BUSY_TIMEOUT = 0.01
+
+# Bounds on the time slept between attempts to acquire the lock, so that a
+# process waiting on the lock doesn't spin on the request path.
+
+_LOCK_MIN_BACKOFF = 0.0001
+_LOCK_MAX_BACKOFF = 0.01
+
+_shared_metric_table = None
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class _ProcessLock():
+
+    """Lock shared by the processes forked after it is created. A record
+    lock on a file is used as it is released by the operating system if
+    the process holding it exits, so a worker killed while holding the lock
+    can't leave it held forever. Record locks are held by a process rather
+    than a thread, so a thread lock is also taken to exclude the other
+    threads of the same process.
+
+    """
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._process_id = os.getpid()
+        self._thread_lock = threading.Lock()
+
+    def acquire(self, timeout):
+        # The thread lock may have been held by another thread when the
+        # process was forked, so a new process starts with its own.
+
+        process_id = os.getpid()
+
+        if self._process_id != process_id:
+            self._process_id = process_id
+            self._thread_lock = threading.Lock()
+
+        thread_lock = self._thread_lock
+        deadline = time.time() + timeout
+        backoff = _LOCK_MIN_BACKOFF
+
+        if not thread_lock.acquire(timeout=timeout):
+            return False
+
+        while True:
+            try:
+                fcntl.lockf(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError:
+                remaining = deadline - time.time()
+                if remaining <= 0.0:
+                    thread_lock.release()
+                    return False
+
+            time.sleep(min(backoff, remaining))
+            backoff = min(backoff * 2, _LOCK_MAX_BACKOFF)
+
+    def release(self):
+        fcntl.lockf(self._file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+
+def _encode_key(key):
+    name, scope = key
+    return f"{name}\x00{scope or ''}".encode("utf-8")
+
+
+def _decode_key(data):
+    name, scope = data.decode("utf-8").split("\x00", 1)
+    return (name, scope)
+
+
+def _has_values(c0, c1, c2, slot):
+    return c0[slot] or c1[slot] or c2[slot]
+
+
+def _merge_row(table, key, kind, v0, v1, v2, v3, v4, v5):
+    row = table._index.get(key)
+    if row is None:
+        table._append(key, kind, v0, v1, v2, v3, v4, v5)
+    else:
+        table._merge_values(row, kind, v0, v1, v2, v3, v4, v5)
+
+
+class SharedMetricTable(MetricTable):
+
+    """Metric table keyed by (name, scope) held in shared memory. Supports
+    the same operations as the MetricTable it replaces, with the values
+    read for a metric being those accumulated across all processes.
+
+    """
+
+    def __init__(self, slots=4096, stripes=32, key_size=256):
+        self._slots = slots
+        self._stripes = stripes
+        self._key_size = key_size
+
+        offset = 0
+        control_offset, offset = offset, offset + _CONTROL_SIZE * 4
+        name_offset, offset = offset, offset + _NAME_SIZE
+        owners_offset, offset = _aligned(offset), _aligned(offset) + stripes * 2 * 4
+        lengths_offset, offset = offset, offset + slots * 4
+        kinds_offset, offset = offset, offset + slots
+        keys_offset, offset = offset, offset + slots * key_size
+        data_offset, offset = _aligned(offset), _aligned(offset) + stripes * 2 * 6 * slots * 8
+
+        # An anonymous mapping is shared with any child processes forked
+        # after it is created.
+
+        self._mmap = mmap.mmap(-1, offset)
+
+        view = memoryview(self._mmap)
+
+        self._control = view[control_offset : control_offset + _CONTROL_SIZE * 4].cast("i")
+        self._name = view[name_offset : name_offset + _NAME_SIZE]
+        self._owners = view[owners_offset : owners_offset + stripes * 2 * 4].cast("i")
+        self._lengths = view[lengths_offset : lengths_offset + slots * 4].cast("i")
+        self._kinds = view[kinds_offset : kinds_offset + slots].cast("b")
+        self._key_data = view[keys_offset : keys_offset + slots * key_size]
+
+        data = view[data_offset:offset].cast("d")
+
+        self._data = tuple(
+            tuple(
+                tuple(data[((stripe * 2 + epoch) * 6 + field) * slots :][:slots] for field in range(6))
+                for epoch in range(2)
+            )
+            for stripe in range(stripes)
+        )
+
+        self._lock = _ProcessLock()
+
+        self._index = {}
+        self._overflow = MetricTable()
+        self._overflowed = 0
+        self._process_id = None
+        self._stripe = None
+
+    def _acquire(self):
+        return self._lock.acquire(1.0)
+
+    def bind(self, name):
+        """Binds the table to the named application, if not already bound
+        to another. Returns True if the table is bound to the application.
+
+        """
+
+        data = name.encode("utf-8")[:_NAME_SIZE]
+
+        if not self._acquire():
+            return False
+
+        try:
+            length = self._control[_NAME_LENGTH]
+            if not length:
+                self._name[: len(data)] = data
+                self._control[_NAME_LENGTH] = len(data)
+                return True
+            return bytes(self._name[:length]) == data
+        finally:
+            self._lock.release()
+
+    def attach(self):
+        """Claims a stripe of the table for the current process if it does
+        not already have one. Returns False if no stripe is available, in
+        which case the table can not be used by the process.
+
+        """
+
+        process_id = os.getpid()
+
+        if self._process_id == process_id:
+            return self._stripe is not None
+
+        # After a fork, the child has to claim its own stripe and discards
+        # the metrics the parent held locally.
+
+        self._process_id = process_id
+        self._stripe = None
+        self._overflow = MetricTable()
+        self._overflowed = 0
+
+        if not self._acquire():
+            return False
+
+        try:
+            owners = self._owners
+
+            for stripe in range(self._stripes):
+                owner = owners[stripe * 2]
+                if not owner or owner == process_id or not _pid_alive(owner):
+                    owners[stripe * 2] = process_id
+                    owners[stripe * 2 + 1] = 0
+                    self._stripe = stripe
+                    break
+        finally:
+            self._lock.release()
+
+        if self._stripe is None:
+            _logger.debug("No stripe of the shared metric table is available for process %r.", process_id)
+            return False
+
+        return True
+
+    def _slot(self, key, kind=None):
+        # Keys which can never be held in the table, because the key is too
+        # long or the table is full, are remembered as having no slot so
+        # they go straight to the local table. Slots are never freed so
+        # this can't change.
+
+        try:
+            return self._index[key]
+        except KeyError:
+            pass
+
+        data = _encode_key(key)
+        length = len(data)
+
+        if length > self._key_size:
+            self._index[key] = None
+            return None
+
+        slots = self._slots
+        key_size = self._key_size
+        lengths = self._lengths
+        keys = self._key_data
+
+        start = zlib.crc32(data) % slots
+
+        for probe in range(slots):
+            slot = (start + probe) % slots
+            slot_length = lengths[slot]
+
+            if not slot_length:
+                if kind is None or not self._acquire():
+                    return None
+
+                try:
+                    # Another process may have filled the slot since it
+                    # was checked. The length is written last so a key is
+                    # only seen by other processes once complete.
+
+                    slot_length = lengths[slot]
+
+                    if not slot_length:
+                        if self._control[_USED] >= slots:
+                            self._index[key] = None
+                            return None
+
+                        keys[slot * key_size : slot * key_size + length] = data
+                        self._kinds[slot] = kind
+                        lengths[slot] = length
+                        self._control[_USED] += 1
+
+                        self._index[key] = slot
+                        return slot
+                finally:
+                    self._lock.release()
+
+            if slot_length == length and keys[slot * key_size : slot * key_size + length] == data:
+                self._index[key] = slot
+                return slot
+
+        self._index[key] = None
+        return None
+
+    @property
+    def _columns(self):
+        return self._data[self._stripe][self._control[_EPOCH]]
+
+    def _merge_values(self, row, kind, v0, v1, v2, v3, v4, v5):
+        # The busy flag for the stripe is set while writing so the harvest
+        # can wait for a write to the half it is about to collect.
+
+        owners = self._owners
+        busy = self._stripe * 2 + 1
+
+        owners[busy] = 1
+        try:
+            super(SharedMetricTable, self)._merge_values(row, kind, v0, v1, v2, v3, v4, v5)
+        finally:
+            owners[busy] = 0
+
+    def _values(self, row):
+        # Combines the values for the row from both halves of all stripes.
+
+        result = MetricTable()
+        kind = self._kinds[row]
+
+        for halves in self._data:
+            for c0, c1, c2, c3, c4, c5 in halves:
+                if _has_values(c0, c1, c2, row):
+                    _merge_row(result, None, kind, c0[row], c1[row], c2[row], c3[row], c4[row], c5[row])
+
+        if not len(result):
+            result._append(None, kind, 0, 0.0, 0.0, 0.0, 0.0, 0.0)
+
+        return result._values(0)
+
+    def _occupied(self):
+        lengths = self._lengths
+        return [slot for slot in range(self._slots) if lengths[slot]]
+
+    def _key(self, slot):
+        offset = slot * self._key_size
+        return _decode_key(bytes(self._key_data[offset : offset + self._lengths[slot]]))
+
+    def __len__(self):
+        return self._control[_USED] + len(self._overflow)
+
+    def __contains__(self, key):
+        return self._slot(key) is not None or key in self._overflow
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [self._key(slot) for slot in self._occupied()] + self._overflow.keys()
+
+    def get(self, key, default=None):
+        slot = self._slot(key)
+        if slot is None:
+            return self._overflow.get(key, default)
+        return MetricTableRow(self, slot)
+
+    def __getitem__(self, key):
+        slot = self._slot(key)
+        if slot is None:
+            return self._overflow[key]
+        return MetricTableRow(self, slot)
+
+    def __setitem__(self, key, stats):
+        kind = _stats_kind(stats)
+        slot = self._slot(key, kind)
+
+        if slot is None:
+            self._overflowed += key not in self._overflow
+            self._overflow[key] = stats
+            return
+
+        # Setting the values of a metric replaces those held for the
+        # current process only, as is the case when the key is first added.
+
+        self._kinds[slot] = kind
+
+        owners = self._owners
+        busy = self._stripe * 2 + 1
+
+        owners[busy] = 1
+        try:
+            for column, value in zip(self._columns, stats):
+                column[slot] = value
+        finally:
+            owners[busy] = 0
+
+    def items(self):
+        items = [(self._key(slot), MetricTableRow(self, slot)) for slot in self._occupied()]
+        return items + self._overflow.items()
+
+    def values(self):
+        return [stats for _, stats in self.items()]
+
+    def _merge_key(self, key, kind, v0, v1, v2, v3, v4, v5):
+        # A newly added row takes on the kind of the first stats merged
+        # into it, as would be the case for a new row in a MetricTable.
+
+        slot = self._slot(key, kind)
+
+        if slot is None:
+            self._overflowed += key not in self._overflow
+            _merge_row(self._overflow, key, kind, v0, v1, v2, v3, v4, v5)
+            return
+
+        self._merge_values(slot, kind, v0, v1, v2, v3, v4, v5)
+
+    def merge_stats(self, key, stats):
+        self._merge_key(key, _stats_kind(stats), *stats)
+
+    def merge_table(self, other):
+        for key, kind, v0, v1, v2, v3, v4, v5 in zip(other._keys, other._kinds, *other._columns):
+            self._merge_key(key, kind, v0, v1, v2, v3, v4, v5)
+
+    def metric_data(self):
+        return [(dict(name=key[0], scope=key[1]), list(stats)) for key, stats in self.items()]
+
+    def _elected(self):
+        # The process which harvests the table remains so while it is
+        # alive. Another process takes over if it exits.
+
+        if not self._acquire():
+            return False
+
+        try:
+            harvester = self._control[_HARVESTER]
+            process_id = os.getpid()
+
+            if harvester != process_id and (not harvester or not _pid_alive(harvester)):
+                self._control[_HARVESTER] = harvester = process_id
+
+            return harvester == process_id
+        finally:
+            self._lock.release()
+
+    def harvest(self):
+        """Returns a MetricTable with the values accumulated since the last
+        harvest, which are cleared from the table. Only the process elected
+        as the harvester collects the metrics of all processes, with other
+        processes only collecting those they hold locally.
+
+        """
+
+        result = MetricTable()
+
+        if self._elected():
+            epoch = self._control[_EPOCH]
+            self._control[_EPOCH] = 1 - epoch
+
+            owners = self._owners
+
+            for stripe in range(self._stripes):
+                deadline = time.time() + _BUSY_TIMEOUT
+                while owners[stripe * 2 + 1] and time.time() < deadline:
+                    time.sleep(0)
+
+            occupied = self._occupied()
+            kinds = self._kinds
+
+            for stripe in range(self._stripes):
+                if not owners[stripe * 2]:
+                    continue
+
+                c0, c1, c2, c3, c4, c5 = self._data[stripe][epoch]
+
+                for slot in occupied:
+                    if _has_values(c0, c1, c2, slot):
+                        _merge_row(
+                            result,
+                            self._key(slot), kinds[slot], c0[slot], c1[slot], c2[slot], c3[slot], c4[slot], c5[slot]
+                        )
+                        c0[slot] = c1[slot] = c2[slot] = c3[slot] = c4[slot] = c5[slot] = 0.0
+
+        result.merge_table(self._overflow)
+        self._overflow = MetricTable()
+
+        return result
+
+    def usage(self):
+        """Returns and resets the counters used for the supportability
+        metrics as a tuple of the number of slots used and the number of
+        metrics which did not fit in the table.
+
+        """
+
+        overflowed, self._overflowed = self._overflowed, 0
+        return self._control[_USED], overflowed
+
+
+def shared_metric_table(settings):
+    """Returns the shared metric table for the process, creating it if it
+    does not already exist. This must first be called before the worker
+    processes are forked for the table to be shared between them.
+
+    """
+
+    global _shared_metric_table
+
+    if _shared_metric_table is None:
+        stats_engine = settings.stats_engine
+        _shared_metric_table = SharedMetricTable(
+            slots=stats_engine.shared_metrics_slots,
+            stripes=stats_engine.shared_metrics_workers,
+        )
+
+    return _shared_metric_table
@@ -0,0 +1,77 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""This module records the wall clock time spent in the stages of agent
+startup, such as loading the configuration, registering instrumentation
+and running each of the instrumentation hooks, so that the cost of the
+agent on cold start can be reported on.
+
+Each stage is only recorded the first time it is seen. Timings are kept
+for the life of the process for reporting by the newrelic-admin command,
+and handed over once to be reported as supportability metrics.
+
+"""
+
+import threading
+import time
+
+_lock = threading.Lock()
+
+_timings = {}
+_pending = []
+
+
+class StartupTrace():
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc, value, tb):
+        record_startup_timing(self.name, time.perf_counter() - self.start)
+
+
+def record_startup_timing(name, duration):
+    with _lock:
+        if name in _timings:
+            return
+
+        _timings[name] = duration
+        _pending.append(name)
+
+
+def startup_timings():
+    """Returns a list of (name, duration) tuples for all the stages which
+    have been recorded, in the order in which they completed.
+
+    """
+
+    with _lock:
+        return list(_timings.items())
+
+
+def harvest_startup_timings():
+    """Returns a list of (name, duration) tuples for the stages recorded
+    since this was last called.
+
+    """
+
+    global _pending
+
+    with _lock:
+        pending, _pending = _pending, []
+        return [(name, _timings[name]) for name in pending]
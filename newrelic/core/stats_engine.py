@@ -21,14 +21,17 @@ data whereby it is sent to the core application.
 
 import base64
 import copy
+import itertools
 import logging
 import operator
 import random
 import sys
+import threading
 import time
 import traceback
 import warnings
 import zlib
+from array import array
 from heapq import heapify, heapreplace
 
 from newrelic.api.settings import STRIP_EXCEPTION_MESSAGE
@@ -195,6 +198,314 @@ class CountStats(TimeStats):
         pass
 
 
+# Kinds of stats which can be held by a row of a MetricTable. The kind
+# dictates how the values for the row are merged and the type of stats
+# object the row is equivalent to.
+
+_KIND_TIME = 0
+_KIND_APDEX = 1
+_KIND_COUNT = 2
+
+
+def _stats_kind(stats):
+    if isinstance(stats, MetricTableRow):
+        return stats.kind
+    elif isinstance(stats, ApdexStats):
+        return _KIND_APDEX
+    elif isinstance(stats, CountStats):
+        return _KIND_COUNT
+    return _KIND_TIME
+
+
+def _as_count(value):
+    return int(value) if value.is_integer() else value
+
+
+class MetricTableRow():
+
+    """View onto a single row of a MetricTable. The row behaves the same as
+    the TimeStats, ApdexStats or CountStats object it replaces, with any
+    updates being written back to the columns of the table. Views are
+    created on demand and are not retained by the table.
+
+    """
+
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    @property
+    def kind(self):
+        return self._table._kinds[self._row]
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, index):
+        return self._table._values(self._row)[index]
+
+    def __iter__(self):
+        return iter(self._table._values(self._row))
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __copy__(self):
+        return self._table.stats(self._row)
+
+    def __repr__(self):
+        return repr(self._table._values(self._row))
+
+    call_count = property(operator.itemgetter(0))
+    total_call_time = property(operator.itemgetter(1))
+    total_exclusive_call_time = property(operator.itemgetter(2))
+    min_call_time = property(operator.itemgetter(3))
+    max_call_time = property(operator.itemgetter(4))
+    sum_of_squares = property(operator.itemgetter(5))
+
+    satisfying = property(operator.itemgetter(0))
+    tolerating = property(operator.itemgetter(1))
+    frustrating = property(operator.itemgetter(2))
+
+    def merge_stats(self, other):
+        """Merge data from another stats object or table row."""
+
+        self._table._merge_values(self._row, _stats_kind(other), *other)
+
+    def merge_raw_time_metric(self, duration, exclusive=None):
+        """Merge time value."""
+
+        if exclusive is None:
+            exclusive = duration
+
+        self._table._merge_values(self._row, _KIND_TIME, 1, duration, exclusive, duration, duration, duration**2)
+
+    def merge_time_metric(self, metric):
+        """Merge data from a time metric object."""
+
+        self.merge_raw_time_metric(metric.duration, metric.exclusive)
+
+    def merge_custom_metric(self, value):
+        """Merge data value."""
+
+        self.merge_raw_time_metric(value)
+
+    def merge_dimensional_metric(self, value):
+        """Merge data value."""
+
+        self.merge_raw_time_metric(value)
+
+    def merge_apdex_metric(self, metric):
+        """Merge data from an apdex metric object."""
+
+        self._table._merge_values(
+            self._row,
+            _KIND_APDEX,
+            metric.satisfying,
+            metric.tolerating,
+            metric.frustrating,
+            metric.apdex_t,
+            metric.apdex_t,
+            0,
+        )
+
+
+class MetricTable():
+
+    """Compact table of accumulated apdex, time and value metrics keyed by
+    (name, scope). This can be used in place of the dictionary of stats
+    objects held by the stats engine. Rather than a list object along with
+    a float object for each field being allocated per metric, the metric
+    key maps to a row index and the fields for all metrics are stored in
+    contiguous arrays of doubles, one for each field. Counts are held as
+    doubles and converted back to integers when read.
+
+    Looking up a metric returns a MetricTableRow view onto the row which
+    supports the same operations as the stats objects it replaces. Adding
+    a stats object to the table copies the values into the table.
+
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._keys = []
+        self._kinds = array("b")
+        self._columns = tuple(array("d") for _ in range(6))
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def keys(self):
+        return list(self._keys)
+
+    def get(self, key, default=None):
+        row = self._index.get(key)
+        if row is None:
+            return default
+        return MetricTableRow(self, row)
+
+    def __getitem__(self, key):
+        return MetricTableRow(self, self._index[key])
+
+    def __setitem__(self, key, stats):
+        row = self._index.get(key)
+        kind = _stats_kind(stats)
+
+        if row is None:
+            self._append(key, kind, *stats)
+        else:
+            self._kinds[row] = kind
+            for column, value in zip(self._columns, stats):
+                column[row] = value
+
+    def items(self):
+        return [(key, MetricTableRow(self, row)) for row, key in enumerate(self._keys)]
+
+    def values(self):
+        return [MetricTableRow(self, row) for row in range(len(self._keys))]
+
+    def _append(self, key, kind, v0, v1, v2, v3, v4, v5):
+        self._index[key] = len(self._keys)
+        self._keys.append(key)
+        self._kinds.append(kind)
+
+        c0, c1, c2, c3, c4, c5 = self._columns
+        c0.append(v0)
+        c1.append(v1)
+        c2.append(v2)
+        c3.append(v3)
+        c4.append(v4)
+        c5.append(v5)
+
+    def _values(self, row):
+        kind = self._kinds[row]
+        c0, c1, c2, c3, c4, c5 = self._columns
+
+        if kind == _KIND_APDEX:
+            return [_as_count(c0[row]), _as_count(c1[row]), _as_count(c2[row]), c3[row], c4[row], c5[row]]
+
+        return [_as_count(c0[row]), c1[row], c2[row], c3[row], c4[row], c5[row]]
+
+    def _merge_values(self, row, kind, v0, v1, v2, v3, v4, v5):
+        # This mirrors the merge_stats() methods of the stats classes. The
+        # kind of the row being merged into takes precedence.
+
+        c0, c1, c2, c3, c4, c5 = self._columns
+        row_kind = self._kinds[row]
+
+        if row_kind == _KIND_COUNT:
+            c0[row] += v0
+
+        elif row_kind == _KIND_APDEX:
+            c0[row] += v0
+            c1[row] += v1
+            c2[row] += v2
+            c3[row] = (c0[row] or c1[row] or c2[row]) and min(c3[row], v3) or v3
+            c4[row] = max(c4[row], v3)
+
+        else:
+            c1[row] += v1
+            c2[row] += v2
+            c3[row] = c0[row] and min(c3[row], v3) or v3
+            c4[row] = max(c4[row], v4)
+            c5[row] += v5
+
+            # Must update the call count last as update of the
+            # minimum call time is dependent on initial value.
+
+            c0[row] += v0
+
+    def merge_stats(self, key, stats):
+        """Merges the stats object or table row into the row for the key,
+        adding a new row if the key is not already present.
+
+        """
+
+        row = self._index.get(key)
+
+        if row is None:
+            self._append(key, _stats_kind(stats), *stats)
+        else:
+            self._merge_values(row, _stats_kind(stats), *stats)
+
+    def merge_table(self, other):
+        """Merges all rows from another metric table into this table."""
+
+        index = self._index
+        kinds = self._kinds
+        merge_values = self._merge_values
+        append = self._append
+        c0, c1, c2, c3, c4, c5 = self._columns
+
+        for key, kind, v0, v1, v2, v3, v4, v5 in zip(other._keys, other._kinds, *other._columns):
+            row = index.get(key)
+            if row is None:
+                append(key, kind, v0, v1, v2, v3, v4, v5)
+            elif kinds[row] == _KIND_TIME:
+                # Time metrics make up the bulk of the table so the merge
+                # for them is done inline rather than via _merge_values().
+
+                c1[row] += v1
+                c2[row] += v2
+                c3[row] = c0[row] and min(c3[row], v3) or v3
+                c4[row] = max(c4[row], v4)
+                c5[row] += v5
+                c0[row] += v0
+            else:
+                merge_values(row, kind, v0, v1, v2, v3, v4, v5)
+
+    def stats(self, row):
+        """Returns a standalone stats object holding a copy of the values
+        for the row.
+
+        """
+
+        kind = self._kinds[row]
+
+        if kind == _KIND_APDEX:
+            stats = ApdexStats()
+        elif kind == _KIND_COUNT:
+            stats = CountStats()
+        else:
+            stats = TimeStats()
+
+        stats[:] = self._values(row)
+
+        return stats
+
+    def metric_data(self):
+        """Returns the list of (key, values) pairs for all metrics in the
+        table in the form sent in the metric data payload.
+
+        """
+
+        result = []
+
+        for key, kind, v0, v1, v2, v3, v4, v5 in zip(self._keys, self._kinds, *self._columns):
+            if kind == _KIND_APDEX:
+                values = [_as_count(v0), _as_count(v1), _as_count(v2), v3, v4, v5]
+            else:
+                values = [_as_count(v0), v1, v2, v3, v4, v5]
+
+            result.append((dict(name=key[0], scope=key[1]), values))
+
+        return result
+
+
 class CustomMetrics():
 
     """Table for collection a set of value metrics."""
@@ -224,6 +535,20 @@ class CustomMetrics():
         else:
             stats.merge_stats(new_stats)
 
+    def merge_custom_metrics(self, metrics):
+        """Merges in a set of value metrics. The metrics should be provided
+        as an iterable where each item is a tuple of the metric name and the
+        accumulated stats for the metric.
+
+        """
+
+        for name, other in metrics:
+            stats = self.__stats_table.get(name)
+            if stats is None:
+                self.__stats_table[name] = other
+            else:
+                stats.merge_stats(other)
+
     def metrics(self):
         """Returns an iterator over the set of value metrics. The items
         returned are a tuple consisting of the metric name and accumulated
@@ -422,6 +747,14 @@ class SampledDataSet():
         # Always sample if under capacity
         return True
 
+    def add_seen(self, count):
+        """Records that samples were seen which were never offered to the
+        data set, as they would not have been sampled.
+
+        """
+
+        self.num_seen += count
+
     def add(self, sample, priority=None):  # pylint: disable=E0202
         self.num_seen += 1
 
@@ -429,11 +762,11 @@ class SampledDataSet():
             priority = random.random()  # nosec
 
         entry = (priority, self.num_seen, sample)
-        if self.num_seen == self.capacity:
-            self.pq.append(entry)
-            self.heap = self.heap or heapify(self.pq) or True
-        elif not self.heap:
+        if not self.heap:
             self.pq.append(entry)
+            if len(self.pq) >= self.capacity:
+                heapify(self.pq)
+                self.heap = True
         else:
             sampled = self.should_sample(priority)
             if not sampled:
@@ -441,16 +774,72 @@ class SampledDataSet():
             heapreplace(self.pq, entry)
 
     def merge(self, other_data_set, priority=None):
+        if self.capacity <= 0:
+            self.num_seen += other_data_set.num_seen
+            return
+
         if priority is None:
             priority = -1
 
-        for original_priority, seen_at, sample in other_data_set.pq:
-            self.add(sample, max(priority, original_priority))
+        # Samples from the other data set are added in bulk rather than
+        # through add(). Each is given a new seen at index, as would be the
+        # case if they had been added one at a time, so entries remain
+        # unique when compared and the sample itself is never compared.
 
-        # Merge the num_seen from the other_data_set, but take care not to
-        # double-count the actual samples of other_data_set since the .add
-        # call above will add one to self.num_seen each time
-        self.num_seen += other_data_set.num_seen - other_data_set.num_samples
+        other_pq = other_data_set.pq
+
+        if priority < 0:
+            priorities = [entry[0] for entry in other_pq]
+        else:
+            priorities = [max(priority, entry[0]) for entry in other_pq]
+
+        entries = list(zip(priorities, itertools.count(self.num_seen + 1), [entry[2] for entry in other_pq]))
+
+        self.num_seen += other_data_set.num_seen
+
+        pq = self.pq
+        capacity = self.capacity
+
+        if not self.heap:
+            if len(pq) + len(entries) < capacity:
+                pq.extend(entries)
+                return
+
+            free = capacity - len(pq)
+            pq.extend(entries[:free])
+            entries = entries[free:]
+
+            heapify(pq)
+            self.heap = True
+
+        if not entries:
+            return
+
+        minimum = pq[0][0]
+        entries = [entry for entry in entries if entry[0] > minimum]
+
+        if len(entries) * 2 < capacity:
+            # Where there are relatively few samples left to consider, such
+            # as when merging a single transaction, it is cheaper to replace
+            # the minimal sample one at a time.
+
+            for entry in entries:
+                if entry[0] > pq[0][0]:
+                    heapreplace(pq, entry)
+
+        elif entries:
+            # Otherwise select the samples to keep using the priority of the
+            # sample at the cut off point and then rebuild the heap. Samples
+            # already held win any tie at the cut off point.
+
+            pq.extend(entries)
+            threshold = sorted([entry[0] for entry in pq])[len(pq) - capacity]
+
+            kept = [entry for entry in pq if entry[0] > threshold]
+            kept.extend([entry for entry in pq if entry[0] == threshold][: capacity - len(kept)])
+
+            heapify(kept)
+            self.pq = kept
 
 
 class LimitedDataSet(list):
@@ -540,6 +929,7 @@ class StatsEngine():
         self._span_events = SampledDataSet()
         self._log_events = SampledDataSet()
         self._span_stream = None
+        self._shared_metric_table = None
         self.__sql_stats_table = {}
         self.__slow_transaction = None
         self.__slow_transaction_map = {}
@@ -548,6 +938,7 @@ class StatsEngine():
         self.__transaction_errors = []
         self._synthetics_events = LimitedDataSet()
         self.__synthetics_transactions = []
+        self.__parent = None
 
     @property
     def settings(self):
@@ -561,6 +952,10 @@ class StatsEngine():
     def dimensional_stats_table(self):
         return self.__dimensional_stats_table
 
+    @property
+    def shared_metric_table(self):
+        return self._shared_metric_table
+
     @property
     def transaction_events(self):
         return self._transaction_events
@@ -623,8 +1018,8 @@ class StatsEngine():
         key = (metric.name, "")
         stats = self.__stats_table.get(key)
         if stats is None:
-            stats = ApdexStats(apdex_t=metric.apdex_t)
-            self.__stats_table[key] = stats
+            self.__stats_table[key] = ApdexStats(apdex_t=metric.apdex_t)
+            stats = self.__stats_table[key]
         stats.merge_apdex_metric(metric)
 
         return key
@@ -1212,8 +1607,11 @@ class StatsEngine():
                 for event in transaction.span_protos(settings):
                     self._span_stream.put(event)
             elif transaction.sampled:
-                for event in transaction.span_events(self.__settings):
-                    self._span_events.add(event, priority=transaction.priority)
+                if self._should_sample_span_events(transaction.priority):
+                    for event in transaction.span_events(self.__settings):
+                        self._span_events.add(event, priority=transaction.priority)
+                else:
+                    self._span_events.add_seen(transaction.span_event_count())
 
         # Merge in log events
 
@@ -1335,6 +1733,9 @@ class StatsEngine():
             )
 
         if normalizer is not None:
+            if isinstance(self.__stats_table, MetricTable):
+                normalized_stats = MetricTable()
+
             for key, value in self.__stats_table.items():
                 normalized_name, ignored = normalizer(key[0])
                 if ignored:
@@ -1356,6 +1757,9 @@ class StatsEngine():
                 list(normalized_stats.items()),
             )
 
+        if isinstance(normalized_stats, MetricTable):
+            return normalized_stats.metric_data()
+
         for key, value in normalized_stats.items():
             key = dict(name=key[0], scope=key[1])
             result.append((key, value))
@@ -1725,8 +2129,31 @@ class StatsEngine():
 
         """
 
-        self.__stats_table = {}
-        self.__dimensional_stats_table.reset_metric_stats()
+        self.__stats_table = self._create_stats_table()
+        self.__dimensional_stats_table = DimensionalMetrics()
+
+    def _create_stats_table(self):
+        # The compact metric table is only used for long lived stats
+        # engines. Workareas for single transactions always use a plain
+        # dictionary as the number of metrics is small and the merge into
+        # the parent copies the values in anyway.
+
+        if self._shared_metric_table is not None and self._shared_metric_table.attach():
+            return self._shared_metric_table
+
+        if self.__settings is not None and self.__settings.stats_engine.columnar_metrics:
+            return MetricTable()
+
+        return {}
+
+    def use_shared_metric_table(self, table):
+        """Sets the shared metric table to be used in place of a metric
+        table local to the process. This takes effect when the metric data
+        is next reset.
+
+        """
+
+        self._shared_metric_table = table
 
     def reset_transaction_events(self):
         """Resets the accumulated statistics back to initial state for
@@ -1817,7 +2244,8 @@ class StatsEngine():
         self.__slow_transaction = None
         self.__synthetics_transactions = []
         self.__sql_stats_table = {}
-        self.__stats_table = {}
+        self.__stats_table = self._create_stats_table()
+        self.__dimensional_stats_table = DimensionalMetrics()
         self.__transaction_errors = []
 
     def harvest_snapshot(self, flexible=False):
@@ -1850,6 +2278,13 @@ class StatsEngine():
             allowlist_stats, other_stats = snapshot, self
             self.reset_non_event_types()
 
+            # The shared metric table is retained across harvests, with the
+            # snapshot instead taking the values accumulated since the last
+            # harvest, for all processes if this process is the harvester.
+
+            if snapshot.__stats_table is self._shared_metric_table:
+                snapshot.__stats_table = self._shared_metric_table.harvest()
+
         event_harvest_allowlist = self.__settings.event_harvest_config.allowlist
 
         # Iterate through harvest types. If they are in the list of types to
@@ -1874,10 +2309,29 @@ class StatsEngine():
         """
 
         stats = copy.copy(self)
+        stats._shared_metric_table = None
         stats.reset_stats(self.__settings)
+        stats.__stats_table = {}
+        stats.__parent = self
 
         return stats
 
+    def _should_sample_span_events(self, priority):
+        """Returns whether span events with the given priority would be kept
+        when merged into the span events of the stats engine this workarea
+        was created from. All span events for a transaction share the same
+        priority, so if the reservoir is already full of higher priority
+        span events there is no need to generate any of them.
+
+        """
+
+        parent = self.__parent
+
+        if parent is None or parent.span_events is None:
+            return True
+
+        return parent.span_events.should_sample(priority)
+
     def merge(self, snapshot):
         """Merges data from a single transaction. Snapshot is an instance of
         StatsEngine that contains stats for the single transaction.
@@ -1922,6 +2376,28 @@ class StatsEngine():
         self._merge_span_events(snapshot, rollback=True)
         self._merge_log_events(snapshot, rollback=True)
 
+    def fold(self, snapshot):
+        """Merges data from a stats engine which has had the data from
+        multiple transactions merged into it, such as the stats engine
+        belonging to a shard. Unlike merge() the events held by the
+        snapshot are not restricted to those of a single transaction.
+        """
+
+        if not self.__settings:
+            return
+
+        self.merge_metric_stats(snapshot)
+        self._merge_transaction_events(snapshot, rollback=True)
+        self._merge_synthetics_events(snapshot)
+        self._merge_error_events(snapshot)
+        self._merge_error_traces(snapshot)
+        self._merge_custom_events(snapshot)
+        self._merge_ml_events(snapshot)
+        self._merge_span_events(snapshot)
+        self._merge_log_events(snapshot)
+        self._merge_sql(snapshot)
+        self._merge_traces(snapshot)
+
     def merge_metric_stats(self, snapshot):
         """Merges metric data from a snapshot. This is used both when merging
         data from a single transaction into the main stats engine, and for
@@ -1932,12 +2408,21 @@ class StatsEngine():
         if not self.__settings:
             return
 
-        for key, other in snapshot.__stats_table.items():
-            stats = self.__stats_table.get(key)
-            if not stats:
-                self.__stats_table[key] = other
+        if isinstance(self.__stats_table, MetricTable):
+            if isinstance(snapshot.__stats_table, MetricTable):
+                self.__stats_table.merge_table(snapshot.__stats_table)
             else:
-                stats.merge_stats(other)
+                for key, other in snapshot.__stats_table.items():
+                    self.__stats_table.merge_stats(key, other)
+        else:
+            for key, other in snapshot.__stats_table.items():
+                stats = self.__stats_table.get(key)
+                if not stats:
+                    self.__stats_table[key] = other
+                else:
+                    stats.merge_stats(other)
+
+        self.merge_dimensional_metrics(snapshot.__dimensional_stats_table.metrics())
 
     def _merge_transaction_events(self, snapshot, rollback=False):
         # Merge in transaction events. In the normal case snapshot is a
@@ -2089,6 +2574,7 @@ class StatsEngine():
     def _snapshot(self):
         copy = object.__new__(StatsEngineSnapshot)
         copy.__dict__.update(self.__dict__)
+        copy._shared_metric_table = None
         return copy
 
 
@@ -2113,3 +2599,120 @@ class StatsEngineSnapshot(StatsEngine):
 
     def reset_error_events(self):
         self._error_events = None
+
+
+class StatsEngineShard():
+
+    """A stats engine into which the data for transactions recorded by
+    the threads assigned to the shard is merged, along with the lock which
+    protects it and counters which would otherwise be maintained by the
+    application.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = StatsEngine()
+        self.transaction_count = 0
+        self.last_transaction = 0.0
+        self.events_count = 0
+
+
+class StatsEngineShards():
+
+    """A fixed set of stats engine shards. Each thread is assigned a shard
+    the first time it records data, with threads spread across the shards
+    in round robin order. Data is accumulated in the shard under the lock
+    for that shard only and is folded into the main stats engine for the
+    application when a harvest is performed.
+
+    Note that each shard maintains its own event reservoirs with the full
+    capacity as dictated by the harvest limits. The upper bound on memory
+    used for events held between harvests is therefore multiplied by the
+    number of shards.
+
+    """
+
+    def __init__(self, count):
+        self._shards = tuple(StatsEngineShard() for _ in range(max(count, 1)))
+        self._counter = itertools.count()
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self._shards)
+
+    def __iter__(self):
+        return iter(self._shards)
+
+    def shard(self):
+        """Returns the shard assigned to the current thread."""
+
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._shards[next(self._counter) % len(self._shards)]
+            self._local.shard = shard
+            return shard
+
+    def reset_stats(self, settings):
+        """Resets all shards back to initial state and associates them
+        with the application settings object.
+
+        """
+
+        for shard in self._shards:
+            with shard.lock:
+                shard.stats.reset_stats(settings)
+                shard.transaction_count = 0
+                shard.last_transaction = 0.0
+                shard.events_count = 0
+
+    def fold(self, stats_engine):
+        """Folds the data accumulated in all shards into the supplied stats
+        engine, leaving each shard empty. The caller must hold whatever
+        lock protects the target stats engine. Returns a tuple of the
+        number of transactions recorded and the number of other events
+        recorded.
+
+        """
+
+        transaction_count = 0
+        events_count = 0
+
+        for shard in self._shards:
+            # Only swap in an empty stats engine while holding the lock for
+            # the shard so threads assigned to it are not held up while the
+            # data is being merged.
+
+            with shard.lock:
+                stats = shard.stats
+                shard.stats = copy.copy(stats)
+                shard.stats.reset_stats(stats.settings)
+
+                transaction_count += shard.transaction_count
+                events_count += shard.events_count
+
+                shard.transaction_count = 0
+                shard.last_transaction = 0.0
+                shard.events_count = 0
+
+            stats_engine.fold(stats)
+
+        return transaction_count, events_count
+
+    def transaction_stats(self):
+        """Returns a tuple of the number of transactions recorded in all
+        shards since they were last folded and the end time of the most
+        recent transaction.
+
+        """
+
+        transaction_count = 0
+        last_transaction = 0.0
+
+        for shard in self._shards:
+            with shard.lock:
+                transaction_count += shard.transaction_count
+                last_transaction = max(last_transaction, shard.last_transaction)
+
+        return transaction_count, last_transaction
@@ -16,6 +16,7 @@
 
 """
 
+import contextvars
 import logging
 import random
 import sys
@@ -40,6 +41,14 @@ def current_task(asyncio):
     if not asyncio:
         return
 
+    # There can be no current task without a running event loop. Checking
+    # for that first avoids the cost of current_task() raising an exception
+    # every time when called from a plain thread.
+
+    get_running_loop = getattr(asyncio, "_get_running_loop", None)
+    if get_running_loop is not None and get_running_loop() is None:
+        return
+
     current_task = getattr(asyncio, "current_task", None)
     if current_task is None:
         current_task = getattr(asyncio.Task, "current_task", None)
@@ -154,6 +163,16 @@ class TraceCache(MutableMapping):
     def current_trace(self):
         return self.get(self.current_thread_id())
 
+    def current_thread_trace(self):
+        """Returns the thread ID for the caller along with the current
+        trace. Where the thread ID is not needed to find the current
+        trace, None may be returned for it.
+
+        """
+
+        thread_id = self.current_thread_id()
+        return thread_id, self.get(thread_id)
+
     def active_threads(self):
         """Returns an iterator over all current stack frames for all
         active threads in the process. The result for each is a tuple
@@ -242,8 +261,15 @@ class TraceCache(MutableMapping):
 
         thread_id = trace.thread_id
 
-        if thread_id in self:
-            cache_root = self[thread_id].root
+        self._check_active_trace(trace, self._cache.get(thread_id))
+
+        self[thread_id] = trace
+
+        self._save_coroutine_context(trace)
+
+    def _check_active_trace(self, trace, cached):
+        if cached is not None:
+            cache_root = cached.root
             if cache_root and cache_root is not trace.root and not cache_root.exited:
                 # Cached trace exists and has a valid root still
                 _logger.error(
@@ -255,27 +281,53 @@ class TraceCache(MutableMapping):
 
                 raise TraceCacheActiveTraceError("transaction already active")
 
-        self[thread_id] = trace
+    def _save_coroutine_context(self, trace):
+        thread_id = trace.thread_id
 
         # We judge whether we are actually running in a coroutine by
-        # seeing if the current thread ID is actually listed in the set
-        # of all current frames for executing threads. If we are
-        # executing within a greenlet, then thread.get_ident() will
-        # return the greenlet identifier. This will not be a key in
-        # dictionary of all current frames because that will still be
-        # the original standard thread which all greenlets are running
-        # within.
+        # seeing if the thread ID the trace was saved under differs from
+        # that of the executing thread. When running in a greenlet or an
+        # asyncio task, current_thread_id() will have returned the ID of
+        # the greenlet or task instead. When gevent has monkey patched
+        # the thread module, get_ident() also returns the ID of the
+        # greenlet, so whether we are in a greenlet is checked directly.
 
         trace._greenlet = None
 
-        if hasattr(sys, "_current_frames"):
-            if thread_id not in sys._current_frames():
-                if self.greenlet:
-                    trace._greenlet = weakref.ref(self.greenlet.getcurrent())
+        if thread_id == thread.get_ident() and not self._in_greenlet():
+            return
+
+        # A trace nested within a parent running in the same greenlet or
+        # task can reuse what was determined when the parent was saved,
+        # so the lookups are only done for the root of the transaction or
+        # the first trace in a new task.
+
+        parent = trace.parent
+
+        if parent is not None and parent.thread_id == thread_id and hasattr(parent, "_greenlet"):
+            trace._greenlet = parent._greenlet
+
+            if not hasattr(trace, "_task"):
+                if hasattr(parent, "_task"):
+                    trace._task = parent._task
+                elif self.asyncio:
+                    trace._task = current_task(self.asyncio)
+
+            return
+
+        if self.greenlet:
+            trace._greenlet = weakref.ref(self.greenlet.getcurrent())
+
+        if self.asyncio and not hasattr(trace, "_task"):
+            task = current_task(self.asyncio)
+            trace._task = task
+
+    def _in_greenlet(self):
+        if not self.greenlet:
+            return False
 
-                if self.asyncio and not hasattr(trace, "_task"):
-                    task = current_task(self.asyncio)
-                    trace._task = task
+        current = self.greenlet.getcurrent()
+        return bool(current is not None and current.parent)
 
     def pop_current(self, trace):
         """Restore the trace's parent under the thread ID of the current
@@ -449,13 +501,169 @@ class TraceCache(MutableMapping):
         return bool(self._cache.__len__())
 
 
-_trace_cache = TraceCache()
+class ContextVarTraceCache(TraceCache):
+    """Trace cache where the current trace is held in a context variable.
+    As asyncio copies the context when a task is created, the current trace
+    propagates to tasks without needing to be recorded against the task
+    when it is started, and likewise to any thread whose target is run
+    within a context obtained from contextvars.copy_context().
+
+    Traces are still recorded against the thread ID of where they were
+    saved so that the active threads and tasks can be iterated over, but
+    the current trace is always looked up from the context.
+
+    """
+
+    def __init__(self):
+        super(ContextVarTraceCache, self).__init__()
+        self._context = contextvars.ContextVar("newrelic_trace", default=None)
+
+    def _set_current(self, trace):
+        self._context.set(trace is not None and weakref.ref(trace) or None)
+
+    def current_trace(self):
+        current = self._context.get()
+        trace = current and current()
+
+        # Where the trace was completed from another context, such as when
+        # the transaction finished while a task was still running, whatever
+        # has since been recorded against its thread ID is current instead.
+
+        if trace is not None and trace.exited:
+            return self.get(trace.thread_id)
+
+        return trace
+
+    def current_transaction(self):
+        trace = self.current_trace()
+        return trace and trace.transaction
+
+    def current_thread_trace(self):
+        return None, self.current_trace()
+
+    def task_start(self, task):
+        pass
+
+    def task_stop(self, task):
+        pass
+
+    def prepare_for_root(self):
+        trace = self.current_trace()
+        if not trace:
+            return None
+
+        if not hasattr(trace, "_task"):
+            return trace
+
+        task = current_task(self.asyncio)
+        if (task is not None and id(trace._task) != id(task)) or (trace.root and trace.root.exited):
+            self._set_current(None)
+            return None
+
+        return trace
+
+    def save_trace(self, trace):
+        self._check_active_trace(trace, self.current_trace())
+
+        self._cache[trace.thread_id] = trace
+        self._set_current(trace)
+
+        self._save_coroutine_context(trace)
+
+    def pop_current(self, trace):
+        if hasattr(trace, "_task"):
+            delattr(trace, "_task")
+
+        # Where the parent is in a different thread or task, such as when
+        # this was the first trace in a task, the parent is only current
+        # through the context having been copied, so rather than restore
+        # the parent against this thread ID the entry is removed. This
+        # avoids the need to remove entries for tasks when they finish.
+
+        thread_id = trace.thread_id
+        parent = trace.parent
+
+        if parent.thread_id == thread_id:
+            self._cache[thread_id] = parent
+        else:
+            self._cache.pop(thread_id, None)
+
+        # The trace may be completed from the context of a child which
+        # exited last, in which case the current trace for this context
+        # is not the one being popped and must be left alone.
+
+        current = self._context.get()
+        if current is not None and current() is trace:
+            self._set_current(parent)
+
+    def complete_root(self, root):
+        super(ContextVarTraceCache, self).complete_root(root)
+
+        current = self._context.get()
+        if current is not None and current() is root:
+            self._set_current(None)
+
+    # Any trace explicitly stored or removed against the ID of the caller,
+    # such as when propagating context with ContextOf, also becomes the
+    # current trace for the context.
+
+    def __setitem__(self, key, value):
+        super(ContextVarTraceCache, self).__setitem__(key, value)
+        if key == self.current_thread_id():
+            self._set_current(value)
+
+    def __delitem__(self, key):
+        super(ContextVarTraceCache, self).__delitem__(key)
+        if key == self.current_thread_id():
+            self._set_current(None)
+
+
+def _create_trace_cache():
+    if global_settings().trace_cache.context_variables:
+        return ContextVarTraceCache()
+    return TraceCache()
+
+
+_trace_cache = _create_trace_cache()
 
 
 def trace_cache():
     return _trace_cache
 
 
+def use_context_variables():
+    """Replaces the trace cache with one where the current trace is held
+    in a context variable. This must be called before any transactions
+    have been started, so is a no-op if any traces are in the cache.
+
+    """
+
+    global _trace_cache
+
+    if isinstance(_trace_cache, ContextVarTraceCache):
+        return True
+
+    if _trace_cache:
+        _logger.warning(
+            "Unable to switch to tracking the current trace using context "
+            "variables as traces have already been recorded."
+        )
+        return False
+
+    cache = ContextVarTraceCache()
+
+    # Carry over the greenlet and asyncio modules if they have already
+    # been set as loaded, or not, by the import hooks.
+
+    for name in ("greenlet", "asyncio"):
+        if name in _trace_cache.__dict__:
+            cache.__dict__[name] = _trace_cache.__dict__[name]
+
+    _trace_cache = cache
+
+    return True
+
+
 def greenlet_loaded(module):
     _trace_cache.greenlet = module
 
@@ -653,3 +653,6 @@ class TransactionNode(_TransactionNode):
             attr_class=attr_class,
         ):
             yield event
+
+    def span_event_count(self):
+        return self.root.span_event_count()
@@ -0,0 +1,215 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module implements a background recorder which takes completed
+transactions off the thread which handled the request and aggregates them
+into the stats engine of the application from a dedicated worker thread.
+
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+_logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("drop", "block", "inline")
+
+
+class TransactionRecorder():
+
+    """Bounded queue of transaction nodes which are waiting to be recorded
+    by a background worker thread. What happens when the queue is full is
+    dictated by the overflow policy:
+
+        drop:   The transaction is discarded and counted as dropped.
+        block:  The caller waits up to block_timeout seconds for space to
+                become available before the transaction is dropped.
+        inline: The transaction is recorded on the calling thread as would
+                be done when the background recorder is not enabled.
+
+    """
+
+    def __init__(self, record, name, queue_size=1000, overflow_policy="drop", block_timeout=0.1):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            _logger.warning(
+                "Unknown transaction recorder overflow policy %r. Defaulting to %r.", overflow_policy, "drop"
+            )
+            overflow_policy = "drop"
+
+        self._record = record
+        self._name = name
+        self._queue_size = max(queue_size, 1)
+        self._overflow_policy = overflow_policy
+        self._block_timeout = block_timeout
+
+        self._queue = collections.deque()
+        self._notify = threading.Condition()
+        self._pending = 0
+        self._shutdown = False
+
+        self._thread = None
+        self._process_id = None
+
+        self._queued = 0
+        self._dropped = 0
+        self._inline = 0
+        self._max_depth = 0
+
+    @property
+    def overflow_policy(self):
+        return self._overflow_policy
+
+    def _start(self):
+        # The worker thread does not survive a fork of the process, so if
+        # we find ourselves in a new process discard anything inherited
+        # from the parent and start a new worker.
+
+        process_id = os.getpid()
+
+        if self._thread is not None and self._process_id == process_id:
+            return
+
+        if self._process_id is not None and self._process_id != process_id:
+            self._queue.clear()
+            self._pending = 0
+
+        self._process_id = process_id
+
+        self._thread = threading.Thread(target=self._run, name=f"NR-Transaction-Recorder/{self._name}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, transaction):
+        """Queues the transaction for recording. Returns False if the
+        transaction could not be queued and was not otherwise recorded.
+
+        """
+
+        with self._notify:
+            if self._shutdown:
+                return False
+
+            self._start()
+
+            if self._pending >= self._queue_size:
+                if self._overflow_policy == "block":
+                    deadline = time.time() + self._block_timeout
+                    while self._pending >= self._queue_size and not self._shutdown:
+                        remaining = deadline - time.time()
+                        if remaining <= 0.0:
+                            break
+                        self._notify.wait(remaining)
+
+                if self._pending >= self._queue_size or self._shutdown:
+                    if self._overflow_policy != "inline":
+                        self._dropped += 1
+                        return False
+
+                    self._inline += 1
+                    inline = True
+                else:
+                    inline = False
+            else:
+                inline = False
+
+            if not inline:
+                self._queued += 1
+                self._pending += 1
+                self._max_depth = max(self._max_depth, self._pending)
+                self._queue.append(transaction)
+                self._notify.notify_all()
+                return True
+
+        # Record outside of the lock so as not to hold up the worker or
+        # other request threads.
+
+        self._record(transaction)
+        return True
+
+    def _run(self):
+        while True:
+            with self._notify:
+                while not self._queue and not self._shutdown:
+                    self._notify.wait()
+
+                if not self._queue:
+                    return
+
+                transaction = self._queue.popleft()
+
+            try:
+                self._record(transaction)
+            except Exception:
+                _logger.exception(
+                    "The background recording of transaction data has "
+                    "failed. This would indicate some sort of internal "
+                    "implementation issue with the agent. Please report "
+                    "this problem to New Relic support for further "
+                    "investigation."
+                )
+            finally:
+                with self._notify:
+                    self._pending -= 1
+                    self._notify.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all queued transactions have been recorded. Returns
+        True if the queue was fully drained in the time allowed.
+
+        """
+
+        deadline = timeout is not None and time.time() + timeout
+
+        with self._notify:
+            if self._thread is None or self._process_id != os.getpid():
+                return not self._pending
+
+            while self._pending:
+                if deadline:
+                    remaining = deadline - time.time()
+                    if remaining <= 0.0:
+                        return False
+                    self._notify.wait(remaining)
+                else:
+                    self._notify.wait()
+
+        return True
+
+    def shutdown(self, timeout=None):
+        """Drains the queue and then stops the worker thread."""
+
+        self.flush(timeout)
+
+        with self._notify:
+            self._shutdown = True
+            self._notify.notify_all()
+
+    def stats(self):
+        """Returns and resets the counters used for the supportability
+        metrics as a tuple of queued, dropped, inline and maximum depth.
+
+        """
+
+        with self._notify:
+            stats = (self._queued, self._dropped, self._inline, self._max_depth)
+            self._queued, self._dropped, self._inline = 0, 0, 0
+            self._max_depth = self._pending
+
+        return stats
+
+    def __len__(self):
+        return self._pending
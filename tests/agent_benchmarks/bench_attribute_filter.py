@@ -0,0 +1,64 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.attribute_filter import DST_ALL, AttributeFilter
+
+_destinations = (
+    "attributes",
+    "transaction_events.attributes",
+    "transaction_tracer.attributes",
+    "error_collector.attributes",
+    "browser_monitoring.attributes",
+    "span_events.attributes",
+)
+
+
+def _settings(rules):
+    settings = {"attributes.enabled": True}
+
+    for destination in _destinations[1:]:
+        settings[f"{destination}.enabled"] = True
+
+    # Spread a mixture of exact and wildcard, include and exclude rules
+    # across all of the destinations.
+
+    for index in range(rules):
+        destination = _destinations[index % len(_destinations)]
+        kind = "include" if index % 2 else "exclude"
+        name = f"custom.group{index % 50}.attribute{index}"
+        if index % 3 == 0:
+            name = f"{name[: -len(str(index))]}*"
+        settings.setdefault(f"{destination}.{kind}", []).append(name)
+
+    return settings
+
+
+class TimeApply:
+    """Time taken to filter N distinct attribute names, none of which have
+    been seen before, against a set of attribute filter rules.
+
+    """
+
+    params = ([10, 100, 1000], [1000, 100000])
+    param_names = ["rules", "names"]
+    timeout = 300
+
+    def setup(self, rules, names):
+        self.attribute_filter = AttributeFilter(_settings(rules))
+        self.names = [f"custom.group{index % 50}.attribute{index}" for index in range(names)]
+
+    def time_apply(self, rules, names):
+        apply = self.attribute_filter.apply
+        for name in self.names:
+            apply(name, DST_ALL)
@@ -0,0 +1,73 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tracemalloc
+
+from newrelic.common.agent_http import HttpClient
+from newrelic.common.encoding_utils import json_encode, json_encode_chunks
+
+
+def _span_events(events):
+    for index in range(events):
+        yield [
+            {
+                "type": "Span",
+                "traceId": "4bf92f3577b34da6a3ce929d0e0e4736",
+                "guid": f"{index:016x}",
+                "name": f"Function/benchmark/span/{index % 100}",
+                "timestamp": 1700000000000 + index,
+                "duration": 0.001 * (index % 10),
+                "category": "generic",
+            },
+            {},
+            {"code.function": "benchmark"},
+        ]
+
+
+def _payload(events):
+    return ("RUN_TOKEN", {"reservoir_size": events, "events_seen": events}, _span_events(events))
+
+
+def _encode_and_compress(streaming, events):
+    if streaming:
+        return HttpClient._compress_chunks(json_encode_chunks(_payload(events)), 64 * 1024)[1]
+
+    payload = json_encode(_payload(events)).encode("utf-8")
+    return HttpClient._compress(payload)[0]
+
+
+class HarvestPayloadSuite:
+    """Peak memory used and time taken to encode and compress a span event
+    payload of N events, either in one go or streamed in chunks.
+
+    """
+
+    params = ([1000, 10000, 100000], [False, True])
+    param_names = ["events", "streaming"]
+    timeout = 300
+
+    def track_peak_memory_bytes(self, events, streaming):
+        tracemalloc.start()
+        try:
+            body = _encode_and_compress(streaming, events)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del body
+        return peak
+
+    track_peak_memory_bytes.unit = "bytes"
+
+    def time_encode_and_compress(self, events, streaming):
+        _encode_and_compress(streaming, events)
@@ -0,0 +1,62 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import os
+import subprocess
+import sys
+
+RUNS = 5
+
+_SCRIPT = """
+import time
+start = time.perf_counter()
+import newrelic.agent
+imported = time.perf_counter()
+newrelic.agent.initialize()
+initialized = time.perf_counter()
+print(imported - start, initialized - imported)
+"""
+
+
+class TrackAgentStartup:
+    """Time taken in a new process to import newrelic.agent and then to
+    call newrelic.agent.initialize() without a configuration file, taking
+    the median of a number of runs. This includes registering the import
+    hooks for all modules which are instrumented by default.
+
+    """
+
+    timeout = 120
+
+    def setup(self):
+        environ = dict(os.environ)
+        environ.pop("NEW_RELIC_CONFIG_FILE", None)
+        environ["NEW_RELIC_DEVELOPER_MODE"] = "true"
+
+        results = []
+        for _ in range(RUNS):
+            output = subprocess.check_output([sys.executable, "-c", _SCRIPT], env=environ)
+            results.append([float(value) for value in output.split()])
+
+        results.sort(key=lambda result: result[1])
+        self.imported, self.initialized = results[len(results) // 2]
+
+    def track_import_ms(self):
+        return self.imported * 1000.0
+
+    track_import_ms.unit = "ms"
+
+    def track_initialize_ms(self):
+        return self.initialized * 1000.0
+
+    track_initialize_ms.unit = "ms"
@@ -0,0 +1,106 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.common.encoding_utils import JSON_BACKENDS, json_encode_chunks
+
+
+def _metric_data(count):
+    return (
+        "RUN_TOKEN",
+        1700000000.0,
+        1700000060.0,
+        [
+            ({"name": f"Function/benchmark/{index}", "scope": ""}, [index, 0.5, 0.5, 0.001, 0.01, 0.0001])
+            for index in range(count)
+        ],
+    )
+
+
+def _analytic_event_data(count):
+    return (
+        "RUN_TOKEN",
+        {"reservoir_size": count, "events_seen": count},
+        [
+            [
+                {
+                    "type": "Transaction",
+                    "name": f"WebTransaction/Function/benchmark:{index % 50}",
+                    "timestamp": 1700000000000 + index,
+                    "duration": 0.01,
+                    "error": False,
+                    "guid": f"{index:016x}",
+                    "priority": 1.234567,
+                    "sampled": True,
+                },
+                {"user.id": index},
+                {"response.status": "200", "request.method": "GET"},
+            ]
+            for index in range(count)
+        ],
+    )
+
+
+def _span_event_data(count):
+    return (
+        "RUN_TOKEN",
+        {"reservoir_size": count, "events_seen": count},
+        [
+            [
+                {
+                    "type": "Span",
+                    "traceId": "4bf92f3577b34da6a3ce929d0e0e4736",
+                    "guid": f"{index:016x}",
+                    "parentId": f"{index + 1:016x}",
+                    "transactionId": "00f067aa0ba902b7",
+                    "name": f"Function/benchmark/span/{index % 100}",
+                    "timestamp": 1700000000000 + index,
+                    "duration": 0.001 * (index % 10),
+                    "category": "generic",
+                    "nr.entryPoint": index == 0,
+                },
+                {},
+                {"code.function": "benchmark", "code.lineno": index % 300},
+            ]
+            for index in range(count)
+        ],
+    )
+
+
+_payloads = {
+    "metric_data": _metric_data,
+    "analytic_event_data": _analytic_event_data,
+    "span_event_data": _span_event_data,
+}
+
+
+class JSONBackendSuite:
+    """Time taken to serialize harvest payloads with each of the available
+    JSON backends, both in one go and in chunks as sent to the collector.
+
+    """
+
+    params = (list(_payloads), list(JSON_BACKENDS), [1000, 10000])
+    param_names = ["method", "backend", "count"]
+    timeout = 120
+
+    def setup(self, method, backend, count):
+        self.payload = _payloads[method](count)
+        self.backend = JSON_BACKENDS[backend]
+
+    def time_encode(self, method, backend, count):
+        self.backend.encode(self.payload)
+
+    def time_encode_chunks(self, method, backend, count):
+        for _ in json_encode_chunks(self.payload, backend=self.backend):
+            pass
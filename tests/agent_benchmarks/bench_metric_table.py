@@ -0,0 +1,62 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import tracemalloc
+
+from newrelic.core.stats_engine import MetricTable, TimeStats
+
+
+def _populate(table, metrics):
+    for index in range(metrics):
+        table[(f"Function/benchmark/{index}", "")] = TimeStats(1, 0.001, 0.001, 0.001, 0.001, 0.000001)
+    return table
+
+
+def _create_table(columnar, metrics):
+    return _populate(MetricTable() if columnar else {}, metrics)
+
+
+class MetricTableSuite:
+    """Memory held by, and time taken to merge, a stats table of N metrics
+    stored either as a dictionary of TimeStats objects or as a columnar
+    MetricTable.
+
+    """
+
+    params = ([1000, 10000, 100000], [False, True])
+    param_names = ["metrics", "columnar"]
+    timeout = 120
+
+    def setup(self, metrics, columnar):
+        self.target = _create_table(columnar, metrics)
+        self.other = _create_table(columnar, metrics)
+
+    def track_memory_bytes(self, metrics, columnar):
+        tracemalloc.start()
+        try:
+            table = _create_table(columnar, metrics)
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del table
+        return size
+
+    track_memory_bytes.unit = "bytes"
+
+    def time_merge(self, metrics, columnar):
+        if columnar:
+            self.target.merge_table(self.other)
+        else:
+            for key, other in self.other.items():
+                self.target[key].merge_stats(other)
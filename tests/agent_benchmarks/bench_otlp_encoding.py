@@ -0,0 +1,100 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.common.encoding_utils import json_encode
+from newrelic.core.otlp_utils import encode_span_event_data, encode_timeslice_metric_data, otlp_encode
+
+
+def _metric_data(count):
+    scopes = ("", "WebTransaction/Function/benchmark")
+    return [
+        ({"name": f"Function/benchmark/{index}", "scope": scopes[index % 2]}, [index, 0.5, 0.5, 0.001, 0.01, 0.0001])
+        for index in range(count)
+    ]
+
+
+def _span_event_data(count):
+    return [
+        [
+            {
+                "type": "Span",
+                "traceId": "4bf92f3577b34da6a3ce929d0e0e4736",
+                "guid": f"{index:016x}",
+                "parentId": f"{index + 1:016x}",
+                "transactionId": "00f067aa0ba902b7",
+                "name": f"Function/benchmark/span/{index % 100}",
+                "timestamp": 1700000000000 + index,
+                "duration": 0.001 * (index % 10),
+                "category": "generic",
+                "nr.entryPoint": index == 0,
+            },
+            {},
+            {"code.function": "benchmark", "code.lineno": index % 300},
+        ]
+        for index in range(count)
+    ]
+
+
+def _encode_json(method, data):
+    if method == "metric_data":
+        payload = ("RUN_TOKEN", 1700000000.0, 1700000060.0, data)
+    else:
+        payload = ("RUN_TOKEN", {"reservoir_size": len(data), "events_seen": len(data)}, data)
+
+    return json_encode(payload).encode("utf-8")
+
+
+def _encode_otlp(method, data):
+    if method == "metric_data":
+        payload, _ = encode_timeslice_metric_data(data, 1700000000.0, 1700000060.0)
+    else:
+        payload = encode_span_event_data(data, "RUN_TOKEN")
+
+    return otlp_encode(payload)
+
+
+_payloads = {
+    "metric_data": _metric_data,
+    "span_event_data": _span_event_data,
+}
+
+_encoders = {
+    "json": _encode_json,
+    "otlp": _encode_otlp,
+}
+
+
+class OtlpEncodingSuite:
+    """Time taken to encode metric data and span event payloads, and the
+    size of the encoded payload, when sent as JSON to the data collector
+    or as OTLP protocol buffers. If protobuf is not installed the OTLP
+    payloads fall back to being encoded as JSON.
+
+    """
+
+    params = (list(_payloads), list(_encoders), [1000, 10000])
+    param_names = ["method", "encoding", "count"]
+    timeout = 120
+
+    def setup(self, method, encoding, count):
+        self.data = _payloads[method](count)
+        self.encode = _encoders[encoding]
+
+    def time_encode(self, method, encoding, count):
+        self.encode(method, self.data)
+
+    def track_payload_bytes(self, method, encoding, count):
+        return len(self.encode(method, self.data))
+
+    track_payload_bytes.unit = "bytes"
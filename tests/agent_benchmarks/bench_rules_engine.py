@@ -0,0 +1,74 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.rules_engine import RulesEngine
+
+
+def _rules(count):
+    rules = []
+
+    for index in range(count):
+        rules.append(
+            {
+                "match_expression": f"^/service{index}/(.*)/[0-9]+$",
+                "replacement": f"/service{index}/\\1/*",
+                "eval_order": index,
+                "each_segment": False,
+                "ignore": False,
+                "terminate_chain": True,
+                "replace_all": False,
+            }
+        )
+
+    rules.append(
+        {
+            "match_expression": "^[0-9a-f]{32}$",
+            "replacement": "*",
+            "eval_order": count,
+            "each_segment": True,
+            "ignore": False,
+            "terminate_chain": False,
+            "replace_all": False,
+        }
+    )
+
+    return rules
+
+
+class TimeNormalize:
+    """Time taken to normalize a mixture of names, most of which are not
+    matched by any of the rules, as is typical of the request path.
+
+    """
+
+    params = ([1, 10, 50], [100, 10000])
+    param_names = ["rules", "distinct"]
+
+    def setup(self, rules, distinct):
+        self.rules_engine = RulesEngine(_rules(rules), cache_size=1000)
+        self.uncached = RulesEngine(_rules(rules))._normalize
+        self.names = [
+            f"/service{index % (rules * 2)}/api/v1/resource/{index % distinct}" if index % 10 == 0 else "/api/v1/status"
+            for index in range(10000)
+        ]
+
+    def time_normalize(self, rules, distinct):
+        normalize = self.rules_engine.normalize
+        for name in self.names:
+            normalize(name)
+
+    def time_normalize_uncached(self, rules, distinct):
+        normalize = self.uncached
+        for name in self.names:
+            normalize(name)
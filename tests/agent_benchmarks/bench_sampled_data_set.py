@@ -0,0 +1,66 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import random
+
+from newrelic.core.stats_engine import SampledDataSet
+
+
+def _data_set(capacity, samples):
+    data_set = SampledDataSet(capacity=capacity)
+    for index in range(samples):
+        data_set.add(index, priority=random.random())  # nosec
+    return data_set
+
+
+class TimeMergeTransaction:
+    """Time taken to merge the samples of a single transaction, such as its
+    span events, into a full reservoir of the given capacity.
+
+    """
+
+    params = ([1000, 2000, 5000, 10000], [10, 100, 1000])
+    param_names = ["capacity", "samples"]
+
+    def setup(self, capacity, samples):
+        random.seed(0)
+        self.full = _data_set(capacity, capacity)
+        self.transaction = _data_set(samples, samples)
+
+    def time_merge(self, capacity, samples):
+        data_set = copy.copy(self.full)
+        data_set.pq = list(self.full.pq)
+        data_set.merge(self.transaction)
+
+
+class TimeMergeReservoir:
+    """Time taken to merge one full reservoir into another, as is done when
+    stats engine snapshots are merged back after a failed harvest or when
+    stats engine shards are folded together.
+
+    """
+
+    params = [1000, 2000, 5000, 10000]
+    param_names = ["capacity"]
+
+    def setup(self, capacity):
+        random.seed(0)
+        self.full = _data_set(capacity, capacity)
+        self.other = _data_set(capacity, capacity)
+
+    def time_merge(self, capacity):
+        data_set = copy.copy(self.full)
+        data_set.pq = list(self.full.pq)
+        data_set.merge(self.other)
@@ -0,0 +1,84 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from newrelic.core.database_utils import SQLStatement, _sql_statements, sql_statement
+
+# SQL in the style generated by ORMs such as Django and SQLAlchemy, with
+# literal values inlined as happens when parameters are interpolated by
+# the database client before the statement is traced.
+
+ORM_SQL = [
+    'SELECT "auth_user"."id", "auth_user"."password", "auth_user"."last_login", "auth_user"."is_superuser", '
+    '"auth_user"."username", "auth_user"."first_name", "auth_user"."last_name", "auth_user"."email", '
+    '"auth_user"."is_staff", "auth_user"."is_active", "auth_user"."date_joined" FROM "auth_user" '
+    "WHERE \"auth_user\".\"username\" = 'alice@example.com' LIMIT 21",
+    "SELECT orders.id AS orders_id, orders.customer_id AS orders_customer_id, orders.total AS orders_total, "
+    "orders.created_at AS orders_created_at FROM orders JOIN customers ON customers.id = orders.customer_id "
+    "WHERE orders.total > 100.5 AND orders.created_at >= '2024-01-01 00:00:00' AND customers.region IN "
+    "('emea', 'apac', 'amer') ORDER BY orders.created_at DESC LIMIT 50 OFFSET 100",
+    "INSERT INTO events (id, session_id, name, payload, created_at) VALUES "
+    "('6f1c2a4e-9b0d-4a57-8c1e-2f3b4c5d6e7f', 1234567, 'page_view', '{\"path\": \"/home\"}', "
+    "'2024-05-01 12:34:56.789')",
+    "UPDATE products SET stock = stock - 3, updated_at = '2024-05-01 12:34:56', is_active = true "
+    "WHERE products.id = 98765 AND products.version = 12",
+    "DELETE FROM sessions WHERE sessions.expires_at < '2024-05-01 00:00:00' AND sessions.user_id = 0x1f3a",
+]
+
+QUOTING_STYLES = ["single", "single+double", "single+dollar", "single+oracle"]
+
+
+class DBAPI2Module():
+    def __init__(self, quoting_style):
+        self._nr_quoting_style = quoting_style
+
+
+class TimeObfuscate:
+    """Time taken to obfuscate and normalize ORM generated SQL without the
+    use of the SQL statement cache.
+
+    """
+
+    params = QUOTING_STYLES
+    param_names = ["quoting_style"]
+
+    def setup(self, quoting_style):
+        from newrelic.core.database_utils import SQLDatabase
+
+        self.database = SQLDatabase(DBAPI2Module(quoting_style))
+
+    def time_obfuscate(self, quoting_style):
+        for sql in ORM_SQL:
+            statement = SQLStatement(sql, self.database)
+            statement.normalized
+            statement.target
+
+
+class TimeCachedStatement:
+    """Time taken to obfuscate and normalize ORM generated SQL where the
+    same SQL is seen repeatedly and the SQL statement cache is used.
+
+    """
+
+    def setup(self):
+        _sql_statements.clear()
+        self.dbapi2_module = DBAPI2Module("single+double")
+
+    def teardown(self):
+        _sql_statements.clear()
+
+    def time_sql_statement(self):
+        for sql in ORM_SQL:
+            statement = sql_statement(sql, self.dbapi2_module)
+            statement.normalized
+            statement.target
@@ -0,0 +1,83 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+from newrelic.core.config import global_settings
+from newrelic.core.stats_engine import StatsEngine, StatsEngineShards
+
+TRANSACTIONS_PER_THREAD = 200
+
+
+def _create_workarea(parent, index):
+    workarea = parent.create_workarea()
+    for metric in range(20):
+        workarea.record_custom_metric(f"Function/benchmark/{metric}", 0.001)
+    workarea.transaction_events.add({"name": "WebTransaction/Function/benchmark", "index": index})
+    return workarea
+
+
+class TimeMergeAcrossThreads:
+    """Time taken for N threads to each merge TRANSACTIONS_PER_THREAD
+    transaction workareas, either into a single stats engine under one lock
+    or into stats engine shards which are then folded together.
+
+    """
+
+    params = ([1, 4, 16, 64], [0, 8])
+    param_names = ["threads", "shards"]
+    timeout = 120
+
+    def setup(self, threads, shards):
+        settings = global_settings()
+
+        self.stats_engine = StatsEngine()
+        self.stats_engine.reset_stats(settings)
+        self.stats_lock = threading.RLock()
+
+        if shards:
+            self.stats_shards = StatsEngineShards(shards)
+            self.stats_shards.reset_stats(settings)
+        else:
+            self.stats_shards = None
+
+        self.workareas = [
+            [_create_workarea(self.stats_engine, index) for index in range(TRANSACTIONS_PER_THREAD)]
+            for _ in range(threads)
+        ]
+
+    def _merge_locked(self, workareas):
+        for workarea in workareas:
+            with self.stats_lock:
+                self.stats_engine.merge(workarea)
+
+    def _merge_sharded(self, workareas):
+        stats_shard = self.stats_shards.shard()
+        for workarea in workareas:
+            with stats_shard.lock:
+                stats_shard.transaction_count += 1
+                stats_shard.stats.merge(workarea)
+
+    def time_merge(self, threads, shards):
+        target = self._merge_sharded if self.stats_shards else self._merge_locked
+
+        workers = [threading.Thread(target=target, args=(workareas,)) for workareas in self.workareas]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        if self.stats_shards:
+            with self.stats_lock:
+                self.stats_shards.fold(self.stats_engine)
@@ -0,0 +1,164 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+import time
+
+from newrelic.api.datastore_trace import DatastoreTrace
+from newrelic.api.external_trace import ExternalTrace
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.api.transaction import Sentinel
+from newrelic.core.config import global_settings
+from newrelic.core.trace_cache import trace_cache
+
+ITERATIONS = 1000
+
+
+class _Transaction:
+    """Stand in for a transaction which is only as much as the traces need,
+    so that what is measured is the overhead of the traces themselves.
+
+    """
+
+    stopped = False
+    enabled = True
+    should_record_segment_params = False
+
+    def __init__(self):
+        self.settings = global_settings()
+        self.thread_id = trace_cache().current_thread_id()
+
+    def _intern_string(self, value):
+        return value
+
+    def _process_node(self, node):
+        pass
+
+
+def _leaf_trace(leaf):
+    if leaf == "datastore":
+        return DatastoreTrace("Postgres", "users", "select")
+    elif leaf == "external":
+        return ExternalTrace("requests", "http://localhost/benchmark", "GET")
+    return FunctionTrace("leaf", group="Python/benchmark")
+
+
+def _nested_traces(depth, leaf):
+    if depth <= 1:
+        with _leaf_trace(leaf):
+            pass
+        return
+
+    with FunctionTrace(f"depth_{depth}", group="Python/benchmark"):
+        _nested_traces(depth - 1, leaf)
+
+
+class TimeNestedTraces:
+    """Time taken to enter and exit a stack of nested function traces of a
+    given depth, with the innermost trace being of the given kind.
+
+    """
+
+    params = ([1, 10, 50], ["function", "datastore", "external"])
+    param_names = ["depth", "leaf"]
+
+    def setup(self, depth, leaf):
+        self.transaction = _Transaction()
+        self.root = Sentinel(self.transaction)
+        trace_cache().save_trace(self.root)
+
+    def teardown(self, depth, leaf):
+        self.root.complete_root()
+
+    def time_nested_traces(self, depth, leaf):
+        for _ in range(ITERATIONS):
+            _nested_traces(depth, leaf)
+
+    def track_ns_per_trace(self, depth, leaf):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            _nested_traces(depth, leaf)
+        return (time.perf_counter() - start) * 1e9 / (ITERATIONS * depth)
+
+    track_ns_per_trace.unit = "ns"
+
+
+class TimeNestedTracesThreads:
+    """Time taken per trace for nested function traces when recorded
+    concurrently from a number of threads, each with its own root.
+
+    """
+
+    params = ([1, 8, 32], [10])
+    param_names = ["threads", "depth"]
+    timeout = 120
+
+    def _worker(self, depth, results, index):
+        transaction = _Transaction()
+        root = Sentinel(transaction)
+        trace_cache().save_trace(root)
+        try:
+            start = time.perf_counter()
+            for _ in range(ITERATIONS):
+                _nested_traces(depth, "function")
+            results[index] = (time.perf_counter() - start) * 1e9 / (ITERATIONS * depth)
+        finally:
+            root.complete_root()
+
+    def track_ns_per_trace(self, threads, depth):
+        results = [0.0] * threads
+        workers = [threading.Thread(target=self._worker, args=(depth, results, index)) for index in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return sum(results) / threads
+
+    track_ns_per_trace.unit = "ns"
+
+
+class TimeTracesWithIdleThreads:
+    """Time taken per trace for nested function traces while a number of
+    other threads exist in the process but are idle, which should not be
+    affected by the number of threads.
+
+    """
+
+    params = ([1, 10, 50, 200], [10])
+    param_names = ["threads", "depth"]
+    timeout = 120
+
+    def setup(self, threads, depth):
+        self.shutdown = threading.Event()
+        self.idle = [threading.Thread(target=self.shutdown.wait) for _ in range(threads)]
+        for thread in self.idle:
+            thread.start()
+
+        self.transaction = _Transaction()
+        self.root = Sentinel(self.transaction)
+        trace_cache().save_trace(self.root)
+
+    def teardown(self, threads, depth):
+        self.root.complete_root()
+
+        self.shutdown.set()
+        for thread in self.idle:
+            thread.join()
+
+    def track_ns_per_trace(self, threads, depth):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            _nested_traces(depth, "function")
+        return (time.perf_counter() - start) * 1e9 / (ITERATIONS * depth)
+
+    track_ns_per_trace.unit = "ns"
@@ -0,0 +1,109 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import zlib
+
+import pytest
+
+from newrelic.common.adaptive_compression import (
+    DEFAULT_RATES,
+    DEFAULT_ZSTD_RATES,
+    AdaptiveCompression,
+    compressobj,
+    nearest_level,
+    zstd_available,
+)
+
+
+def test_small_payload_uses_highest_level():
+    policy = AdaptiveCompression(time_budget=1.0)
+    assert policy.choose("metric_data", 1024) == 9
+
+
+def test_level_lowered_to_fit_time_budget():
+    policy = AdaptiveCompression(time_budget=1.0)
+
+    # A payload which would take longer than the budget at the highest
+    # level, but not at the next level down.
+    size = int(DEFAULT_RATES[6] * 0.9)
+    assert policy.choose("span_event_data", size) == 6
+
+    # Once the budget has been used up, the lowest level is used.
+    policy.record("span_event_data", 6, size, size // 10, 1.0)
+    assert policy.choose("span_event_data", size) == 1
+
+    policy.reset_budget()
+    assert policy.choose("metric_data", 1024) == 9
+
+
+def test_level_skipped_without_improvement():
+    policy = AdaptiveCompression(time_budget=1.0)
+
+    policy.record("metric_data", 9, 1000, 100, 0.0)
+    policy.record("metric_data", 6, 1000, 100, 0.0)
+    policy.record("metric_data", 3, 1000, 200, 0.0)
+
+    # Level 9 compresses no better than level 6 so isn't worth the time.
+    assert policy.choose("metric_data", 1024) == 6
+
+    # Payloads for other collector methods are judged separately.
+    assert policy.choose("span_event_data", 1024) == 9
+
+
+def test_expected_size():
+    policy = AdaptiveCompression()
+
+    assert policy.expected_size("metric_data") is None
+    assert policy.expected_size("metric_data", 100) == 100
+    policy.record("metric_data", 6, 1000, 100, 0.01)
+    assert policy.expected_size("metric_data", 100) == 1000
+
+
+@pytest.mark.parametrize("level,expected", ((None, 6), (-1, 6), (1, 1), (2, 1), (4, 3), (5, 6), (8, 9), (9, 9)))
+def test_nearest_level(level, expected):
+    assert nearest_level(level) == expected
+
+
+def test_record_level_outside_ladder():
+    policy = AdaptiveCompression()
+
+    # A level not picked between is ignored, other than for the payload size.
+    policy.record("metric_data", 4, 1000, 100, 0.01)
+
+    assert policy.expected_size("metric_data") == 1000
+    assert policy.choose("metric_data", 1024) == 9
+
+
+@pytest.mark.parametrize("method", ("gzip", "deflate"))
+def test_compressobj(method):
+    compressor = compressobj(method, 1)
+    data = compressor.compress(b"*" * 100) + compressor.flush()
+
+    assert zlib.decompress(data, 31 if method == "gzip" else 15) == b"*" * 100
+
+
+def test_zstd_only_when_available():
+    policy = AdaptiveCompression(method="gzip", zstd=True)
+    assert policy.method == ("zstd" if zstd_available() else "gzip")
+
+
+def test_zstd_default_rates():
+    # The zstd levels are much faster than the zlib levels of the same
+    # number, so larger payloads fit in the time budget at a higher level.
+
+    size = int(DEFAULT_RATES[9] * 2)
+
+    assert AdaptiveCompression(method="gzip").choose("span_event_data", size) < 9
+    assert AdaptiveCompression(method="zstd").choose("span_event_data", size) == 9
+    assert DEFAULT_ZSTD_RATES.keys() == DEFAULT_RATES.keys()
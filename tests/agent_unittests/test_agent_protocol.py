@@ -33,6 +33,7 @@ from newrelic.network.exceptions import (
     ForceAgentDisconnect,
     ForceAgentRestart,
     NetworkInterfaceException,
+    PayloadTooLarge,
     RetryDataForRequest,
 )
 
@@ -222,7 +223,7 @@ def test_send(status_code):
         (409, ForceAgentRestart, "INFO"),
         (410, ForceAgentDisconnect, "CRITICAL"),
         (411, DiscardDataForRequest, "WARNING"),
-        (413, DiscardDataForRequest, "WARNING"),
+        (413, PayloadTooLarge, "INFO"),
         (414, DiscardDataForRequest, "WARNING"),
         (415, DiscardDataForRequest, "WARNING"),
         (417, DiscardDataForRequest, "WARNING"),
@@ -0,0 +1,138 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.common.agent_http import AggregatorModeClient, DeveloperModeClient
+from newrelic.common.encoding_utils import json_decode
+from newrelic.common.object_wrapper import transient_function_wrapper
+from newrelic.core.aggregator import AggregatorServer
+from newrelic.core.application import Application
+from newrelic.core.config import global_settings
+from newrelic.core.data_collector import AggregatorModeSession
+from newrelic.network.exceptions import NetworkInterfaceException
+
+settings = global_settings()
+
+
+@pytest.fixture
+def socket_path():
+    # The path of a Unix domain socket is limited in length, so is kept
+    # short rather than placed under the pytest temporary directory.
+
+    directory = tempfile.mkdtemp()
+    yield os.path.join(directory, "aggregator.sock")
+    os.rmdir(directory)
+
+
+@pytest.fixture
+def aggregator(socket_path):
+    @override_generic_settings(settings, {"developer_mode": True, "aggregator.socket_path": socket_path})
+    def _aggregator():
+        server = AggregatorServer(socket_path)
+        server.start()
+        return server
+
+    server = _aggregator()
+    yield server
+    server.shutdown()
+
+
+def collector_requests(requests):
+    # The aggregator uses the stand-in collector of developer mode, so all
+    # requests made to it are those made by the aggregator.
+
+    @transient_function_wrapper("newrelic.common.agent_http", "DeveloperModeClient.send_request")
+    def _collector_requests(wrapped, instance, args, kwargs):
+        def _bind_params(method="POST", path=None, params=None, headers=None, payload=None):
+            return params, payload
+
+        params, payload = _bind_params(*args, **kwargs)
+        requests.append((params["method"], payload and json_decode(payload.decode("utf-8"))))
+
+        return wrapped(*args, **kwargs)
+
+    return _collector_requests
+
+
+def test_agents_report_through_aggregator(aggregator):
+    requests = []
+
+    @collector_requests(requests)
+    @override_generic_settings(
+        settings,
+        {
+            "developer_mode": True,
+            "aggregator.enabled": True,
+            "aggregator.socket_path": aggregator.socket_path,
+        },
+    )
+    def _test():
+        apps = [Application("Python Agent Test (Aggregator)") for _ in range(2)]
+
+        for app in apps:
+            app.connect_to_data_collector(None)
+
+            assert isinstance(app._active_session, AggregatorModeSession)
+            assert app._active_session.agent_run_id == DeveloperModeClient.RESPONSES["connect"]["agent_run_id"]
+
+            app._stats_engine.record_custom_metric("CustomMetric/Int", 1)
+            app._stats_engine.transaction_events.add("transaction event")
+
+            app.harvest(flexible=True)
+            app.harvest()
+
+        # Nothing is sent to the collector until the aggregator harvests,
+        # other than for the single connect.
+
+        assert [method for method, _ in requests if method not in ("preconnect", "agent_settings")] == ["connect"]
+
+        aggregator.harvest()
+
+        methods = [method for method, _ in requests]
+        assert methods.count("connect") == 1
+        assert methods.count("metric_data") == 1
+        assert methods.count("analytic_event_data") == 1
+
+        payloads = dict(requests)
+
+        metrics = {spec["name"]: stats for spec, stats in payloads["metric_data"][3] if not spec.get("scope")}
+        assert metrics["CustomMetric/Int"][0] == 2
+        assert metrics["Supportability/Python/Aggregator/Harvests"][0] == 2
+
+        run_id, sampling_info, samples = payloads["analytic_event_data"]
+        assert run_id == DeveloperModeClient.RESPONSES["connect"]["agent_run_id"]
+        assert sampling_info["events_seen"] == 2
+        assert samples == ["transaction event", "transaction event"]
+
+    _test()
+
+
+def test_unknown_run_id(aggregator):
+    assert aggregator.dispatch({"method": "metric_data", "run_id": 1}, b"[1, 0, 0, []]") == (409, None)
+
+
+def test_unknown_method(aggregator):
+    assert aggregator.dispatch({"method": "unknown", "run_id": 1}, b"[]") == (400, None)
+
+
+def test_aggregator_not_running(socket_path):
+    client = AggregatorModeClient(socket_path, None, timeout=1.0)
+
+    with pytest.raises(NetworkInterfaceException):
+        client.send_request(params={"method": "preconnect"}, payload=b"[]")
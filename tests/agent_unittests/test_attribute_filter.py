@@ -0,0 +1,66 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.attribute_filter import (
+    DST_ALL,
+    DST_ERROR_COLLECTOR,
+    DST_NONE,
+    DST_SPAN_EVENTS,
+    DST_TRANSACTION_EVENTS,
+    AttributeFilter,
+)
+
+_settings = {
+    "attributes.enabled": True,
+    "transaction_events.attributes.enabled": True,
+    "span_events.attributes.enabled": True,
+    "error_collector.attributes.enabled": True,
+    "attributes.exclude": ["request.*", "secret"],
+    "attributes.include": ["request.headers.*", "*"],
+    "span_events.attributes.exclude": ["request.headers.cookie"],
+    "error_collector.attributes.exclude": ["*"],
+    "error_collector.attributes.include": ["error.*"],
+}
+
+_enabled = DST_TRANSACTION_EVENTS | DST_SPAN_EVENTS | DST_ERROR_COLLECTOR
+
+
+@pytest.mark.parametrize(
+    "name,expected",
+    [
+        ("user", DST_TRANSACTION_EVENTS | DST_SPAN_EVENTS),
+        ("secret", DST_NONE),
+        ("secrets", DST_TRANSACTION_EVENTS | DST_SPAN_EVENTS),
+        ("request.method", DST_NONE),
+        ("request.headers.host", _enabled),
+        ("request.headers.cookie", DST_TRANSACTION_EVENTS | DST_ERROR_COLLECTOR),
+        ("error.message", _enabled),
+        ("", DST_TRANSACTION_EVENTS | DST_SPAN_EVENTS),
+    ],
+)
+def test_apply_most_specific_rule_wins(name, expected):
+    attribute_filter = AttributeFilter(_settings)
+    assert attribute_filter.apply(name, DST_ALL) == expected
+
+
+def test_cache_bounded():
+    attribute_filter = AttributeFilter(dict(_settings, **{"attributes.filter_cache_size": 100}))
+
+    for i in range(1000):
+        attribute_filter.apply(f"custom.{i}", DST_ALL)
+        assert len(attribute_filter.cache) <= 100
+
+    assert attribute_filter.apply("custom.999", DST_ALL) == DST_TRANSACTION_EVENTS | DST_SPAN_EVENTS
@@ -14,7 +14,15 @@
 
 import pytest
 
-from newrelic.common.encoding_utils import camel_case, snake_case
+from newrelic.common.encoding_utils import (
+    JSON_BACKENDS,
+    camel_case,
+    json_backend,
+    json_decode,
+    json_encode,
+    json_encode_chunks,
+    snake_case,
+)
 
 
 @pytest.mark.parametrize("input_,expected,upper", [
@@ -50,3 +58,60 @@ def test_camel_case(input_, expected, upper):
 def test_snake_case(input_, expected):
     output = snake_case(input_)
     assert output == expected
+
+
+def _payload():
+    return (
+        "RUN_TOKEN",
+        {"reservoir_size": 10, "events_seen": 3},
+        ([{"name": f"event{i}"}, {"bytes": b"caf\xe9"}, (i, i * 0.5, None)] for i in range(3)),
+        [],
+        (),
+    )
+
+
+@pytest.mark.parametrize("chunk_size", [1, 16, 64 * 1024])
+@pytest.mark.parametrize("max_depth", [0, 1, 2, 3])
+def test_json_encode_chunks(chunk_size, max_depth):
+    chunks = list(json_encode_chunks(_payload(), chunk_size=chunk_size, max_depth=max_depth))
+
+    assert all(isinstance(chunk, bytes) for chunk in chunks)
+    assert b"".join(chunks) == json_encode(_payload()).encode("utf-8")
+
+    if chunk_size == 64 * 1024:
+        assert len(chunks) == 1
+
+
+def test_json_encode_chunks_separators():
+    chunks = json_encode_chunks(_payload(), separators=(", ", ": "))
+    assert b"".join(chunks) == json_encode(_payload(), separators=(", ", ": ")).encode("utf-8")
+
+
+@pytest.mark.parametrize("backend", list(JSON_BACKENDS))
+@pytest.mark.parametrize("large_int", [False, True])
+def test_json_backend_encode(backend, large_int):
+    payload = _payload()
+
+    if large_int:
+        # Integers orjson cannot encode force the fallback to the json
+        # module after generators in the payload have been consumed.
+        payload += (2**70,)
+
+    expected = json_decode(json_encode(_payload() + ((2**70,) if large_int else ())))
+
+    encoded = JSON_BACKENDS[backend].encode(payload)
+
+    assert isinstance(encoded, bytes)
+    assert json_decode(encoded) == expected
+
+
+@pytest.mark.parametrize("backend", list(JSON_BACKENDS))
+def test_json_encode_chunks_backend(backend):
+    chunks = json_encode_chunks(_payload(), chunk_size=16, backend=JSON_BACKENDS[backend])
+    assert json_decode(b"".join(chunks)) == json_decode(json_encode(_payload()))
+
+
+def test_json_backend_selection():
+    assert json_backend("json").name == "json"
+    assert json_backend("auto") is next(iter(JSON_BACKENDS.values()))
+    assert json_backend("unknown") is next(iter(JSON_BACKENDS.values()))
@@ -0,0 +1,147 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sqlite3
+import threading
+
+import pytest
+
+from newrelic.core import database_utils
+from newrelic.core.database_utils import ExplainPlanPool, SQLStatement, explain_plan
+
+CONNECT_PARAMS = ((":memory:",), {})
+
+
+class SQLiteDBAPI2Module():
+    _nr_database_product = "SQLite"
+    _nr_explain_query = "EXPLAIN QUERY PLAN"
+    _nr_explain_stmts = ("select",)
+
+    NotSupportedError = sqlite3.NotSupportedError
+
+    def __init__(self):
+        self.__name__ = "sqlite3_explain"
+        self.connect_threads = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def connect(self, *args, **kwargs):
+        self.connect_threads.append(threading.current_thread())
+        self.release.wait(5.0)
+        return sqlite3.connect(*args, check_same_thread=True, **kwargs)
+
+
+@pytest.fixture
+def dbapi2_module():
+    return SQLiteDBAPI2Module()
+
+
+@pytest.fixture
+def explain_calls(monkeypatch):
+    calls = []
+    original = database_utils._explain_plan
+
+    def _explain_plan(*args, **kwargs):
+        calls.append(threading.current_thread())
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(database_utils, "_explain_plan", _explain_plan)
+    return calls
+
+
+@pytest.fixture
+def pool():
+    pool = ExplainPlanPool(harvest_timeout=5.0)
+    yield pool
+    pool.shutdown()
+
+
+def _explain(connections, sql, dbapi2_module):
+    statement = SQLStatement(sql, database_utils.SQLDatabase(dbapi2_module))
+    return explain_plan(connections, statement, CONNECT_PARAMS, None, None, None, "obfuscated")
+
+
+def test_explain_plan_in_background(pool, dbapi2_module, explain_calls):
+    with pool:
+        details = _explain(pool, "SELECT 1", dbapi2_module)
+
+    columns, rows = details
+    assert columns and rows
+
+    assert len(explain_calls) == 1
+    assert explain_calls[0] is not threading.current_thread()
+    assert dbapi2_module.connect_threads == explain_calls
+
+
+def test_explain_plan_cached_by_fingerprint(pool, dbapi2_module, explain_calls):
+    sql = "SELECT * FROM (SELECT 1 AS a, 2 AS b) WHERE (a, b) IN (VALUES %s)"
+
+    with pool:
+        details = _explain(pool, sql % "(1, 2)", dbapi2_module)
+
+    with pool:
+        cached_details = _explain(pool, sql % "(1, 2), (3, 4)", dbapi2_module)
+
+    assert details is not None
+    assert cached_details == details
+    assert len(explain_calls) == 1
+
+
+def test_explain_plan_cache_expires(dbapi2_module, explain_calls):
+    pool = ExplainPlanPool(cache_ttl=0.0)
+
+    try:
+        with pool:
+            assert _explain(pool, "SELECT 1", dbapi2_module) is not None
+            assert _explain(pool, "SELECT 1", dbapi2_module) is not None
+    finally:
+        pool.shutdown()
+
+    assert len(explain_calls) == 2
+
+
+def test_connections_persist_across_harvests(pool, dbapi2_module):
+    with pool:
+        _explain(pool, "SELECT 1", dbapi2_module)
+
+    with pool:
+        _explain(pool, "SELECT 2", dbapi2_module)
+
+    assert len(dbapi2_module.connect_threads) == 1
+    assert len(pool.connections) == 1
+
+    pool.shutdown()
+    pool._thread.join(5.0)
+
+    assert not pool.connections
+
+
+def test_harvest_timeout(dbapi2_module, explain_calls):
+    pool = ExplainPlanPool(harvest_timeout=0.05)
+    dbapi2_module.release.clear()
+
+    try:
+        # The explain plan does not complete within the time allowed for
+        # the harvest, so is not available until a later harvest.
+
+        with pool:
+            assert _explain(pool, "SELECT 1", dbapi2_module) is None
+            assert _explain(pool, "SELECT 2", dbapi2_module) is None
+
+        dbapi2_module.release.set()
+
+        with pool:
+            assert _explain(pool, "SELECT 1", dbapi2_module) is not None
+    finally:
+        pool.shutdown()
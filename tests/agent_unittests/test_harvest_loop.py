@@ -12,8 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import random
 import tempfile
+import threading
 import time
 
 import pytest
@@ -483,6 +485,134 @@ def test_transaction_count(transaction_node):
     assert app._transaction_count == 0
 
 
+@validate_metric_payload(
+    metrics=[
+        ("Supportability/Python/TransactionRecorder/Queued", 1),
+        ("Supportability/Python/TransactionRecorder/Dropped", 1),
+        ("Supportability/Python/RequestSampler/requests", 1),
+    ]
+)
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+        "collect_custom_events": False,
+        "application_logging.forwarding.enabled": False,
+        "transaction_recorder.enabled": True,
+        "transaction_recorder.queue_size": 1,
+        "transaction_recorder.overflow_policy": "drop",
+    },
+)
+def test_transaction_recorder(transaction_node):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    recorder = app._transaction_recorder
+    assert recorder is not None
+
+    # Hold up the worker thread so that the queue is full when the second
+    # transaction is recorded and it is dropped.
+
+    event = threading.Event()
+    record = recorder._record
+
+    def _record(data):
+        event.wait(5.0)
+        record(data)
+
+    recorder._record = _record
+
+    app.record_transaction(transaction_node)
+    app.record_transaction(transaction_node)
+
+    event.set()
+
+    # Harvest waits for the queued transaction to be recorded.
+    app.harvest()
+
+    assert app._transaction_count == 0
+
+    app.internal_agent_shutdown(restart=False)
+    assert app._transaction_recorder is None
+
+
+def validate_events_seen(events_seen):
+    def validator(payload):
+        assert payload[1]["events_seen"] == events_seen
+
+    return validator
+
+
+@validate_transaction_event_payloads([validate_events_seen(8)])
+@validate_metric_payload(metrics=[("Custom/test_stats_engine_shards", 8)])
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+        "collect_custom_events": False,
+        "application_logging.forwarding.enabled": False,
+        "stats_engine.shards": 4,
+    },
+)
+def test_stats_engine_shards(transaction_node):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    assert len(app._stats_shards) == 4
+
+    def record():
+        app.record_transaction(transaction_node)
+        app.record_custom_metric("Custom/test_stats_engine_shards", 1)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Nothing is merged into the main stats engine until harvest.
+    assert app._transaction_count == 0
+    assert not app._stats_engine.transaction_events.num_seen
+    assert sum(shard.transaction_count for shard in app._stats_shards) == 8
+
+    app.harvest()
+
+    for shard in app._stats_shards:
+        assert shard.transaction_count == 0
+        assert not shard.stats.stats_table
+
+
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+    },
+)
+def test_workarea_preserves_dimensional_metrics():
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    app.record_dimensional_metric("Dimensional/test_workarea", 1, {"tag": "value"})
+
+    # Creating a workarea to record a transaction into must not discard
+    # the dimensional metrics held by the main stats engine.
+    workarea = app._stats_engine.create_workarea()
+    workarea.record_dimensional_metric("Dimensional/test_workarea", 1, {"tag": "value"})
+    app._stats_engine.merge(workarea)
+
+    ((name, tagged_stats),) = app._stats_engine.dimensional_metric_data()
+    assert name == "Dimensional/test_workarea"
+
+    ((_, stats),) = tagged_stats.items()
+    assert stats.call_count == 2
+
+
 @override_generic_settings(
     settings,
     {
@@ -551,6 +681,45 @@ def test_reservoir_sizes(transaction_node):
     assert app._stats_engine.span_events.num_samples == 102
 
 
+@pytest.mark.parametrize("span_priority,span_events_generated", ((2.0, False), (0.5, True)))
+@override_generic_settings(
+    settings,
+    {
+        "developer_mode": True,
+        "license_key": "**NOT A LICENSE KEY**",
+        "feature_flag": set(),
+        "distributed_tracing.enabled": True,
+        "event_harvest_config.harvest_limits.span_event_data": 10,
+    },
+)
+def test_span_events_not_generated_when_not_sampled(
+    transaction_node, monkeypatch, span_priority, span_events_generated
+):
+    app = Application("Python Agent Test (Harvest Loop)")
+    app.connect_to_data_collector(None)
+
+    # Fill the reservoir with span events of a higher or lower priority
+    # than the transaction.
+    for _ in range(10):
+        app._stats_engine.span_events.add("span event", priority=span_priority)
+
+    generated = []
+    original_span_events = transaction_node.span_events
+
+    def span_events(*args, **kwargs):
+        generated.append(True)
+        return original_span_events(*args, **kwargs)
+
+    monkeypatch.setattr(transaction_node, "span_events", span_events)
+
+    app.record_transaction(transaction_node)
+
+    assert bool(generated) == span_events_generated
+
+    # Add 1 for the root span
+    assert app._stats_engine.span_events.num_seen == 10 + 102
+
+
 @pytest.mark.parametrize(
     "harvest_name, event_name",
     [
@@ -805,6 +974,68 @@ def test_reset_synthetics_events():
     assert app._stats_engine.transaction_events.num_seen == 1
 
 
+@pytest.mark.parametrize("parallel_harvest_enabled", (True, False))
+def test_parallel_harvest_rollback(parallel_harvest_enabled):
+    @failing_endpoint("analytic_event_data")
+    @override_generic_settings(
+        settings,
+        {
+            "developer_mode": True,
+            "parallel_harvest.enabled": parallel_harvest_enabled,
+        },
+    )
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.transaction_events.add("transaction event")
+        app._stats_engine.custom_events.add("custom event")
+
+        app.harvest()
+
+        # The failed transaction events are always rolled back. The custom
+        # events are only sent after them when the uploads are sequential,
+        # but are sent concurrently and so not rolled back otherwise.
+
+        assert app._stats_engine.transaction_events.num_seen == 1
+        assert app._stats_engine.custom_events.num_seen == (0 if parallel_harvest_enabled else 1)
+
+    _test()
+
+
+def test_spool_failed_harvest(tmp_path):
+    @failing_endpoint("analytic_event_data")
+    @override_generic_settings(
+        settings,
+        {
+            "developer_mode": True,
+            "spool.enabled": True,
+            "spool.directory": str(tmp_path),
+        },
+    )
+    def _test():
+        app = Application("Python Agent Test (Harvest Loop)")
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.transaction_events.add("transaction event")
+
+        app.harvest()
+
+        # The failed transaction events are written to the spool rather
+        # than being rolled back, and are sent by the following harvest.
+
+        assert app._stats_engine.transaction_events.num_seen == 0
+
+        spool_directory = app._harvest_spool.directory
+        assert os.listdir(spool_directory)
+
+        app.harvest()
+
+        assert not os.listdir(spool_directory)
+
+    _test()
+
+
 @pytest.mark.parametrize(
     "allowlist_event",
     ("analytic_event_data", "custom_event_data", "log_event_data", "error_event_data", "span_event_data"),
@@ -0,0 +1,153 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+
+import pytest
+
+from newrelic.core.harvest_spool import HarvestSpool
+from newrelic.network.exceptions import DiscardDataForRequest, PayloadTooLarge
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return HarvestSpool(str(tmp_path / "spool"), max_bytes=1024 * 1024, max_age=60.0, segment_bytes=1024)
+
+
+def drain(spool):
+    sent = []
+    spool.drain(lambda method, payload: sent.append((method, payload)))
+    return sent
+
+
+def test_write_and_drain(spool):
+    assert spool.write("metric_data", [1, 2.0, 3.0, [["metric", [1, 2]]]])
+    assert spool.write("error_data", [1, []])
+
+    assert drain(spool) == [
+        ("metric_data", [1, 2.0, 3.0, [["metric", [1, 2]]]]),
+        ("error_data", [1, []]),
+    ]
+
+    # Drained data is removed from the spool.
+
+    assert drain(spool) == []
+    assert spool.stats() == (2, 2, 0)
+
+
+def test_drain_missing_directory(spool):
+    assert drain(spool) == []
+
+
+def test_segments_are_rotated(spool):
+    for i in range(20):
+        assert spool.write("span_event_data", [i, "x" * 100])
+
+    assert len(os.listdir(spool.directory)) > 1
+    assert [payload[0] for _, payload in drain(spool)] == list(range(20))
+
+
+def test_max_bytes(tmp_path):
+    spool = HarvestSpool(str(tmp_path), max_bytes=2048, max_age=60.0, segment_bytes=512)
+
+    for i in range(50):
+        assert spool.write("span_event_data", [i, os.urandom(64).hex()])
+
+    sent = [payload[0] for _, payload in drain(spool)]
+
+    # The oldest segments are discarded so only the most recent data is
+    # sent.
+
+    assert sent
+    assert sent[-1] == 49
+    assert sent == list(range(sent[0], 50))
+    assert sent[0] > 0
+    assert spool.stats()[2] > 0
+
+
+def test_max_age(tmp_path):
+    spool = HarvestSpool(str(tmp_path), max_age=0.0)
+
+    assert spool.write("error_data", [1, []])
+    time.sleep(0.01)
+
+    assert drain(spool) == []
+    assert spool.stats() == (1, 0, 1)
+
+
+def test_failed_send_keeps_remaining(spool):
+    for i in range(5):
+        spool.write("error_data", [i, []])
+
+    sent = []
+
+    def send(method, payload):
+        if payload[0] == 3:
+            raise ValueError
+        sent.append(payload[0])
+
+    with pytest.raises(ValueError):
+        spool.drain(send)
+
+    assert sent == [0, 1, 2]
+    assert [payload[0] for _, payload in drain(spool)] == [3, 4]
+
+
+@pytest.mark.parametrize("exception", (DiscardDataForRequest, PayloadTooLarge))
+def test_discarded_send_dropped(spool, exception):
+    for i in range(5):
+        spool.write("error_data", [i, []])
+    spool.write("metric_data", [5, 0.0, 0.0, []])
+
+    sent = []
+
+    def send(method, payload):
+        if payload[0] == 1:
+            raise exception
+        sent.append(payload[0])
+
+    assert spool.drain(send) == 5
+
+    assert sent == [0, 2, 3, 4, 5]
+    assert drain(spool) == []
+    assert spool.stats() == (6, 5, 1)
+
+
+def test_truncated_record(spool):
+    spool.write("error_data", [1, []])
+    spool.write("error_data", [2, []])
+    spool.close()
+
+    (name,) = os.listdir(spool.directory)
+    path = os.path.join(spool.directory, name)
+
+    with open(path, "rb+") as fp:
+        fp.truncate(os.path.getsize(path) - 1)
+
+    assert drain(spool) == [("error_data", [1, []])]
+
+
+def test_abandoned_segment(spool):
+    spool.write("error_data", [1, []])
+
+    # Make the open segment look as if it belongs to a process which no
+    # longer exists.
+
+    (name,) = os.listdir(spool.directory)
+    timestamp, _, sequence = name.split("-")
+    os.rename(os.path.join(spool.directory, name), os.path.join(spool.directory, f"{timestamp}-999999999-{sequence}"))
+    spool._segment = None
+
+    assert drain(spool) == [("error_data", [1, []])]
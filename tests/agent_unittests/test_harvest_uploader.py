@@ -0,0 +1,91 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.harvest_uploader import HarvestUploader
+from newrelic.core.internal_metrics import internal_metric
+from newrelic.core.stats_engine import CustomMetrics
+from newrelic.network.exceptions import DiscardDataForRequest, RetryDataForRequest
+
+
+def _raise(exc):
+    raise exc()
+
+
+def test_uploads_made_immediately_with_single_worker():
+    sent = []
+
+    with HarvestUploader(CustomMetrics()) as uploader:
+        uploader.upload(sent.append, 1, on_success=lambda: sent.append("sent"))
+        assert sent == [1, "sent"]
+
+        with pytest.raises(RetryDataForRequest):
+            uploader.upload(_raise, RetryDataForRequest)
+
+
+def test_uploads_made_concurrently():
+    barrier = threading.Barrier(3, timeout=5.0)
+    threads = []
+
+    def send(name):
+        threads.append(threading.current_thread())
+        barrier.wait()
+        internal_metric(f"Supportability/Test/{name}", 1)
+
+    internal_metrics = CustomMetrics()
+
+    with HarvestUploader(internal_metrics, max_workers=3) as uploader:
+        for name in ("a", "b", "c"):
+            uploader.upload(send, name)
+
+    assert threading.current_thread() not in threads
+    assert len(set(threads)) == 3
+    assert sorted(name for name, _ in internal_metrics.metrics()) == [
+        "Supportability/Test/a",
+        "Supportability/Test/b",
+        "Supportability/Test/c",
+    ]
+
+
+def test_first_failure_raised_after_all_uploads():
+    succeeded = []
+
+    uploader = HarvestUploader(CustomMetrics(), max_workers=2)
+
+    uploader.upload(lambda: None, on_success=lambda: succeeded.append(1))
+    uploader.upload(_raise, DiscardDataForRequest, on_success=lambda: succeeded.append(2))
+    uploader.upload(_raise, RetryDataForRequest, on_success=lambda: succeeded.append(3))
+    uploader.upload(lambda: None, on_success=lambda: succeeded.append(4))
+
+    with pytest.raises(DiscardDataForRequest):
+        uploader.wait()
+
+    # The callbacks are made in order for all uploads which succeeded.
+
+    assert succeeded == [1, 4]
+
+
+def test_callbacks_made_on_exception():
+    succeeded = []
+
+    with pytest.raises(ValueError):
+        with HarvestUploader(CustomMetrics(), max_workers=2) as uploader:
+            uploader.upload(lambda: None, on_success=lambda: succeeded.append(1))
+            uploader.upload(_raise, RetryDataForRequest)
+            raise ValueError()
+
+    assert succeeded == [1]
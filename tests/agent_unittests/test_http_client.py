@@ -25,12 +25,15 @@ from testing_support.certs import CERT_PATH
 from testing_support.mock_external_http_server import MockExternalHTTPServer
 
 from newrelic.common import certs
+from newrelic.common.adaptive_compression import AdaptiveCompression
 from newrelic.common.agent_http import (
     ApplicationModeClient,
     DeveloperModeClient,
+    Http2ConnectionPool,
     HttpClient,
     InsecureHttpClient,
     ServerlessModeClient,
+    close_shared_connection_pools,
 )
 from newrelic.common.encoding_utils import ensure_str
 from newrelic.common.object_names import callable_name
@@ -251,6 +254,52 @@ def test_http_close_connection(server):
     client.close_connection()
 
 
+def test_shared_connections(server):
+    clients = [
+        HttpClient("localhost", server.port, disable_certificate_validation=True, shared_connections=True)
+        for _ in range(2)
+    ]
+
+    try:
+        connections = []
+        for client in clients:
+            with client:
+                status, _ = client.send_request()
+                assert status == 200
+                connections.append(client._connection_attr)
+
+            assert client._connection_attr is None
+
+        # The connection pool is shared and left open for reuse.
+        assert connections[0] is connections[1]
+        assert connections[0].pool is not None
+
+        status, _ = clients[0].send_request()
+        assert status == 200
+        assert clients[0]._connection_attr is connections[0]
+    finally:
+        close_shared_connection_pools()
+
+    assert connections[0].pool is None
+
+
+def test_http2_falls_back_when_not_installed(monkeypatch):
+    monkeypatch.setattr(Http2ConnectionPool, "available", staticmethod(lambda: False))
+
+    client = HttpClient("localhost", 1000, http2=True)
+    assert client.CONNECTION_CLS is not Http2ConnectionPool
+
+
+def test_http2_not_used_via_proxy(monkeypatch):
+    monkeypatch.setattr(Http2ConnectionPool, "available", staticmethod(lambda: True))
+
+    client = HttpClient("localhost", 1000, proxy_scheme="http", proxy_host="localhost", proxy_port=8080, http2=True)
+    assert client.CONNECTION_CLS is not Http2ConnectionPool
+
+    client = HttpClient("localhost", 1000, http2=True)
+    assert client.CONNECTION_CLS is Http2ConnectionPool
+
+
 def test_http_close_connection_in_context_manager():
     client = HttpClient("localhost", 1000)
     with client:
@@ -268,9 +317,16 @@ def test_http_close_connection_in_context_manager():
         (ApplicationModeClient, "deflate", 100),
     ),
 )
-def test_http_payload_compression(server, client_cls, method, threshold):
+@pytest.mark.parametrize("chunked", (False, True))
+def test_http_payload_compression(server, client_cls, method, threshold, chunked):
     payload = b"*" * 20
 
+    def request_payload():
+        # A chunked payload is consumed as it is compressed.
+        if chunked:
+            return iter((payload[:7], payload[7:]))
+        return payload
+
     internal_metrics = CustomMetrics()
 
     with client_cls(
@@ -281,7 +337,7 @@ def test_http_payload_compression(server, client_cls, method, threshold):
         compression_threshold=threshold,
     ) as client:
         with InternalTraceContext(internal_metrics):
-            status, data = client.send_request(payload=payload, params={"method": "method1"})
+            status, data = client.send_request(payload=request_payload(), params={"method": "method1"})
 
     # Sending one additional request to valid metric aggregation for top level data usage supportability metrics
     with client_cls(
@@ -292,7 +348,7 @@ def test_http_payload_compression(server, client_cls, method, threshold):
         compression_threshold=threshold,
     ) as client:
         with InternalTraceContext(internal_metrics):
-            status, data = client.send_request(payload=payload, params={"method": "method2"})
+            status, data = client.send_request(payload=request_payload(), params={"method": "method2"})
 
     assert status == 200
     data = data.split(b"\n")
@@ -349,6 +405,43 @@ def test_http_payload_compression(server, client_cls, method, threshold):
     assert sent_payload == payload
 
 
+@pytest.mark.parametrize("chunked,compression_level,expected_level", ((False, None, 9), (True, None, 6), (True, 1, 1), (True, 4, 3)))
+def test_adaptive_payload_compression(server, chunked, compression_level, expected_level):
+    payload = b"*" * 20
+
+    def request_payload():
+        if chunked:
+            return iter((payload[:7], payload[7:]))
+        return payload
+
+    internal_metrics = CustomMetrics()
+    policy = AdaptiveCompression(method="deflate")
+
+    with ApplicationModeClient(
+        "localhost",
+        server.port,
+        disable_certificate_validation=True,
+        compression_threshold=0,
+        compression_level=compression_level,
+        adaptive_compression=policy,
+    ) as client:
+        with InternalTraceContext(internal_metrics):
+            status, data = client.send_request(payload=request_payload(), params={"method": "method1"})
+
+    assert status == 200
+    data = data.split(b"\n")
+    assert zlib.decompress(data[-1]) == payload
+    assert b"content-encoding: deflate" in data[1:-1]
+
+    internal_metrics = dict(internal_metrics.metrics())
+    # Where the payload is compressed as it is produced, nothing is known
+    # about its size for the first payload so the configured level is used.
+
+    assert internal_metrics[f"Supportability/Python/Collector/Compression/deflate/Level/{expected_level}"][0] == 1
+    assert internal_metrics["Supportability/Python/Collector/Compression/Ratio"][0] == 1
+    assert policy.expected_size("method1", 0) == len(payload)
+
+
 def test_cert_path(server):
     with HttpClient("localhost", server.port, ca_bundle_path=CERT_PATH) as client:
         status, data = client.send_request()
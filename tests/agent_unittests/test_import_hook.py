@@ -70,3 +70,56 @@ def test_module_function_globbing(input, expected):
     
     result = set(_module_function_glob(module, input))
     assert result == expected, (result, expected)
+
+
+def test_builtin_import_hooks_table():
+    from newrelic.config import BUILTIN_IMPORT_HOOKS
+
+    for entry in BUILTIN_IMPORT_HOOKS:
+        target, module, function = entry
+        assert module.startswith("newrelic.hooks.")
+        assert isinstance(function, str)
+
+
+def test_builtin_import_hook_disabled_on_import(monkeypatch):
+    import configparser
+
+    import newrelic.config as config
+
+    target = "_test_import_hook"
+    key = (target, "newrelic.hooks.does_not_exist", "instrument")
+
+    config_object = configparser.RawConfigParser()
+    config_object.add_section(f"import-hook:{target}")
+    config_object.set(f"import-hook:{target}", "enabled", "false")
+
+    monkeypatch.setattr(config, "_config_object", config_object)
+    monkeypatch.setitem(config._module_import_hook_registry, target, key[1:])
+    monkeypatch.setitem(config._module_import_hook_results, key, None)
+
+    # The hook module does not exist so this would fail to instrument if
+    # the configuration were not honoured when the module is imported.
+    config._builtin_module_import_hook(target, None)
+
+    assert target not in config._module_import_hook_registry
+    assert key not in config._module_import_hook_results
+
+
+def test_builtin_import_hook_configuration_error(monkeypatch):
+    import configparser
+
+    import newrelic.config as config
+    from newrelic.api.exceptions import ConfigurationError
+
+    config_object = configparser.RawConfigParser()
+    config_object.add_section("import-hook:_test_import_hook")
+    config_object.set("import-hook:_test_import_hook", "enabled", "maybe")
+
+    monkeypatch.setattr(config, "_config_object", config_object)
+    monkeypatch.setattr(config, "_ignore_errors", False)
+
+    # The error is raised when the builtin import hooks are registered
+    # rather than when the target module is imported.
+
+    with pytest.raises(ConfigurationError):
+        config._process_module_builtin_defaults()
@@ -0,0 +1,136 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.core.config import global_settings
+from newrelic.core.metric import ApdexMetric, TimeMetric
+from newrelic.core.stats_engine import (
+    ApdexStats,
+    CountStats,
+    MetricTable,
+    StatsEngine,
+    TimeStats,
+)
+
+settings = global_settings()
+
+
+def _populate(table):
+    table[("Apdex/a", "")] = ApdexStats(1, 0, 0, 0.5)
+    table[("Function/a", "")] = TimeStats(1, 2.0, 1.0, 2.0, 2.0, 4.0)
+    table[("Custom/count", "")] = CountStats(call_count=3)
+    return table
+
+
+@pytest.mark.parametrize(
+    "key,other",
+    [
+        (("Apdex/a", ""), ApdexStats(0, 1, 2, 0.25)),
+        (("Function/a", ""), TimeStats(2, 1.0, 0.5, 0.25, 0.75, 0.625)),
+        (("Custom/count", ""), CountStats(call_count=4)),
+    ],
+)
+def test_merge_stats_matches_stats_objects(key, other):
+    expected = _populate({})
+    table = _populate(MetricTable())
+
+    expected[key].merge_stats(other)
+    table[key].merge_stats(other)
+
+    assert table[key] == expected[key]
+    assert dict(table.items()) == expected
+
+
+def test_merge_table_matches_stats_objects():
+    expected = _populate({})
+    for key, stats in _populate({}).items():
+        expected[key].merge_stats(stats)
+
+    table = _populate(MetricTable())
+    table.merge_table(_populate(MetricTable()))
+
+    assert len(table) == 3
+    assert dict(table.items()) == expected
+
+
+def test_row_view_merges():
+    table = MetricTable()
+    table[("Function/a", "")] = TimeStats()
+    table[("Apdex/a", "")] = ApdexStats(apdex_t=0.5)
+
+    table[("Function/a", "")].merge_time_metric(TimeMetric("Function/a", "", 2.0, 1.0))
+    table[("Function/a", "")].merge_custom_metric(1.0)
+    table[("Apdex/a", "")].merge_apdex_metric(ApdexMetric("Apdex/a", 1, 1, 0, 0.5))
+
+    stats = table[("Function/a", "")]
+    assert stats.call_count == 2
+    assert stats.total_call_time == 3.0
+    assert stats.total_exclusive_call_time == 2.0
+    assert stats.min_call_time == 1.0
+    assert stats.max_call_time == 2.0
+
+    apdex = table[("Apdex/a", "")]
+    assert (apdex.satisfying, apdex.tolerating, apdex.frustrating) == (1, 1, 0)
+
+
+def test_copy_of_row_is_standalone():
+    table = _populate(MetricTable())
+
+    stats = copy.copy(table[("Custom/count", "")])
+    stats.merge_stats(CountStats(call_count=1))
+
+    assert isinstance(stats, CountStats)
+    assert stats.call_count == 4
+    assert table[("Custom/count", "")].call_count == 3
+
+
+def test_metric_data_counts_are_integers():
+    table = _populate(MetricTable())
+
+    for key, values in table.metric_data():
+        assert isinstance(values[0], int), key
+
+
+@override_generic_settings(settings, {"stats_engine.columnar_metrics": True})
+def test_stats_engine_columnar_metric_data():
+    stats_engine = StatsEngine()
+    stats_engine.reset_stats(settings)
+
+    assert isinstance(stats_engine.stats_table, MetricTable)
+
+    # Workareas for single transactions use a plain dictionary.
+    workarea = stats_engine.create_workarea()
+    assert isinstance(workarea.stats_table, dict)
+
+    for _ in range(2):
+        workarea = stats_engine.create_workarea()
+        workarea.record_time_metric(TimeMetric("Function/a", "", 2.0, 1.0))
+        workarea.record_apdex_metric(ApdexMetric("Apdex/a", 1, 0, 0, 0.5))
+        workarea.record_custom_metric("Custom/a", {"count": 2})
+        stats_engine.merge(workarea)
+
+    metric_data = {(key["name"], key["scope"]): values for key, values in stats_engine.metric_data()}
+
+    assert metric_data == {
+        ("Function/a", ""): [2, 4.0, 2.0, 2.0, 2.0, 8.0],
+        ("Apdex/a", ""): [2, 0, 0, 0.5, 0.5, 0],
+        ("Custom/a", ""): [4, 0.0, 0.0, 0.0, 0.0, 0.0],
+    }
+
+    normalized = stats_engine.metric_data(normalizer=lambda name: ("Renamed/all", name.startswith("Apdex")))
+    assert normalized == [({"name": "Renamed/all", "scope": ""}, [6, 4.0, 2.0, 0.0, 2.0, 8.0])]
@@ -0,0 +1,185 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.common.object_wrapper import transient_function_wrapper
+from newrelic.core.application import Application
+from newrelic.core.config import global_settings
+from newrelic.core.otlp_utils import (
+    encode_span_event_data,
+    otlp_content_setting,
+    timeslice_to_dimensional_metrics,
+)
+from newrelic.core.stats_engine import CountStats, TimeStats
+from newrelic.network.exceptions import RetryDataForRequest
+
+if otlp_content_setting == "protobuf":
+    from google.protobuf.json_format import MessageToDict
+else:
+    MessageToDict = None
+
+settings = global_settings()
+
+
+def _message(payload):
+    if type(payload) is dict:
+        return payload
+    return MessageToDict(payload, use_integers_for_enums=True, preserving_proto_field_name=True)
+
+
+def test_timeslice_to_dimensional_metrics():
+    metric_data = [
+        ({"name": "Function/a", "scope": ""}, [2, 3.0, 1.0, 1.0, 2.0, 5.0]),
+        ({"name": "Function/a", "scope": "WebTransaction/Function/a"}, [1, 1.0, 1.0, 1.0, 1.0, 1.0]),
+        ({"name": "Supportability/count", "scope": ""}, [4, 0.0, 0.0, 0.0, 0.0, 0.0]),
+        ({"name": "Apdex/Function/a", "scope": ""}, [1, 0, 0, 0.5, 0.5, 0]),
+    ]
+
+    dimensional_metric_data, remaining_metric_data = timeslice_to_dimensional_metrics(metric_data)
+    dimensional_metric_data = dict(dimensional_metric_data)
+
+    assert dimensional_metric_data["Function/a"] == {
+        None: TimeStats(2, 3.0, 1.0, 1.0, 2.0, 5.0),
+        frozenset({("scope", "WebTransaction/Function/a")}): TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0),
+    }
+    assert type(dimensional_metric_data["Supportability/count"][None]) is CountStats
+    assert remaining_metric_data == [metric_data[3]]
+
+
+def test_encode_span_event_data():
+    span_event_data = [
+        (
+            {"type": "Span", "guid": "0123456789abcdef", "timestamp": 1700000000000, "parentId": None},
+            {"user": 1},
+            {"code.function": "span"},
+        )
+    ]
+
+    message = _message(encode_span_event_data(span_event_data, "RUN_ID"))
+    (log_record,) = message["resource_logs"][0]["scope_logs"][0]["log_records"]
+
+    assert int(log_record["time_unix_nano"]) == 1700000000000 * 1000000
+
+    attributes = {attribute["key"]: attribute["value"] for attribute in log_record["attributes"]}
+
+    assert attributes["guid"] == {"string_value": "0123456789abcdef"}
+    assert attributes["event.domain"] == {"string_value": "newrelic.span_events"}
+    assert attributes["code.function"] == {"string_value": "span"}
+    assert "user" in attributes
+    assert "parentId" not in attributes
+
+
+@pytest.mark.parametrize("otlp_enabled", [True, False])
+def test_harvest_data_sent_by_otlp(otlp_enabled):
+    otlp_methods = []
+    collector_methods = []
+
+    # The stand-in collector of developer mode doesn't accept OTLP requests
+    # so they are not passed on.
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "OtlpProtocol.send")
+    def _otlp_send(wrapped, instance, args, kwargs):
+        otlp_methods.append(args[0])
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "AgentProtocol.send")
+    def _collector_send(wrapped, instance, args, kwargs):
+        collector_methods.append(args[0])
+        return wrapped(*args, **kwargs)
+
+    @_otlp_send
+    @_collector_send
+    @override_generic_settings(
+        settings,
+        {
+            "developer_mode": True,
+            "distributed_tracing.enabled": True,
+            "otlp.metric_data": otlp_enabled,
+            "otlp.span_event_data": otlp_enabled,
+        },
+    )
+    def _test():
+        app = Application("Python Agent Test (OTLP harvest data)")
+        app.connect_to_data_collector(None)
+
+        app._stats_engine.record_custom_metric("CustomMetric/Int", 1)
+        app._stats_engine.span_events.add(
+            [{"type": "Span", "guid": "0123456789abcdef", "timestamp": 1700000000000}, {}, {}]
+        )
+
+        app.harvest()
+
+    _test()
+
+    if otlp_enabled:
+        assert "metric_data" in otlp_methods
+        assert "span_event_data" in otlp_methods
+        assert "span_event_data" not in collector_methods
+    else:
+        assert not otlp_methods
+        assert "metric_data" in collector_methods
+        assert "span_event_data" in collector_methods
+
+
+@pytest.mark.parametrize("failing_method", ["otlp", "collector"])
+def test_metric_data_not_sent_twice_on_retry(failing_method):
+    otlp_methods = []
+    collector_methods = []
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "OtlpProtocol.send")
+    def _otlp_send(wrapped, instance, args, kwargs):
+        if failing_method == "otlp":
+            raise RetryDataForRequest()
+        otlp_methods.append(args[0])
+
+    @transient_function_wrapper("newrelic.core.agent_protocol", "AgentProtocol.send")
+    def _collector_send(wrapped, instance, args, kwargs):
+        if args[0] == "metric_data" and failing_method == "collector":
+            raise RetryDataForRequest()
+        collector_methods.append(args[0])
+        return wrapped(*args, **kwargs)
+
+    @_otlp_send
+    @_collector_send
+    @override_generic_settings(settings, {"developer_mode": True, "otlp.metric_data": True})
+    def _test():
+        app = Application("Python Agent Test (OTLP harvest data)")
+        app.connect_to_data_collector(None)
+
+        # Apdex metrics can't be sent as OTLP metrics so are still sent
+        # to the data collector.
+
+        app._stats_engine.record_custom_metric("CustomMetric/Int", 1)
+        app._stats_engine.record_custom_metric("Apdex/Function/a", 1)
+
+        app.harvest()
+
+        return {key[0] for key in app._stats_engine.stats_table}
+
+    metric_names = _test()
+
+    assert "metric_data" not in collector_methods
+
+    if failing_method == "otlp":
+        # Nothing was sent so all the metrics are kept for the next harvest.
+
+        assert not otlp_methods
+        assert {"CustomMetric/Int", "Apdex/Function/a"} <= metric_names
+    else:
+        # The OTLP metrics were sent so the metrics are not kept to be sent
+        # again on the next harvest.
+
+        assert "metric_data" in otlp_methods
+        assert "CustomMetric/Int" not in metric_names
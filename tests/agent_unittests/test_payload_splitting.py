@@ -0,0 +1,252 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gzip
+import json
+import zlib
+
+import pytest
+from testing_support.mock_external_http_server import MockExternalHTTPServer
+
+from newrelic.common.agent_http import InsecureHttpClient
+from newrelic.core.agent_protocol import AgentProtocol
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.data_collector import Session, split_sample_set
+from newrelic.core.internal_metrics import InternalTraceContext
+from newrelic.core.stats_engine import CustomMetrics
+from newrelic.network.exceptions import (
+    DiscardDataForRequest,
+    PayloadTooLarge,
+    RetryDataForRequest,
+)
+
+# Maximum size of the uncompressed body accepted by the stand-in collector.
+
+COLLECTOR_MAX_BODY_SIZE = 2000
+
+
+def collector_handler(self):
+    method = self.path.split("method=", 1)[1].split("&", 1)[0]
+    body = self.rfile.read(int(self.headers["Content-Length"]))
+
+    encoding = self.headers.get("Content-Encoding")
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        body = zlib.decompress(body)
+
+    if len(body) > COLLECTOR_MAX_BODY_SIZE:
+        self.send_response(413)
+        self.end_headers()
+        return
+
+    # Payloads which fit can be failed with the status codes queued up by
+    # a test.
+
+    status = self.server.statuses.pop(0) if self.server.statuses else 200
+    if status != 200:
+        self.send_response(status)
+        self.end_headers()
+        return
+
+    self.server.requests.append((method, json.loads(body)))
+
+    self.send_response(200)
+    self.end_headers()
+    self.wfile.write(b'{"return_value": null}')
+
+
+class StandInCollector(MockExternalHTTPServer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, handler=collector_handler, **kwargs)
+        self.httpd.requests = []
+        self.httpd.statuses = []
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+
+class StandInProtocol(AgentProtocol):
+    @classmethod
+    def connect(cls, app_name, linked_applications, environment, settings, client_cls):
+        return cls(settings, client_cls=client_cls)
+
+
+class StandInSession(Session):
+    PROTOCOL = StandInProtocol
+    OTLP_PROTOCOL = StandInProtocol
+    CLIENT = InsecureHttpClient
+
+
+@pytest.fixture(scope="module")
+def collector():
+    with StandInCollector() as collector:
+        yield collector
+
+
+@pytest.fixture
+def session(collector):
+    del collector.requests[:]
+    del collector.httpd.statuses[:]
+
+    def _session(max_payload_size_in_bytes=1000000):
+        settings = finalize_application_settings(
+            {
+                "agent_run_id": "1234567",
+                "host": "localhost",
+                "port": collector.port,
+                "max_payload_size_in_bytes": max_payload_size_in_bytes,
+            }
+        )
+        return StandInSession("Python Agent Test", [], {}, settings)
+
+    return _session
+
+
+def events(count):
+    return [
+        [{"type": "Transaction", "name": f"WebTransaction/Function/event_{i}", "padding": "x" * 100}, {}, {}]
+        for i in range(count)
+    ]
+
+
+def test_split_sample_set_apportions_sampling_info():
+    sampling_info = {"reservoir_size": 1200, "events_seen": 4801}
+
+    first, second = split_sample_set(sampling_info, range(7))
+
+    assert first[1] == [0, 1, 2] and second[1] == [3, 4, 5, 6]
+    assert first[0]["events_seen"] + second[0]["events_seen"] == 4801
+    assert first[0]["reservoir_size"] + second[0]["reservoir_size"] == 1200
+    assert sampling_info == {"reservoir_size": 1200, "events_seen": 4801}
+
+
+@pytest.mark.parametrize("max_payload_size_in_bytes", (1000000, 1500))
+def test_oversized_events_split(session, collector, max_payload_size_in_bytes):
+    # Payloads are rejected either locally when exceeding the maximum
+    # payload size given by the data collector, or by the collector itself.
+
+    session = session(max_payload_size_in_bytes)
+    sampling_info = {"reservoir_size": 2000, "events_seen": 5000}
+    sample_set = events(50)
+
+    internal_metrics = CustomMetrics()
+    with InternalTraceContext(internal_metrics):
+        session.send_transaction_events(sampling_info, sample_set)
+
+    assert len(collector.requests) > 1
+
+    received = []
+    events_seen = reservoir_size = 0
+    for method, payload in collector.requests:
+        assert method == "analytic_event_data"
+        assert payload[0] == "1234567"
+        events_seen += payload[1]["events_seen"]
+        reservoir_size += payload[1]["reservoir_size"]
+        received.extend(payload[2])
+
+    assert received == sample_set
+    assert (events_seen, reservoir_size) == (5000, 2000)
+
+    metrics = dict(internal_metrics.metrics())
+    assert metrics["Supportability/Python/Collector/PayloadSplit/analytic_event_data"][0] >= 1
+
+
+def test_payload_not_split_when_within_limit(session, collector):
+    session = session()
+    session.send_span_events({"reservoir_size": 2000, "events_seen": 5}, events(5))
+
+    assert len(collector.requests) == 1
+
+
+def test_oversized_log_events_split(session, collector):
+    class LogEvent(dict):
+        def _asdict(self):
+            return self
+
+    session = session(1500)
+    log_events = [LogEvent(message=f"message {i}", padding="x" * 100) for i in range(30)]
+
+    session.send_log_events({"reservoir_size": 10000, "events_seen": 30}, log_events)
+
+    assert len(collector.requests) > 1
+
+    received = []
+    for method, payload in collector.requests:
+        assert method == "log_event_data"
+        received.extend(payload[0]["logs"])
+
+    assert received == log_events
+
+
+def test_single_oversized_event_discarded(session, collector):
+    session = session(100)
+
+    with pytest.raises(PayloadTooLarge):
+        session.send_custom_events({"reservoir_size": 100, "events_seen": 1}, events(1))
+
+    assert issubclass(PayloadTooLarge, DiscardDataForRequest)
+    assert not collector.requests
+
+
+@pytest.mark.parametrize("position", (0, 3, 7))
+def test_oversized_event_dropped_from_split(session, collector, position):
+    session = session(1500)
+    sample_set = events(7)
+    huge = [{"type": "Transaction", "name": "WebTransaction/Function/huge", "padding": "x" * 5000}, {}, {}]
+    sample_set.insert(position, huge)
+
+    internal_metrics = CustomMetrics()
+    with InternalTraceContext(internal_metrics):
+        session.send_transaction_events({"reservoir_size": 2000, "events_seen": 8}, sample_set)
+
+    received = []
+    for method, payload in collector.requests:
+        received.extend(payload[2])
+
+    sample_set.remove(huge)
+    assert received == sample_set
+
+    metrics = dict(internal_metrics.metrics())
+    assert metrics["Supportability/Python/Collector/PayloadDropped/analytic_event_data"][0] == 1
+
+
+def test_split_not_resent_after_partial_retry(session, collector):
+    # The whole payload is rejected as too large, then the first half is
+    # accepted and the second half fails with a 503.
+
+    session = session(1000000)
+    sample_set = events(20)
+    collector.httpd.statuses.extend([200, 503])
+
+    with pytest.raises(DiscardDataForRequest) as exc_info:
+        session.send_transaction_events({"reservoir_size": 2000, "events_seen": 20}, sample_set)
+
+    # Retrying would merge all the events back for the next harvest, and
+    # so send the first half again.
+
+    assert not isinstance(exc_info.value, RetryDataForRequest)
+
+    ((method, payload),) = collector.requests
+    assert payload[2] == sample_set[:10]
+
+
+def test_split_retried_when_nothing_sent(session, collector):
+    session = session(1000000)
+    collector.httpd.statuses.append(503)
+
+    with pytest.raises(RetryDataForRequest):
+        session.send_transaction_events({"reservoir_size": 2000, "events_seen": 20}, events(20))
+
+    assert not collector.requests
@@ -0,0 +1,138 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from newrelic.core.rules_engine import RulesEngine
+
+_rules = [
+    {
+        "match_expression": "^(.*)/[0-9]+$",
+        "replacement": "\\1/*",
+        "eval_order": 1,
+        "each_segment": False,
+        "ignore": False,
+        "terminate_chain": False,
+        "replace_all": False,
+    },
+    {
+        "match_expression": "^[a-f0-9]{8}$",
+        "replacement": "*",
+        "eval_order": 2,
+        "each_segment": True,
+        "ignore": False,
+        "terminate_chain": False,
+        "replace_all": False,
+    },
+    {
+        "match_expression": "^/healthcheck",
+        "replacement": "",
+        "eval_order": 3,
+        "each_segment": False,
+        "ignore": True,
+        "terminate_chain": True,
+        "replace_all": False,
+    },
+    {
+        "match_expression": "/\\*$",
+        "replacement": "/ID",
+        "eval_order": 4,
+        "each_segment": False,
+        "ignore": False,
+        "terminate_chain": False,
+        "replace_all": False,
+    },
+]
+
+_inputs = [
+    "",
+    "/",
+    "/users",
+    "/users/123",
+    "/users/deadbeef/items",
+    "/USERS/DEADBEEF",
+    "/healthcheck/status",
+    "/HealthCheck",
+    "users/deadbeef",
+    b"/users/123",
+    b"/caf\xe9/123",
+]
+
+
+@pytest.mark.parametrize("name", _inputs)
+def test_normalize_matches_uncached_rules(name):
+    rules_engine = RulesEngine(_rules)
+    expected_name = name.decode("Latin-1") if isinstance(name, bytes) else name
+
+    expected = RulesEngine(_rules)._normalize(expected_name)
+
+    assert rules_engine.normalize(name) == expected
+
+    # The second lookup is served from the cache.
+
+    assert rules_engine.normalize(name) == expected
+
+
+def test_normalize_chained_rules():
+    rules_engine = RulesEngine(_rules)
+
+    assert rules_engine.normalize("/users/123") == ("/users/ID", False)
+    assert rules_engine.normalize("/users/deadbeef/items") == ("/users/*/items", False)
+    assert rules_engine.normalize("/healthcheck/123") == ("/*", True)
+
+
+def test_normalize_unmatched_skips_rules():
+    rules_engine = RulesEngine(_rules)
+
+    def fail(string):
+        raise AssertionError(string)
+
+    rules_engine._normalize = fail
+
+    assert rules_engine.normalize("/users/abc") == ("/users/abc", False)
+
+
+@pytest.mark.parametrize(
+    "match_expression",
+    [
+        "(a)\\1",  # Back reference which would be renumbered.
+        "(?P<name>a)(?P=name)",  # Named back reference.
+    ],
+)
+def test_normalize_without_prefilter(match_expression):
+    rules = [
+        {
+            "match_expression": match_expression,
+            "replacement": "b",
+            "eval_order": 1,
+            "each_segment": False,
+            "ignore": False,
+            "terminate_chain": False,
+            "replace_all": False,
+        }
+    ]
+
+    rules_engine = RulesEngine(rules)
+
+    assert rules_engine.normalize("/aa") == ("/b", False)
+    assert rules_engine.normalize("/ab") == ("/ab", False)
+
+
+def test_normalize_cache_bounded():
+    rules_engine = RulesEngine(_rules, cache_size=10)
+
+    for index in range(25):
+        assert rules_engine.normalize(f"/users/{index}") == ("/users/ID", False)
+
+    assert len(rules_engine._RulesEngine__cache) <= 10
@@ -0,0 +1,90 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+import random
+
+import pytest
+
+from newrelic.core.stats_engine import SampledDataSet
+
+
+def _data_set(capacity, samples, start=0):
+    data_set = SampledDataSet(capacity=capacity)
+    for index in range(start, start + samples):
+        data_set.add(index, priority=random.random())  # nosec
+    return data_set
+
+
+def _add_one_at_a_time(data_set, other_data_set, priority=-1):
+    # Reference for a merge, adding the samples of the other data set one
+    # at a time as was done prior to bulk merging.
+    for original_priority, _, sample in other_data_set.pq:
+        data_set.add(sample, max(priority, original_priority))
+    data_set.num_seen += other_data_set.num_seen - other_data_set.num_samples
+
+
+@pytest.mark.parametrize(
+    "capacity,existing,merged",
+    [
+        (10, 0, 5),
+        (10, 5, 5),
+        (10, 8, 5),
+        (10, 10, 1),
+        (1000, 1000, 10),
+        (1000, 500, 2000),
+        (1000, 1000, 1000),
+    ],
+)
+@pytest.mark.parametrize("priority", (None, 0.5))
+def test_merge_keeps_highest_priority_samples(capacity, existing, merged, priority):
+    random.seed(capacity + existing + merged)
+
+    other = _data_set(merged, merged, start=existing)
+
+    data_set = _data_set(capacity, existing)
+    expected = copy.deepcopy(data_set)
+
+    data_set.merge(other, priority)
+    _add_one_at_a_time(expected, other, -1 if priority is None else priority)
+
+    assert data_set.num_seen == expected.num_seen == existing + merged
+    assert data_set.num_samples == expected.num_samples == min(capacity, existing + merged)
+    assert data_set.heap == expected.heap
+    assert sorted(data_set.samples) == sorted(expected.samples)
+    assert data_set.pq[0] == min(data_set.pq)
+
+
+def test_merge_after_other_data_set_overflowed():
+    other = _data_set(5, 20)
+
+    data_set = SampledDataSet(capacity=10)
+    data_set.merge(other)
+
+    assert data_set.num_seen == 20
+    assert data_set.num_samples == 5
+
+    for index in range(10):
+        data_set.add(index)
+
+    assert data_set.num_samples == 10
+    assert data_set.heap
+
+
+def test_merge_zero_capacity():
+    data_set = SampledDataSet(capacity=0)
+    data_set.merge(_data_set(5, 10))
+
+    assert data_set.num_seen == 10
+    assert data_set.num_samples == 0
@@ -0,0 +1,261 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+import time
+
+import newrelic.core.shared_metric_table as shared_metric_table
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.metric import ApdexMetric, TimeMetric
+from newrelic.core.shared_metric_table import SharedMetricTable
+from newrelic.core.stats_engine import (
+    ApdexStats,
+    CountStats,
+    MetricTable,
+    StatsEngine,
+    TimeStats,
+)
+
+
+def _populate(table):
+    table[("Apdex/a", "")] = ApdexStats(1, 0, 0, 0.5)
+    table[("Function/a", "")] = TimeStats(1, 2.0, 1.0, 2.0, 2.0, 4.0)
+    table[("Custom/count", "")] = CountStats(call_count=3)
+    return table
+
+
+def _metric_data(table):
+    return {(key["name"], key["scope"]): values for key, values in table.metric_data()}
+
+
+def test_merge_matches_metric_table():
+    expected = _populate(MetricTable())
+    expected.merge_table(_populate(MetricTable()))
+
+    table = SharedMetricTable(slots=16, stripes=2)
+    assert table.attach()
+
+    _populate(table)
+    table.merge_table(_populate(MetricTable()))
+
+    assert len(table) == 3
+    assert _metric_data(table) == _metric_data(expected)
+
+    table[("Function/a", "")].merge_time_metric(TimeMetric("Function/a", "", 1.0, 1.0))
+    assert table[("Function/a", "")].call_count == 3
+    assert table[("Function/a", "")].min_call_time == 1.0
+
+
+def test_harvest_clears_values():
+    table = SharedMetricTable(slots=16, stripes=2)
+    assert table.attach()
+
+    _populate(table)
+
+    assert _metric_data(table.harvest()) == _metric_data(_populate(MetricTable()))
+    assert not len(table.harvest())
+
+    # Metric names are retained across harvests.
+    assert ("Function/a", "") in table
+    assert table[("Function/a", "")].call_count == 0
+
+
+def test_metrics_from_forked_process():
+    table = SharedMetricTable(slots=16, stripes=2)
+    assert table.attach()
+
+    table.merge_stats(("Function/a", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            if table.attach():
+                table.merge_stats(("Function/a", ""), TimeStats(1, 2.0, 2.0, 2.0, 2.0, 4.0))
+                table.merge_stats(("Function/b", ""), TimeStats(1, 3.0, 3.0, 3.0, 3.0, 9.0))
+                status = 0
+        finally:
+            os._exit(status)
+
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+
+    assert _metric_data(table.harvest()) == {
+        ("Function/a", ""): [2, 3.0, 3.0, 1.0, 2.0, 5.0],
+        ("Function/b", ""): [1, 3.0, 3.0, 3.0, 3.0, 9.0],
+    }
+
+
+def test_only_elected_process_harvests():
+    table = SharedMetricTable(slots=16, stripes=2)
+    assert table.attach()
+
+    table.merge_stats(("Function/a", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    # Another live process holds the harvester role, so only metrics held
+    # locally are returned.
+    table._control[1] = os.getppid()
+
+    assert not len(table.harvest())
+
+    table._control[1] = 0
+
+    assert len(table.harvest()) == 1
+
+
+def test_overflow_held_locally():
+    table = SharedMetricTable(slots=2, stripes=1, key_size=16)
+    assert table.attach()
+
+    table.merge_stats(("Function/a", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/b", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/c", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/too-long-for-slot", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    assert len(table) == 4
+    assert table.usage() == (2, 2)
+    assert len(table.harvest()) == 4
+
+
+def test_no_stripe_available():
+    table = SharedMetricTable(slots=16, stripes=1)
+    table._owners[0] = os.getppid()
+
+    assert not table.attach()
+
+
+def test_stats_engine_shared_metric_data():
+    settings = finalize_application_settings({"agent_run_id": "1234567"})
+    table = SharedMetricTable(slots=16, stripes=2)
+
+    stats_engine = StatsEngine()
+    stats_engine.use_shared_metric_table(table)
+    stats_engine.reset_stats(settings)
+
+    assert stats_engine.stats_table is table
+
+    # Workareas for single transactions never use the shared table.
+    workarea = stats_engine.create_workarea()
+    assert isinstance(workarea.stats_table, dict)
+
+    workarea.record_time_metric(TimeMetric("Function/a", "", 2.0, 1.0))
+    workarea.record_apdex_metric(ApdexMetric("Apdex/a", 1, 0, 0, 0.5))
+    stats_engine.merge(workarea)
+
+    snapshot = stats_engine.harvest_snapshot()
+
+    assert stats_engine.stats_table is table
+    assert isinstance(snapshot.stats_table, MetricTable)
+    assert snapshot.stats_table is not table
+
+    assert _metric_data(snapshot) == {
+        ("Function/a", ""): [1, 2.0, 1.0, 2.0, 2.0, 4.0],
+        ("Apdex/a", ""): [1, 0, 0, 0.5, 0.5, 0],
+    }
+
+    # Rolling back the harvest returns the metrics to the shared table.
+    stats_engine.rollback(snapshot)
+
+    assert _metric_data(table.harvest()) == _metric_data(snapshot)
+
+
+def test_lock_released_when_holder_killed():
+    table = SharedMetricTable(slots=16, stripes=2)
+
+    read_fd, write_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            table._acquire()
+            os.write(write_fd, b"x")
+            time.sleep(60.0)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+
+    try:
+        # Wait for the child to be holding the lock.
+        assert os.read(read_fd, 1) == b"x"
+        assert not table._lock.acquire(0.01)
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(read_fd)
+
+    # The lock is released when the process holding it is killed, so the
+    # table can still be used by the other processes.
+
+    assert table.attach()
+    table.merge_stats(("Function/a", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    assert len(table.harvest()) == 1
+
+
+def test_overflowed_keys_not_probed_again(monkeypatch):
+    table = SharedMetricTable(slots=2, stripes=1, key_size=16)
+    assert table.attach()
+
+    table.merge_stats(("Function/a", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/b", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/c", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/too-long-for-slot", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    def _encode_key(key):
+        raise AssertionError(f"Slot looked up again for {key!r}")
+
+    monkeypatch.setattr(shared_metric_table, "_encode_key", _encode_key)
+
+    table.merge_stats(("Function/c", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+    table.merge_stats(("Function/too-long-for-slot", ""), TimeStats(1, 1.0, 1.0, 1.0, 1.0, 1.0))
+
+    assert table.usage() == (2, 2)
+    assert _metric_data(table.harvest())[("Function/c", "")][0] == 2
+
+
+def test_lock_backs_off_while_held():
+    table = SharedMetricTable(slots=16, stripes=2)
+
+    read_fd, write_fd = os.pipe()
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read_fd)
+            table._acquire()
+            os.write(write_fd, b"x")
+            time.sleep(60.0)
+        finally:
+            os._exit(0)
+
+    os.close(write_fd)
+
+    try:
+        assert os.read(read_fd, 1) == b"x"
+
+        # Waiting on the lock held by another process sleeps rather than
+        # using the CPU.
+
+        start, cpu_start = time.time(), time.process_time()
+        assert not table._lock.acquire(0.2)
+        elapsed, cpu_elapsed = time.time() - start, time.process_time() - cpu_start
+
+        assert elapsed >= 0.2
+        assert cpu_elapsed < elapsed / 2
+    finally:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+        os.close(read_fd)
@@ -0,0 +1,98 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.core.config import global_settings
+from newrelic.core.database_utils import SQLStatement
+
+settings = global_settings()
+
+
+class DummyDB():
+    quoting_style = "single"
+
+
+_collapsed_variants = [
+    (
+        "INSERT INTO users (name, age) VALUES ('a', 1)",
+        "INSERT INTO users (name, age) VALUES ('a', 1), ('b', 2), ('c', 3)",
+    ),
+    (
+        "INSERT INTO users (name, age) VALUES (%s, %s)",
+        "INSERT INTO users (name, age) VALUES (%s, %s), (%s, %s)",
+    ),
+    (
+        "SELECT * FROM users WHERE (name, age) IN (('a', 1))",
+        "SELECT * FROM users WHERE (name, age) IN (('a', 1), ('b', 2))",
+    ),
+    (
+        "UPDATE users SET tags = ARRAY['a'] WHERE id = 1",
+        "UPDATE users SET tags = ARRAY['a', 'b', 'c'] WHERE id = 2",
+    ),
+    (
+        "UPDATE users SET points = ARRAY[(1, 2)] WHERE id = 1",
+        "UPDATE users SET points = ARRAY[(1, 2), (3, 4)] WHERE id = 2",
+    ),
+    (
+        "insert into users (name) values ('a')",
+        "insert into users (name) values ('a'), ('b')",
+    ),
+]
+
+
+@pytest.mark.parametrize("sql_1,sql_2", _collapsed_variants)
+def test_fingerprint_collapses_variants(sql_1, sql_2):
+    statement_1 = SQLStatement(sql_1, DummyDB())
+    statement_2 = SQLStatement(sql_2, DummyDB())
+
+    assert statement_1.normalized != statement_2.normalized
+    assert statement_1.fingerprint == statement_2.fingerprint
+
+
+def test_fingerprint_keeps_distinct_statements():
+    statement_1 = SQLStatement("SELECT * FROM users WHERE id IN (1, 2)", DummyDB())
+    statement_2 = SQLStatement("SELECT * FROM orders WHERE id IN (1, 2)", DummyDB())
+
+    assert statement_1.fingerprint != statement_2.fingerprint
+
+
+@pytest.mark.parametrize(
+    "sql",
+    (
+        # Only lists of values following VALUES or IN are collapsed.
+        "SELECT COALESCE(a, b), (c) FROM users",
+        "SELECT f(1), (2) FROM users",
+        "select coalesce(?),(?) from t",
+    ),
+)
+def test_fingerprint_keeps_other_parentheses(sql):
+    statement = SQLStatement(sql, DummyDB())
+
+    assert statement.fingerprint == statement.normalized
+
+
+@pytest.mark.parametrize("fingerprint", (True, False))
+def test_identifier(fingerprint):
+    sql_1, sql_2 = _collapsed_variants[0]
+
+    @override_generic_settings(settings, {"slow_sql.fingerprint": fingerprint})
+    def _test():
+        statement_1 = SQLStatement(sql_1, DummyDB())
+        statement_2 = SQLStatement(sql_2, DummyDB())
+
+        assert (statement_1.identifier == statement_2.identifier) == fingerprint
+
+    _test()
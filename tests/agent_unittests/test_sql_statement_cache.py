@@ -0,0 +1,100 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+
+import pytest
+from testing_support.fixtures import override_generic_settings
+
+from newrelic.core.config import global_settings
+from newrelic.core.database_utils import SQLStatementCache, _sql_statements, sql_statement
+
+settings = global_settings()
+
+
+class DummyDBAPI2Module():
+    _nr_quoting_style = "single"
+
+
+@pytest.fixture(autouse=True)
+def clear_sql_statements():
+    _sql_statements.clear()
+    yield
+    _sql_statements.clear()
+
+
+def test_statement_kept_after_references_dropped():
+    statement = sql_statement("SELECT * FROM users WHERE id = 1", DummyDBAPI2Module)
+    assert statement.obfuscated == "SELECT * FROM users WHERE id = ?"
+
+    statement_id = id(statement)
+    del statement
+    gc.collect()
+
+    statement = sql_statement("SELECT * FROM users WHERE id = 1", DummyDBAPI2Module)
+    assert id(statement) == statement_id
+    assert statement._obfuscated == "SELECT * FROM users WHERE id = ?"
+
+
+def test_statement_keyed_on_dbapi2_module():
+    class OtherDBAPI2Module():
+        _nr_quoting_style = "single+double"
+
+    statement = sql_statement('SELECT "a"', DummyDBAPI2Module)
+    other_statement = sql_statement('SELECT "a"', OtherDBAPI2Module)
+
+    assert statement is not other_statement
+    assert statement.obfuscated == 'SELECT "a"'
+    assert other_statement.obfuscated == "SELECT ?"
+
+
+@override_generic_settings(settings, {"agent_limits.sql_statement_cache_entries": 2})
+def test_least_recently_used_evicted():
+    first = sql_statement("SELECT 1", DummyDBAPI2Module)
+    second = sql_statement("SELECT 2", DummyDBAPI2Module)
+
+    # Use the first statement again so the second is least recently used.
+    assert sql_statement("SELECT 1", DummyDBAPI2Module) is first
+
+    sql_statement("SELECT 3", DummyDBAPI2Module)
+
+    assert len(_sql_statements) == 2
+    assert sql_statement("SELECT 1", DummyDBAPI2Module) is first
+    assert sql_statement("SELECT 2", DummyDBAPI2Module) is not second
+
+
+@override_generic_settings(settings, {"agent_limits.sql_statement_cache_bytes": 20})
+def test_bounded_by_size():
+    cache = SQLStatementCache()
+
+    for i in range(5):
+        cache.put(i, sql_statement(f"SELECT {i:04}", DummyDBAPI2Module))
+
+    # Each statement is 11 characters, so only one fits.
+    assert len(cache) == 1
+    assert cache.size == 11
+    assert cache.get(4) is not None
+
+    # A statement which is larger than the cache is not kept.
+    cache.put(5, sql_statement("SELECT * FROM large_table", DummyDBAPI2Module))
+    assert cache.get(5) is None
+    assert len(cache) == 1
+
+
+@override_generic_settings(settings, {"agent_limits.sql_statement_cache_entries": 0})
+def test_cache_disabled():
+    statement = sql_statement("SELECT 1", DummyDBAPI2Module)
+
+    assert len(_sql_statements) == 0
+    assert sql_statement("SELECT 1", DummyDBAPI2Module) is not statement
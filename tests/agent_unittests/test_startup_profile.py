@@ -0,0 +1,68 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import types
+
+import pytest
+
+import newrelic.core.startup_profile as startup_profile
+from newrelic.config import _module_import_hook
+from newrelic.core.startup_profile import (
+    StartupTrace,
+    harvest_startup_timings,
+    startup_timings,
+)
+
+
+@pytest.fixture(autouse=True)
+def empty_startup_profile(monkeypatch):
+    monkeypatch.setattr(startup_profile, "_timings", {})
+    monkeypatch.setattr(startup_profile, "_pending", [])
+
+
+def test_startup_trace_records_first_only():
+    with StartupTrace("stage"):
+        pass
+
+    ((name, first),) = startup_timings()
+    assert name == "stage"
+    assert first >= 0.0
+
+    with StartupTrace("stage"):
+        pass
+
+    assert startup_timings() == [("stage", first)]
+
+
+def test_harvest_startup_timings():
+    with StartupTrace("one"):
+        pass
+
+    assert [name for name, _ in harvest_startup_timings()] == ["one"]
+    assert harvest_startup_timings() == []
+
+    with StartupTrace("two"):
+        pass
+
+    assert [name for name, _ in harvest_startup_timings()] == ["two"]
+    assert [name for name, _ in startup_timings()] == ["one", "two"]
+
+
+def test_import_hook_recorded():
+    target = types.ModuleType("_test_startup_profile")
+
+    _module_import_hook("_test_startup_profile", "newrelic.core.startup_profile", "startup_timings")(target)
+
+    assert [name for name, _ in startup_timings()] == [
+        "ImportHook/_test_startup_profile/newrelic.core.startup_profile:startup_timings"
+    ]
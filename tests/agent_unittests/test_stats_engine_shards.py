@@ -0,0 +1,52 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import threading
+
+from newrelic.core.config import finalize_application_settings
+from newrelic.core.stats_engine import StatsEngine, StatsEngineShards
+
+
+def _record(stats_shards, end_time):
+    shard = stats_shards.shard()
+    with shard.lock:
+        workarea = shard.stats.create_workarea()
+        workarea.record_custom_metric("Function/a", 1.0)
+        shard.stats.merge(workarea)
+        shard.transaction_count += 1
+        shard.last_transaction = end_time
+
+
+def test_transaction_stats_and_fold():
+    settings = finalize_application_settings({"agent_run_id": "1234567"})
+
+    stats_shards = StatsEngineShards(2)
+    stats_shards.reset_stats(settings)
+
+    _record(stats_shards, 10.0)
+
+    thread = threading.Thread(target=_record, args=(stats_shards, 20.0))
+    thread.start()
+    thread.join()
+
+    # Transactions recorded into the shards are visible before a harvest.
+
+    assert stats_shards.transaction_stats() == (2, 20.0)
+
+    stats_engine = StatsEngine()
+    stats_engine.reset_stats(settings)
+
+    assert stats_shards.fold(stats_engine) == (2, 0)
+    assert stats_engine.stats_table[("Function/a", "")][0] == 2
+
+    assert stats_shards.transaction_stats() == (0, 0.0)
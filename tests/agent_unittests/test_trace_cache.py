@@ -12,11 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import contextvars
+import sys
 import threading
 
 import pytest
 
-from newrelic.core.trace_cache import TraceCache
+from newrelic.api.function_trace import FunctionTrace
+from newrelic.core.trace_cache import ContextVarTraceCache, TraceCache, current_task
 
 _TEST_CONCURRENT_ITERATION_TC_SIZE = 20
 
@@ -127,3 +131,153 @@ def test_concurrent_iteration(iterate_trace_cache, change_weakref_dict_size):
     t2.join(timeout=1)
     assert not t1.is_alive(), "Thread failed to exit."
     assert not t2.is_alive(), "Thread failed to exit."
+
+
+def test_current_task_without_running_loop():
+    assert current_task(asyncio) is None
+
+    async def _task():
+        return current_task(asyncio)
+
+    loop = asyncio.new_event_loop()
+    try:
+        assert loop.run_until_complete(_task()) is not None
+    finally:
+        loop.close()
+
+
+def test_current_thread_id_in_plain_thread(trace_cache):
+    assert trace_cache.current_thread_id() == threading.get_ident()
+
+
+def test_slotted_trace_attributes():
+    trace = FunctionTrace("name")
+
+    # Attributes are held in slots, but others can still be added.
+    assert not trace.__dict__
+    trace._task = None
+    assert trace.__dict__ == {"_task": None}
+
+
+def _trace(thread_id, parent=None):
+    trace = DummyTrace()
+    trace.thread_id = thread_id
+    trace.parent = parent
+    trace.root = parent.root if parent else trace
+    trace.exited = False
+    return trace
+
+
+def test_save_trace_without_current_frames(trace_cache, monkeypatch):
+    def _current_frames():
+        raise AssertionError("sys._current_frames() called")
+
+    monkeypatch.setattr(sys, "_current_frames", _current_frames)
+
+    root = _trace(trace_cache.current_thread_id())
+    trace_cache.save_trace(root)
+    assert root._greenlet is None
+    assert not hasattr(root, "_task")
+
+    async def _task():
+        root = _trace(trace_cache.current_thread_id())
+        trace_cache.save_trace(root)
+
+        child = _trace(trace_cache.current_thread_id(), parent=root)
+        trace_cache.save_trace(child)
+
+        return root, child
+
+    trace_cache.asyncio = asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        root, child = loop.run_until_complete(_task())
+    finally:
+        loop.close()
+
+    assert root._task is not None
+    assert child._task is root._task
+
+
+def test_save_trace_with_patched_get_ident(trace_cache, monkeypatch):
+    # When gevent has monkey patched the thread module, get_ident() returns
+    # the ID of the current greenlet, which is also what current_thread_id()
+    # returns when running in a greenlet.
+
+    import newrelic.core.trace_cache as trace_cache_module
+
+    class Greenlet():
+        def __init__(self, parent=None):
+            self.parent = parent
+
+    hub = Greenlet()
+    current = Greenlet(parent=hub)
+
+    class GreenletModule():
+        @staticmethod
+        def getcurrent():
+            return current
+
+    monkeypatch.setattr(trace_cache_module.thread, "get_ident", lambda: id(GreenletModule.getcurrent()))
+    trace_cache.greenlet = GreenletModule
+
+    root = _trace(trace_cache.current_thread_id())
+    trace_cache.save_trace(root)
+    assert root._greenlet() is current
+
+    child = _trace(trace_cache.current_thread_id(), parent=root)
+    trace_cache.save_trace(child)
+    assert child._greenlet is root._greenlet
+
+    # The root greenlet is never treated as being a greenlet.
+
+    current = hub
+
+    trace = _trace(trace_cache.current_thread_id())
+    trace_cache.save_trace(trace)
+    assert trace._greenlet is None
+
+
+def test_context_var_trace_cache_propagation():
+    trace_cache = ContextVarTraceCache()
+    trace_cache.asyncio = asyncio
+
+    root = _trace(trace_cache.current_thread_id())
+    trace_cache.save_trace(root)
+    assert trace_cache.current_trace() is root
+
+    # Threads run within a copy of the context see the current trace.
+
+    results = []
+    context = contextvars.copy_context()
+    thread = threading.Thread(target=context.run, args=(lambda: results.append(trace_cache.current_trace()),))
+    thread.start()
+    thread.join()
+
+    assert results == [root]
+
+    # Tasks see the current trace without it being stored against them,
+    # and traces saved within them are not current for the parent.
+
+    async def _task():
+        assert trace_cache.current_trace() is root
+
+        child = _trace(trace_cache.current_thread_id(), parent=root)
+        trace_cache.save_trace(child)
+        assert trace_cache.current_trace() is child
+
+        trace_cache.pop_current(child)
+        assert trace_cache.current_trace() is root
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_task())
+    finally:
+        loop.close()
+
+    assert trace_cache.current_trace() is root
+    assert list(trace_cache.values()) == [root]
+
+    trace_cache.complete_root(root)
+    assert trace_cache.current_trace() is None
+    assert not trace_cache
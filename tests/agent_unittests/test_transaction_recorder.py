@@ -0,0 +1,138 @@
+# Copyright 2010 New Relic, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import pytest
+
+from newrelic.core.transaction_recorder import TransactionRecorder
+
+
+class BlockingRecord():
+    def __init__(self):
+        self.recorded = []
+        self.threads = []
+        self.release = threading.Event()
+
+    def __call__(self, transaction):
+        self.threads.append(threading.current_thread())
+        self.release.wait(5.0)
+        self.recorded.append(transaction)
+
+
+def test_records_on_background_thread():
+    record = BlockingRecord()
+    record.release.set()
+
+    recorder = TransactionRecorder(record, "test")
+
+    for i in range(10):
+        assert recorder.put(i)
+
+    assert recorder.flush(timeout=5.0)
+    assert record.recorded == list(range(10))
+    assert threading.current_thread() not in record.threads
+
+    queued, dropped, inline, _ = recorder.stats()
+    assert (queued, dropped, inline) == (10, 0, 0)
+
+    recorder.shutdown()
+
+
+@pytest.mark.parametrize(
+    "overflow_policy,expected_stats",
+    [
+        ("drop", (2, 2, 0)),
+        ("block", (2, 2, 0)),
+        ("inline", (2, 0, 2)),
+    ],
+)
+def test_overflow_policy(overflow_policy, expected_stats):
+    record = BlockingRecord()
+    recorder = TransactionRecorder(record, "test", queue_size=2, overflow_policy=overflow_policy, block_timeout=0.01)
+
+    if overflow_policy == "inline":
+        # Recording done on this thread must not wait on the event.
+        def inline_record(transaction):
+            if threading.current_thread() is main_thread:
+                record.recorded.append(transaction)
+            else:
+                record(transaction)
+
+        main_thread = threading.current_thread()
+        recorder._record = inline_record
+
+    results = [recorder.put(i) for i in range(4)]
+
+    assert results == [True, True, overflow_policy == "inline", overflow_policy == "inline"]
+
+    record.release.set()
+    assert recorder.flush(timeout=5.0)
+
+    queued, dropped, inline, max_depth = recorder.stats()
+    assert (queued, dropped, inline) == expected_stats
+    assert max_depth == 2
+
+    recorder.shutdown()
+
+
+def test_unknown_overflow_policy():
+    recorder = TransactionRecorder(lambda transaction: None, "test", overflow_policy="unknown")
+    assert recorder.overflow_policy == "drop"
+
+
+def test_flush_timeout():
+    record = BlockingRecord()
+    recorder = TransactionRecorder(record, "test")
+
+    recorder.put(1)
+
+    assert not recorder.flush(timeout=0.01)
+    assert len(recorder) == 1
+
+    record.release.set()
+    assert recorder.flush(timeout=5.0)
+    assert len(recorder) == 0
+
+    recorder.shutdown()
+
+
+def test_put_after_shutdown():
+    record = BlockingRecord()
+    record.release.set()
+
+    recorder = TransactionRecorder(record, "test")
+    recorder.shutdown()
+
+    assert not recorder.put(1)
+    assert not record.recorded
+
+
+def test_record_failure_does_not_stop_worker():
+    recorded = []
+
+    def record(transaction):
+        if transaction == 0:
+            raise ValueError(transaction)
+        recorded.append(transaction)
+
+    recorder = TransactionRecorder(record, "test")
+
+    recorder.put(0)
+    recorder.put(1)
+
+    assert recorder.flush(timeout=5.0)
+    assert recorded == [1]
+
+    recorder.shutdown()